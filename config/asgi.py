@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Start planning worker processes (when PLANNING_EXECUTOR uses them) before the first request
+from routes.planning import warm_planner  # noqa: E402
+
+warm_planner()
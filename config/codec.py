@@ -0,0 +1,142 @@
+import datetime
+import decimal
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # stdlib codec only
+    orjson = None
+
+# Raised by loads() for malformed input whichever codec is active (orjson's error subclasses it)
+JSONDecodeError = json.JSONDecodeError
+
+
+class Fragment:
+    """
+    Already serialized JSON, inserted verbatim by dumps_fragments()
+    """
+
+    __slots__ = ("json",)
+
+    def __init__(self, json_bytes):
+        self.json = json_bytes
+
+
+def _default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, Fragment):
+        return json.loads(obj.json)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class _StdlibCodec:
+    name = "stdlib"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"), default=_default, ensure_ascii=False)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class _OrjsonCodec:
+    name = "orjson"
+
+    _options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=_default, option=self._options)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+_codecs = {}
+
+
+def get_codec():
+    """
+    Codec selected by settings.JSON_CODEC: 'orjson', 'stdlib' or 'auto' (orjson when installed)
+    """
+    setting = getattr(settings, "JSON_CODEC", "auto")
+    codec = _codecs.get(setting)
+    if codec is None:
+        name = ("orjson" if orjson is not None else "stdlib") if setting == "auto" else setting
+        if name == "orjson":
+            if orjson is None:
+                raise ImproperlyConfigured("JSON_CODEC = 'orjson' but orjson is not installed")
+            codec = _OrjsonCodec()
+        elif name == "stdlib":
+            codec = _StdlibCodec()
+        else:
+            raise ImproperlyConfigured(f"Unknown JSON_CODEC {setting!r}, expected 'auto', 'orjson' or 'stdlib'")
+        _codecs[setting] = codec
+    return codec
+
+
+def dumps(obj):
+    """
+    Compact UTF-8 JSON bytes. Handles NumPy scalars and arrays, Decimal and dates.
+    """
+    return get_codec().dumps(obj)
+
+
+def loads(data):
+    """
+    Parse JSON from bytes or str without an intermediate decode. Raises JSONDecodeError.
+    """
+    return get_codec().loads(data)
+
+
+def dumps_indented(obj, indent):
+    """
+    Pretty-printed JSON bytes (browsable API, debugging), Fragments expanded
+    """
+    return json.dumps(obj, indent=indent, default=_default, ensure_ascii=False).encode("utf-8")
+
+
+def _spliced(value):
+    return isinstance(value, Fragment) or (
+        isinstance(value, (list, tuple)) and len(value) > 0 and isinstance(value[0], Fragment)
+    )
+
+
+def dumps_fragments(obj):
+    """
+    dumps() that splices Fragment values in verbatim instead of re-encoding
+    them: at the top level, as values of the top-level dict, or as the items
+    of a list whose first item is a Fragment. Fragments anywhere else are
+    still encoded correctly, just not for free.
+    """
+    if isinstance(obj, Fragment):
+        return obj.json
+    if isinstance(obj, (list, tuple)) and _spliced(obj):
+        return b"[" + b",".join(item.json if isinstance(item, Fragment) else dumps(item) for item in obj) + b"]"
+    if isinstance(obj, dict) and any(_spliced(v) for v in obj.values()):
+        return b"{" + b",".join(dumps(str(k)) + b":" + dumps_fragments(v) for k, v in obj.items()) + b"}"
+    return dumps(obj)
+
+
+class JSONBytesResponse(HttpResponse):
+    """
+    JsonResponse counterpart serialized with the fast codec (dict or list data, Fragments allowed)
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps_fragments(data), **kwargs)
@@ -0,0 +1,166 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Correlation ID of the request being handled, '-' outside requests
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# Whether this request's debug/info trace is kept (see SamplingFilter)
+sampled_var = contextvars.ContextVar("log_sampled", default=True)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps every record with the current request's correlation ID
+    """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drops DEBUG and INFO records of requests that were not sampled.
+
+    The decision is made once per request (RequestIdMiddleware), so a
+    sampled request keeps its whole trace. Warnings and errors always pass.
+    """
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or sampled_var.get()
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, request_id, message and
+    any fields passed with `extra=`.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class _DrainingListener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # The queue may be full of records; the listener thread is draining it, so wait for room
+        self.queue.put(self._sentinel)
+
+
+class QueuedStreamHandler(QueueHandler):
+    """
+    Non-blocking handler: records go on a bounded queue and a background
+    thread writes them to `stream`.
+
+    The request thread only resolves the message; formatting and I/O happen
+    on the listener thread. When the queue is full records are dropped
+    (counted in `dropped`) rather than stalling the request.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self.listener = _DrainingListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        # dictConfig sets the formatter here, but it's the listener side that formats
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:  # not already closed
+            listener.stop()
+        super().close()
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+def _begin(request):
+    incoming = request.headers.get(REQUEST_ID_HEADER, "")
+    request_id = incoming if _VALID_REQUEST_ID.match(incoming) else new_request_id()
+    request_id_var.set(request_id)
+    sampled_var.set(random.random() < getattr(settings, "LOG_SAMPLE_RATE", 1.0))
+    request.request_id = request_id
+    return request_id
+
+
+class RequestIdMiddleware:
+    """
+    Assigns each request a correlation ID (the caller's X-Request-ID when it
+    is well formed, else a new one), decides log sampling for it, and echoes
+    the ID back in the response header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id = _begin(request)
+        response = self.get_response(request)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id = _begin(request)
+        response = await self.get_response(request)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
@@ -0,0 +1,322 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse, JsonResponse
+
+# Seconds, from sub-millisecond index lookups up to the ORS timeout
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        """
+        Child metric for one combination of label values
+        """
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.label_names)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.expose(self.name, self.label_names, key))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def expose(self, name, names, key):
+        return [f"{name}{_label_text(names, key)} {_number(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate of the q-quantile by linear interpolation inside the bucket
+        (the same estimate Prometheus' histogram_quantile() makes)
+        """
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def expose(self, name, names, key):
+        with self._lock:
+            counts, total, sum_ = list(self.counts), self.count, self.sum
+        lines, cumulative = [], 0
+        for bound, n in zip(self.bounds + (float("inf"),), counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_label_text(names, key, [('le', _number(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_label_text(names, key)} {_number(sum_)}")
+        lines.append(f"{name}_count{_label_text(names, key)} {total}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def summary(self):
+        """
+        {label values: {'count', 'sum', 'p50', 'p95', 'p99'}} for every child
+        """
+        out = {}
+        for key, child in sorted(self._children.items()):
+            entry = {"count": child.count, "sum": round(child.sum, 6)}
+            for q in QUANTILES:
+                value = child.quantile(q)
+                entry[f"p{int(q * 100)}"] = None if value is None else round(value, 6)
+            out[",".join(key) or "-"] = entry
+        return out
+
+
+class Registry:
+    """
+    Process-wide set of metrics plus collectors that produce samples at scrape time
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        `collector()` returns [(name, kind, help, {label: value} or None, value), ...]
+        and is called on every scrape, for values owned by other components.
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def _collected(self):
+        grouped = {}
+        for collector in list(self._collectors):
+            for name, kind, help_text, labels, value in collector():
+                grouped.setdefault(name, (kind, help_text, []))[2].append((labels or {}, value))
+        return grouped
+
+    def expose(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            lines.extend(metric.expose())
+        for name, (kind, help_text, samples) in sorted(self._collected().items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        JSON-friendly view: histogram quantiles, counter/gauge values, collected samples
+        """
+        out = {}
+        for name, metric in sorted(self._metrics.items()):
+            if isinstance(metric, Histogram):
+                out[name] = metric.summary()
+            else:
+                out[name] = {",".join(k) or "-": child.value for k, child in sorted(metric._children.items())}
+        for name, (_, _, samples) in sorted(self._collected().items()):
+            out[name] = {",".join(str(v) for v in labels.values()) or "-": value for labels, value in samples}
+        return out
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "fuelroute_stage_seconds", "Time spent in each request stage", labels=("stage",),
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "fuelroute_http_request_seconds", "Request latency by view, method and status",
+    labels=("view", "method", "status"),
+)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the enclosed block into fuelroute_stage_seconds{stage=...}
+    """
+    child = STAGE_SECONDS.labels(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        child.observe(time.perf_counter() - started)
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match.route or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Records request latency into fuelroute_http_request_seconds, labelled by
+    the resolved view name (not the raw path) to keep cardinality bounded.
+    For streamed responses this is the time to the first byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._async = iscoroutinefunction(get_response)
+        if self._async:
+            markcoroutinefunction(self)
+
+    def _record(self, request, response, started):
+        HTTP_SECONDS.labels(_view_name(request), request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+
+    def __call__(self, request):
+        if self._async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, started)
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition, or p50/p95/p99 summaries with ?format=json
+    """
+    if request.GET.get("format") == "json":
+        return JsonResponse(REGISTRY.snapshot())
+    return HttpResponse(REGISTRY.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,40 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from config import codec
+
+# U+2028/U+2029 are valid JSON but not valid JavaScript, DRF escapes them
+_LINE_SEPARATORS = ((b"\xe2\x80\xa8", b"\\u2028"), (b"\xe2\x80\xa9", b"\\u2029"))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on the config.codec fast path: compact bytes straight from
+    the codec, with codec.Fragment values spliced in unencoded. Indented
+    output (browsable API, `; indent=` media types) uses the stdlib.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        body = codec.dumps_fragments(data) if indent is None else codec.dumps_indented(data, indent)
+        for raw, escaped in _LINE_SEPARATORS:
+            if raw in body:
+                body = body.replace(raw, escaped)
+        return body
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser that hands the raw request bytes to the codec, skipping the text decode
+    """
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return codec.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
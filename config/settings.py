@@ -1,3 +1,4 @@
+import logging
 import os
 from pathlib import Path
 from decouple import Config, RepositoryEnv
@@ -13,9 +14,8 @@ config = Config(repository=RepositoryEnv(env_path))
 # Load Environment Variables
 try:
     ORS_API_KEY = config('ORS_API_KEY')
-    print("[+] ORS_API_KEY loaded:", ORS_API_KEY[:5], "...")
 except Exception as e:
-    print("[-] Failed to load ORS_API_KEY:", e)
+    logging.getLogger('config').warning("ORS_API_KEY not configured: %s", e)
     ORS_API_KEY = ''
 
 SECRET_KEY = config('DJANGO_SECRET_KEY', default='django-insecure-change-me-now')
@@ -38,6 +38,8 @@ INSTALLED_APPS = [
 
 # Middleware Stack
 MIDDLEWARE = [
+    'config.log.RequestIdMiddleware',
+    'config.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,5 +98,133 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Fuel station data
+FUEL_PRICES_CSV = BASE_DIR / 'data' / 'fuel_prices.csv'
+FUEL_STATION_COORDS_CSV = BASE_DIR / 'data' / 'station_coords.csv'
+# Compiled binary station table (manage.py build_station_snapshot), mapped instead of parsing the CSV
+FUEL_STATION_SNAPSHOT = config('FUEL_STATION_SNAPSHOT', default=str(BASE_DIR / 'data' / 'stations.snapshot'))
+# Price kept when the CSV lists a station more than once: 'min', 'latest' or 'mean'
+FUEL_PRICE_POLICY = config('FUEL_PRICE_POLICY', default='min')
+# 'csv' reads FUEL_PRICES_CSV, 'datalake' reads the LatestPrice snapshot
+FUEL_STATION_SOURCE = config('FUEL_STATION_SOURCE', default='csv')
+FUEL_SNAPSHOT_POLL_SECONDS = config('FUEL_SNAPSHOT_POLL_SECONDS', cast=float, default=5)
+# /api/fuel-prices/ responses: Cache-Control max-age and cached pages per station table
+FUEL_PRICE_CACHE = {
+    'MAX_AGE_SECONDS': config('FUEL_PRICE_CACHE_MAX_AGE_SECONDS', cast=int, default=60),
+    'MAX_ENTRIES': config('FUEL_PRICE_CACHE_MAX_ENTRIES', cast=int, default=2048),
+}
+
+# OpenRouteService HTTP clients (pooled requests.Session / httpx.AsyncClient)
+ORS_BASE_URL = config('ORS_BASE_URL', default='https://api.openrouteservice.org')
+ORS_HTTP = {
+    'TIMEOUT': config('ORS_TIMEOUT_SECONDS', cast=float, default=30),
+    'MAX_CONNECTIONS': 20,
+    'MAX_KEEPALIVE': 10,
+    'KEEPALIVE_EXPIRY': 30,
+    'MAX_CONCURRENCY': config('ORS_MAX_CONCURRENCY', cast=int, default=50),
+    'PER_HOST_LIMIT': 20,
+}
+
+# ORS quota, circuit breaker and request coalescing (routes.resilience)
+ORS_RESILIENCE = {
+    'RATE_PER_SECOND': config('ORS_RATE_PER_MINUTE', cast=float, default=40) / 60,
+    'BURST': config('ORS_RATE_BURST', cast=int, default=10),
+    'MAX_WAIT_SECONDS': 5.0,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_SECONDS': 30.0,
+    'COALESCE': True,
+}
+
+# Routing backend: 'ors' (OpenRouteService API) or 'local' (in-process A* over ROUTE_GRAPH_DIR)
+ROUTING_BACKEND = config('ROUTING_BACKEND', default='ors')
+ROUTE_GRAPH_DIR = BASE_DIR / 'data' / 'road_graph'
+ROUTE_GRAPH_MAX_SNAP_MILES = config('ROUTE_GRAPH_MAX_SNAP_MILES', cast=float, default=50)
+
+# Batch route costing (/routes/calculate-route-batch/)
+ROUTE_BATCH_MAX_LANES = config('ROUTE_BATCH_MAX_LANES', cast=int, default=1000)
+ROUTE_BATCH_CONCURRENCY = config('ROUTE_BATCH_CONCURRENCY', cast=int, default=8)
+# Multi-stop routes (waypoints between start and end) and /routes/cost-matrix/ size
+ROUTE_MAX_WAYPOINTS = config('ROUTE_MAX_WAYPOINTS', cast=int, default=25)
+ROUTE_MATRIX_MAX_CELLS = config('ROUTE_MATRIX_MAX_CELLS', cast=int, default=2500)
+
+# Route sessions (/routes/sessions/): in-process, re-planned on position and fuel updates
+ROUTE_SESSIONS = {
+    'TTL_SECONDS': config('ROUTE_SESSION_TTL_SECONDS', cast=int, default=6 * 3600),
+    'MAX_SESSIONS': config('ROUTE_SESSION_MAX', cast=int, default=10000),
+    'REROUTE_MILES': config('ROUTE_SESSION_REROUTE_MILES', cast=float, default=10),
+}
+
+# Fuel planning executor (routes.planning): 'inline' in the request thread, or a 'thread'/'process'
+# pool admitting at most MAX_PENDING jobs (default 2 x WORKERS); callers waiting longer than
+# QUEUE_TIMEOUT_SECONDS for a slot get a 503
+PLANNING_EXECUTOR = {
+    'MODE': config('PLANNING_EXECUTOR', default='inline'),
+    'WORKERS': config('PLANNING_WORKERS', cast=int, default=os.cpu_count() or 1),
+    'MAX_PENDING': config('PLANNING_MAX_PENDING', cast=int, default=0) or None,
+    'QUEUE_TIMEOUT_SECONDS': config('PLANNING_QUEUE_TIMEOUT_SECONDS', cast=float, default=5),
+    'START_METHOD': config('PLANNING_START_METHOD', default='spawn'),
+    'SHARED_MEMORY_MIN_POINTS': config('PLANNING_SHARED_MEMORY_MIN_POINTS', cast=int, default=2000),
+}
+
+# Douglas-Peucker tolerance for the map_route polyline in responses
+ROUTE_MAP_TOLERANCE_MILES = config('ROUTE_MAP_TOLERANCE_MILES', cast=float, default=0.5)
+# route-geometry responses with more vertices than this are streamed, this many at a time
+ROUTE_GEOMETRY_CHUNK_POINTS = config('ROUTE_GEOMETRY_CHUNK_POINTS', cast=int, default=5000)
+
+# Route cache (SQLite file shared by routes.views and routes.services)
+ROUTE_CACHE = {
+    'PATH': BASE_DIR / 'route_cache.sqlite3',
+    'TTL_SECONDS': config('ROUTE_CACHE_TTL_SECONDS', cast=int, default=7 * 24 * 3600),
+    'MAX_ENTRIES': config('ROUTE_CACHE_MAX_ENTRIES', cast=int, default=10000),
+    'PRECISION': 3,
+    'STALE_SECONDS': config('ROUTE_CACHE_STALE_SECONDS', cast=int, default=30 * 24 * 3600),
+}
+
+# JSON codec for API bodies (config.codec): 'auto' uses orjson when installed, else the stdlib
+JSON_CODEC = config('JSON_CODEC', default='auto')
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'config.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'config.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Logging: JSON lines (or plain text) written off the request thread by
+# config.log.QueuedStreamHandler. LOG_SAMPLE_RATE is the share of requests
+# whose DEBUG/INFO trace is kept; warnings and errors are always logged.
+LOG_LEVEL = config('LOG_LEVEL', default='DEBUG' if DEBUG else 'INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='text' if DEBUG else 'json')
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', cast=float, default=1.0 if DEBUG else 0.05)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'config.log.RequestIdFilter'},
+        'sampling': {'()': 'config.log.SamplingFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'config.log.StructuredFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+    },
+    'handlers': {
+        'queued': {
+            '()': 'config.log.QueuedStreamHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['request_id', 'sampling'],
+        },
+    },
+    'root': {'handlers': ['queued'], 'level': 'WARNING'},
+    'loggers': {
+        'django': {'handlers': ['queued'], 'level': 'INFO', 'propagate': False},
+        **{app: {'handlers': ['queued'], 'level': LOG_LEVEL, 'propagate': False}
+           for app in ('config', 'fuel', 'datalake', 'routes')},
+    },
+}
+
 # Default Auto Field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
@@ -1,10 +1,11 @@
-print("[+] config.urls.py loaded")
-
 from django.contrib import admin
 from django.urls import path, include
+from config.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('routes/', include('routes.urls')),
+    path('api/', include('fuel.urls')),
+    path('metrics', metrics_view, name='metrics'),
    # path('fuel/', include('datalake.urls')),
-]
\ No newline at end of file
+]
@@ -1,4 +1,27 @@
 from django.contrib import admin
-from .models import FuelPrice
+from .models import LatestPrice, PriceObservation, PriceSnapshot, Station
 
-admin.site.register(FuelPrice)
\ No newline at end of file
+@admin.register(Station)
+class StationAdmin(admin.ModelAdmin):
+    list_display = ('opis_id', 'name', 'city', 'state', 'rack_id')
+    list_filter = ('state',)
+    search_fields = ('name', 'city', 'opis_id')
+
+
+@admin.register(PriceObservation)
+class PriceObservationAdmin(admin.ModelAdmin):
+    list_display = ('station', 'fuel_type', 'date', 'price')
+    list_filter = ('fuel_type', 'date')
+    raw_id_fields = ('station',)
+
+
+@admin.register(LatestPrice)
+class LatestPriceAdmin(admin.ModelAdmin):
+    list_display = ('station', 'fuel_type', 'price', 'date', 'version')
+    list_filter = ('fuel_type',)
+    raw_id_fields = ('station',)
+
+
+@admin.register(PriceSnapshot)
+class PriceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('version', 'refreshed_at')
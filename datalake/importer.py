@@ -0,0 +1,170 @@
+import csv
+import datetime
+import time
+
+from django.db import transaction
+
+from datalake.models import PriceObservation, Station
+from datalake.snapshot import refresh_latest_prices
+from fuel.canonical import PriceMerger
+from fuel.geocoding import load_gazetteer, load_station_coords, locate_station, placed
+
+DEFAULT_BATCH_SIZE = 2000
+STATION_FIELDS = ['name', 'address', 'city', 'state', 'rack_id', 'latitude', 'longitude']
+
+
+class ImportStats:
+    __slots__ = ('read', 'written', 'skipped', 'changed', 'batches', 'started', 'elapsed')
+
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.skipped = 0
+        self.changed = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_date(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.date.fromisoformat(value.strip()[:10])
+    except ValueError:
+        return None
+
+
+class RowConverter:
+    """
+    Turns CSV rows into (Station, PriceObservation) pairs, attaching
+    coordinates from the station coordinate cache and bundled gazetteer
+    (none when the station is only located to its state).
+    """
+
+    def __init__(self, default_date, fuel_type):
+        self.default_date = default_date
+        self.fuel_type = fuel_type
+        self.cached = load_station_coords()
+        self.gazetteer = load_gazetteer()
+
+    def __call__(self, row):
+        """
+        (station, observation) for one CSV row, or None when the row has no
+        station ID, price or valid date
+        """
+        opis_id = _int_or_none(row.get('OPIS Truckstop ID'))
+        try:
+            price = float(row.get('Retail Price') or '')
+        except ValueError:
+            return None
+        price_date = _parse_date(row.get('Date'), self.default_date)
+        if opis_id is None or price <= 0 or price_date is None:
+            return None
+
+        address = (row.get('Address') or '').strip()[:255]
+        city = (row.get('City') or '').strip()[:100]
+        state = (row.get('State') or '').strip().upper()[:2]
+        point = locate_station(opis_id, address, city, state, self.cached, self.gazetteer)
+        if not placed(point):
+            point = None
+
+        station = Station(
+            opis_id=opis_id,
+            name=(row.get('Truckstop Name') or '').strip()[:255],
+            address=address,
+            city=city,
+            state=state,
+            rack_id=_int_or_none(row.get('Rack ID')),
+            latitude=point[0] if point else None,
+            longitude=point[1] if point else None,
+        )
+        observation = PriceObservation(
+            station_id=opis_id,
+            date=price_date,
+            price=price,
+            fuel_type=(row.get('Fuel Type') or self.fuel_type).strip()[:50],
+        )
+        return station, observation
+
+
+def _write_batch(stations, observations):
+    with transaction.atomic():
+        Station.objects.bulk_create(
+            stations.values(),
+            update_conflicts=True,
+            unique_fields=['opis_id'],
+            update_fields=STATION_FIELDS,
+        )
+        PriceObservation.objects.bulk_create(
+            observations.values(),
+            update_conflicts=True,
+            unique_fields=['station', 'fuel_type', 'date'],
+            update_fields=['price'],
+        )
+        return refresh_latest_prices(observations.values())
+
+
+def import_fuel_prices(stream, default_date=None, fuel_type='Diesel', batch_size=DEFAULT_BATCH_SIZE, progress=None,
+                       price_policy=None):
+    """
+    Stream CSV rows from a text file object into Station and PriceObservation.
+
+    Stations are upserted on OPIS Truckstop ID and prices on (station, fuel
+    type, date), in bulk batches of `batch_size` with one transaction each,
+    so re-running an import is idempotent and memory stays bounded by one
+    batch whatever the file size. A 'Date' column, when present, overrides
+    `default_date` (today). Repeated rows for the same station and day are
+    collapsed into one observation priced by `price_policy` (min, latest or
+    mean, default settings.FUEL_PRICE_POLICY). A repeat that lands in the
+    next batch is merged with the price already written for that key, so
+    duplicates at most one batch apart merge as if they had shared one.
+    Each batch also refreshes the LatestPrice snapshot for the stations it
+    touched; stats.changed counts the snapshot rows that actually moved.
+    `progress(stats)` is called after every batch. Returns ImportStats.
+    """
+    convert = RowConverter(default_date or datetime.date.today(), fuel_type)
+    stats = ImportStats()
+    stations, observations = {}, {}
+    merger = PriceMerger(price_policy)
+
+    def flush():
+        if observations:
+            stats.changed += _write_batch(stations, observations)
+            stats.written += len(observations)
+            stats.batches += 1
+            stations.clear()
+            observations.clear()
+            merger.rotate()
+            stats.elapsed = time.perf_counter() - stats.started
+            if progress:
+                progress(stats)
+
+    for row in csv.DictReader(stream):
+        stats.read += 1
+        converted = convert(row)
+        if converted is None:
+            stats.skipped += 1
+            continue
+        station, observation = converted
+        key = (station.opis_id, observation.fuel_type, observation.date)
+        if len(observations) >= batch_size and key not in observations:
+            flush()
+        observation.price = merger.add(key, observation.price)
+        stations.setdefault(station.opis_id, station)
+        observations[key] = observation
+    flush()
+
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
@@ -1,24 +1,56 @@
-import csv
-from datetime import datetime
-from django.core.management.base import BaseCommand
-from datalake.models import FuelPrice
+import datetime
+import io
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from datalake.importer import DEFAULT_BATCH_SIZE, import_fuel_prices
+from fuel.canonical import PRICE_POLICIES
 
 class Command(BaseCommand):
-    help = 'Imports fuel price data from CSV file into the database'
+    help = 'Imports fuel price data from a CSV file (or - for stdin) into the database'
 
-    def handle(self, *args, **kwargs):
-        with open('datalake/fuel_prices.csv', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                # Check if price exists before trying to convert
-                if row['Retail Price']:
-                    try:
-                        FuelPrice.objects.create(
-                            station_name = row['Truckstop Name'],
-                            fuel_type = 'Diesel',
-                            price = float(row['Retail Price']),
-                            date = datetime.today().date()
-                        )
-                    except Exception as e:
-                        print(f"Skipping row due to error: {e}")
-        self.stdout.write(self.style.SUCCESS('Fuel data imported successfully.'))
\ No newline at end of file
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=None, help='CSV file to import, - for stdin (default: FUEL_PRICES_CSV)')
+        parser.add_argument('--date', default=None, help='Price date (YYYY-MM-DD) for rows without a Date column, default today')
+        parser.add_argument('--fuel-type', default='Diesel')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--price-policy', choices=PRICE_POLICIES, default=None,
+                            help='How duplicate rows for one station are priced (default: FUEL_PRICE_POLICY)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or str(settings.FUEL_PRICES_CSV)
+        try:
+            price_date = datetime.date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError:
+            raise CommandError(f"Invalid --date {options['date']!r}, expected YYYY-MM-DD")
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def progress(stats):
+            if stats.batches % 50 == 0:
+                self.stdout.write(f"  {stats.read} rows read, {stats.rows_per_second:,.0f} rows/sec")
+
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+            stats = self._import(stream, price_date, options, progress)
+        else:
+            try:
+                with open(path, newline='', encoding='utf-8') as csvfile:
+                    stats = self._import(csvfile, price_date, options, progress)
+            except OSError as e:
+                raise CommandError(f"Could not read {path}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Fuel data imported successfully: {stats.read} rows read, {stats.written} upserted, '
+            f'{stats.skipped} skipped in {stats.elapsed:.2f}s ({stats.rows_per_second:,.0f} rows/sec)'
+        ))
+
+    def _import(self, stream, price_date, options, progress):
+        return import_fuel_prices(
+            stream,
+            default_date=price_date,
+            fuel_type=options['fuel_type'],
+            batch_size=options['batch_size'],
+            progress=progress,
+            price_policy=options['price_policy'],
+        )
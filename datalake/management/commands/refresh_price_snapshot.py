@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from datalake.models import LatestPrice
+from datalake.snapshot import rebuild_latest_prices
+
+class Command(BaseCommand):
+    help = 'Rebuilds the LatestPrice snapshot from the full price history'
+
+    def handle(self, *args, **options):
+        version = rebuild_latest_prices()
+        self.stdout.write(self.style.SUCCESS(
+            f'Price snapshot rebuilt: {LatestPrice.objects.count()} rows at version {version}'
+        ))
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.5 on 2026-10-18 12:46
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datalake', '0002_alter_fuelprice_date_alter_fuelprice_fuel_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fuelprice',
+            name='address',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='fuelprice',
+            name='city',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='fuelprice',
+            name='opis_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fuelprice',
+            name='rack_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fuelprice',
+            name='state',
+            field=models.CharField(blank=True, default='', max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='fuelprice',
+            name='date',
+            field=models.DateField(default=datetime.date.today),
+        ),
+        migrations.AddConstraint(
+            model_name='fuelprice',
+            constraint=models.UniqueConstraint(fields=('opis_id', 'date'), name='fuelprice_unique_station_date'),
+        ),
+    ]
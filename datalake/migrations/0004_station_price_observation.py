@@ -0,0 +1,151 @@
+# Generated by Django 5.0.5 on 2026-10-18 12:47
+
+import datetime
+import logging
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def latest_per_key(rows, key):
+    """
+    Last row of each run of equal `key(row)` in `rows`, which come sorted by key then id
+    """
+    previous = None
+    for row in rows:
+        if previous is not None and key(row) != key(previous):
+            yield previous
+        previous = row
+    if previous is not None:
+        yield previous
+
+
+def copy_fuel_prices(apps, schema_editor):
+    """
+    Split FuelPrice rows into Station and PriceObservation.
+
+    Station details come from each station's most recent row. Rows without
+    an OPIS ID (imported before 0003) are tied to a station by name when
+    exactly one OPIS ID carries that name; the rest can't be placed and are
+    dropped, and their count is logged. Of several rows for the same
+    station, fuel type and date, the one with the latest id is kept.
+    """
+    FuelPrice = apps.get_model('datalake', 'FuelPrice')
+    Station = apps.get_model('datalake', 'Station')
+    PriceObservation = apps.get_model('datalake', 'PriceObservation')
+
+    stations = {}
+    names = defaultdict(set)
+    rows = FuelPrice.objects.filter(opis_id__isnull=False)
+    for row in rows.order_by('date', 'id').iterator(chunk_size=2000):
+        stations[row.opis_id] = Station(
+            opis_id=row.opis_id,
+            name=row.station_name,
+            address=row.address,
+            city=row.city,
+            state=row.state,
+            rack_id=row.rack_id,
+        )
+        names[row.station_name].add(row.opis_id)
+    Station.objects.bulk_create(stations.values(), batch_size=2000)
+    by_name = {name: ids.pop() for name, ids in names.items() if len(ids) == 1}
+
+    def write(observations, **conflicts):
+        batch = []
+        for observation in observations:
+            batch.append(observation)
+            if len(batch) >= 2000:
+                PriceObservation.objects.bulk_create(batch, **conflicts)
+                batch = []
+        PriceObservation.objects.bulk_create(batch, **conflicts)
+
+    # Unidentified rows first: they predate every identified one, so on a clash the identified row
+    # written after them (with the later id) wins
+    dropped = 0
+    unidentified = FuelPrice.objects.filter(opis_id__isnull=True).order_by('station_name', 'fuel_type', 'date', 'id')
+    matched = []
+    for row in latest_per_key(unidentified.iterator(chunk_size=2000), lambda r: (r.station_name, r.fuel_type, r.date)):
+        if row.station_name in by_name:
+            matched.append(PriceObservation(
+                station_id=by_name[row.station_name], date=row.date, price=row.price, fuel_type=row.fuel_type,
+            ))
+        else:
+            dropped += 1
+    write(matched)
+    if dropped:
+        logger.warning(
+            "Dropped %d FuelPrice rows without an OPIS ID whose station name matches no single station", dropped,
+        )
+
+    identified = rows.order_by('opis_id', 'fuel_type', 'date', 'id').iterator(chunk_size=2000)
+    write(
+        (
+            PriceObservation(station_id=row.opis_id, date=row.date, price=row.price, fuel_type=row.fuel_type)
+            for row in latest_per_key(identified, lambda r: (r.opis_id, r.fuel_type, r.date))
+        ),
+        update_conflicts=True, unique_fields=['station', 'fuel_type', 'date'], update_fields=['price'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datalake', '0003_fuelprice_station_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(default=datetime.date.today)),
+                ('price', models.FloatField()),
+                ('fuel_type', models.CharField(default='Diesel', max_length=50)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Station',
+            fields=[
+                ('opis_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('address', models.CharField(blank=True, default='', max_length=255)),
+                ('city', models.CharField(blank=True, default='', max_length=100)),
+                ('state', models.CharField(blank=True, default='', max_length=2)),
+                ('rack_id', models.IntegerField(blank=True, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='station',
+            index=models.Index(fields=['state', 'city'], name='station_state_city'),
+        ),
+        migrations.AddIndex(
+            model_name='station',
+            index=models.Index(fields=['latitude', 'longitude'], name='station_lat_lon'),
+        ),
+        migrations.AddField(
+            model_name='priceobservation',
+            name='station',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='datalake.station'),
+        ),
+        migrations.AddIndex(
+            model_name='priceobservation',
+            index=models.Index(fields=['station', 'fuel_type', '-date'], name='price_station_latest'),
+        ),
+        migrations.AddIndex(
+            model_name='priceobservation',
+            index=models.Index(fields=['fuel_type', 'date', 'price'], name='price_fuel_date_price'),
+        ),
+        migrations.AddConstraint(
+            model_name='priceobservation',
+            constraint=models.UniqueConstraint(fields=('station', 'fuel_type', 'date'), name='price_unique_station_fuel_date'),
+        ),
+        migrations.RunPython(copy_fuel_prices, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='FuelPrice',
+        ),
+    ]
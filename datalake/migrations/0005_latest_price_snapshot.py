@@ -0,0 +1,68 @@
+# Generated by Django 5.0.5 on 2026-10-18 12:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def build_latest_prices(apps, schema_editor):
+    """
+    Materialise the latest observation per (station, fuel type) as snapshot version 1,
+    picked in one query with ROW_NUMBER over each pair's history
+    """
+    PriceObservation = apps.get_model('datalake', 'PriceObservation')
+    LatestPrice = apps.get_model('datalake', 'LatestPrice')
+    PriceSnapshot = apps.get_model('datalake', 'PriceSnapshot')
+
+    PriceSnapshot.objects.create(pk=1, version=1)
+    latest = (
+        PriceObservation.objects
+        .annotate(rank=Window(RowNumber(), partition_by=[F('station_id'), F('fuel_type')], order_by=F('date').desc()))
+        .filter(rank=1)
+        .values_list('station_id', 'fuel_type', 'price', 'date')
+    )
+    batch = []
+    for station_id, fuel_type, price, date in latest.iterator(chunk_size=2000):
+        batch.append(LatestPrice(station_id=station_id, fuel_type=fuel_type, price=price, date=date, version=1))
+        if len(batch) >= 2000:
+            LatestPrice.objects.bulk_create(batch)
+            batch = []
+    LatestPrice.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datalake', '0004_station_price_observation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LatestPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fuel_type', models.CharField(default='Diesel', max_length=50)),
+                ('price', models.FloatField()),
+                ('date', models.DateField()),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='latest_prices', to='datalake.station')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fuel_type', 'price'], name='latest_fuel_price')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='latestprice',
+            constraint=models.UniqueConstraint(fields=('station', 'fuel_type'), name='latest_unique_station_fuel'),
+        ),
+        migrations.RunPython(build_latest_prices, migrations.RunPython.noop),
+    ]
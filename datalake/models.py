@@ -1,7 +1,74 @@
+import datetime
 from django.db import models
 
-class FuelPrice(models.Model):
-    station_name = models.CharField(max_length=255)
-    fuel_type = models.CharField(max_length=50, default='Diesel')  # hardcoded value
+class Station(models.Model):
+    opis_id = models.IntegerField(primary_key=True)  # OPIS Truckstop ID
+    name = models.CharField(max_length=255)
+    address = models.CharField(max_length=255, blank=True, default='')
+    city = models.CharField(max_length=100, blank=True, default='')
+    state = models.CharField(max_length=2, blank=True, default='')
+    rack_id = models.IntegerField(null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'city'], name='station_state_city'),
+            # Bounding box lookups: range on latitude, then longitude
+            models.Index(fields=['latitude', 'longitude'], name='station_lat_lon'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.city}, {self.state})"
+
+
+class PriceObservation(models.Model):
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='prices')
+    date = models.DateField(default=datetime.date.today)
     price = models.FloatField()
-    date = models.DateField(auto_now_add=True)  # use today's date
\ No newline at end of file
+    fuel_type = models.CharField(max_length=50, default='Diesel')
+
+    class Meta:
+        constraints = [
+            # One price per station, fuel and day: re-importing a file updates instead of duplicating
+            models.UniqueConstraint(fields=['station', 'fuel_type', 'date'], name='price_unique_station_fuel_date'),
+        ]
+        indexes = [
+            # Latest price per station
+            models.Index(fields=['station', 'fuel_type', '-date'], name='price_station_latest'),
+            # Cheapest prices on a day
+            models.Index(fields=['fuel_type', 'date', 'price'], name='price_fuel_date_price'),
+        ]
+
+    def __str__(self):
+        return f"{self.station_id} {self.fuel_type} {self.date}: {self.price}"
+
+
+class LatestPrice(models.Model):
+    """
+    Materialised latest PriceObservation per station and fuel type.
+
+    Kept current by the importer (datalake.snapshot.refresh_latest_prices)
+    so "current price" reads never need a GROUP BY over the history.
+    """
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='latest_prices')
+    fuel_type = models.CharField(max_length=50, default='Diesel')
+    price = models.FloatField()
+    date = models.DateField()
+    version = models.PositiveIntegerField(default=0)  # snapshot version that last changed this row
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'fuel_type'], name='latest_unique_station_fuel'),
+        ]
+        indexes = [
+            models.Index(fields=['fuel_type', 'price'], name='latest_fuel_price'),
+        ]
+
+
+class PriceSnapshot(models.Model):
+    """
+    Single row holding the LatestPrice snapshot version, bumped on every change
+    """
+    version = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
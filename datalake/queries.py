@@ -0,0 +1,39 @@
+from django.db.models import F
+
+from datalake.models import Station
+
+DEFAULT_FUEL_TYPE = 'Diesel'
+
+
+def stations_with_latest_price(fuel_type=DEFAULT_FUEL_TYPE):
+    """
+    Stations annotated with latest_price / latest_date from the LatestPrice
+    snapshot (a single join, no per-station history lookup). Stations
+    without a price are left out.
+    """
+    return (
+        Station.objects
+        .filter(latest_prices__fuel_type=fuel_type)
+        .annotate(latest_price=F('latest_prices__price'), latest_date=F('latest_prices__date'))
+    )
+
+
+def cheapest_in_state(state, fuel_type=DEFAULT_FUEL_TYPE, limit=10):
+    """
+    Cheapest stations in a state by latest price
+    """
+    return (
+        stations_with_latest_price(fuel_type)
+        .filter(state=state.upper())
+        .order_by('latest_price')[:limit]
+    )
+
+
+def stations_in_bbox(min_lat, min_lon, max_lat, max_lon):
+    """
+    Stations inside a latitude/longitude bounding box (uses the (latitude, longitude) index)
+    """
+    return Station.objects.filter(
+        latitude__gte=min_lat, latitude__lte=max_lat,
+        longitude__gte=min_lon, longitude__lte=max_lon,
+    )
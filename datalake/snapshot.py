@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from datalake.models import LatestPrice, PriceObservation, PriceSnapshot
+
+SNAPSHOT_ID = 1
+
+
+def snapshot_version():
+    """
+    Current LatestPrice snapshot version (0 before anything was imported)
+    """
+    return PriceSnapshot.objects.filter(pk=SNAPSHOT_ID).values_list('version', flat=True).first() or 0
+
+
+def _bump_version():
+    snapshot, created = PriceSnapshot.objects.get_or_create(pk=SNAPSHOT_ID, defaults={'version': 1})
+    if not created:
+        PriceSnapshot.objects.filter(pk=SNAPSHOT_ID).update(version=F('version') + 1)
+        snapshot.refresh_from_db()
+    return snapshot.version
+
+
+def refresh_latest_prices(observations):
+    """
+    Fold freshly written PriceObservations into the LatestPrice snapshot.
+
+    Only (station, fuel type) pairs whose latest price or date actually
+    changed are written, and the snapshot version is bumped once when any
+    did. Must run in the same transaction as the observation writes.
+    Returns the number of snapshot rows changed.
+    """
+    newest = {}
+    for obs in observations:
+        key = (obs.station_id, obs.fuel_type)
+        current = newest.get(key)
+        if current is None or obs.date >= current.date:
+            newest[key] = obs
+    if not newest:
+        return 0
+
+    existing = {}
+    for fuel_type in {key[1] for key in newest}:
+        station_ids = [key[0] for key in newest if key[1] == fuel_type]
+        for row in LatestPrice.objects.filter(fuel_type=fuel_type, station_id__in=station_ids):
+            existing[(row.station_id, fuel_type)] = row
+
+    changed = []
+    for key, obs in newest.items():
+        row = existing.get(key)
+        if row is not None and (obs.date < row.date or (obs.date == row.date and obs.price == row.price)):
+            continue
+        changed.append(LatestPrice(station_id=key[0], fuel_type=key[1], price=obs.price, date=obs.date))
+    if not changed:
+        return 0
+
+    version = _bump_version()
+    for row in changed:
+        row.version = version
+    LatestPrice.objects.bulk_create(
+        changed,
+        update_conflicts=True,
+        unique_fields=['station', 'fuel_type'],
+        update_fields=['price', 'date', 'version'],
+    )
+    return len(changed)
+
+
+def latest_observations():
+    """
+    (station_id, fuel_type, price, date) of the newest PriceObservation per
+    station and fuel type, in a single query (ROW_NUMBER over each pair's
+    history, newest first)
+    """
+    return (
+        PriceObservation.objects
+        .annotate(rank=Window(RowNumber(), partition_by=[F('station_id'), F('fuel_type')], order_by=F('date').desc()))
+        .filter(rank=1)
+        .values_list('station_id', 'fuel_type', 'price', 'date')
+    )
+
+
+def rebuild_latest_prices(batch_size=2000):
+    """
+    Recompute the whole snapshot from PriceObservation (for repairs).
+    Returns the new snapshot version.
+    """
+    with transaction.atomic():
+        LatestPrice.objects.all().delete()
+        version = _bump_version()
+        batch = []
+        for station_id, fuel_type, price, date in latest_observations().iterator(chunk_size=batch_size):
+            batch.append(LatestPrice(
+                station_id=station_id, fuel_type=fuel_type, price=price, date=date, version=version,
+            ))
+            if len(batch) >= batch_size:
+                LatestPrice.objects.bulk_create(batch)
+                batch = []
+        LatestPrice.objects.bulk_create(batch)
+    return version
+
+
+def snapshot_rows(fuel_type='Diesel'):
+    """
+    (version, rows) where rows are the current snapshot joined with station
+    details, read inside one transaction so version and rows agree.
+    """
+    with transaction.atomic():
+        version = snapshot_version()
+        rows = list(
+            LatestPrice.objects
+            .filter(fuel_type=fuel_type)
+            .order_by('station_id')
+            .values_list(
+                'station_id', 'station__name', 'station__address', 'station__city', 'station__state',
+                'station__rack_id', 'price', 'station__latitude', 'station__longitude',
+            )
+        )
+    return version, rows
+
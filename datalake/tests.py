@@ -1,3 +1,247 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from datalake.importer import import_fuel_prices
+from datalake.models import LatestPrice, PriceObservation, Station
+from datalake.snapshot import rebuild_latest_prices, refresh_latest_prices, snapshot_version
+from fuel import stations as station_module
+
+HEADER = "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price,Date\n"
+
+
+def price_csv(rows):
+    """
+    CSV text with the import header for (opis_id, price, date) rows
+    """
+    return HEADER + "".join(
+        f"{opis_id},STOP {opis_id},I-{opis_id} EXIT 1,Dallas,TX,1,{price},{date}\n" for opis_id, price, date in rows
+    )
+
+
+def history(stations, days, start=datetime.date(2024, 1, 1)):
+    # Date-ordered history: every station once per day
+    return [
+        (opis_id, 3.0 + opis_id / 100 + day / 1000, start + datetime.timedelta(days=day))
+        for day in range(days) for opis_id in range(1, stations + 1)
+    ]
+
+
+class ImporterTests(TestCase):
+    def test_batches_stay_bounded_on_date_ordered_history(self):
+        written = [0]
+        stats = import_fuel_prices(
+            io.StringIO(price_csv(history(10, 30))), batch_size=50,
+            progress=lambda stats: written.append(stats.written),
+        )
+        self.assertEqual(stats.written, 300)
+        self.assertEqual([b - a for a, b in zip(written, written[1:])], [50] * 6)
+        self.assertEqual(PriceObservation.objects.count(), 300)
+
+    def test_duplicates_across_a_batch_boundary_are_merged(self):
+        day = datetime.date(2024, 1, 1)
+        # Station 1's repeat comes after the first batch of two was written
+        rows = [(1, 3.5, day), (2, 3.0, day), (3, 3.2, day), (1, 3.1, day)]
+        stats = import_fuel_prices(io.StringIO(price_csv(rows)), batch_size=2, price_policy='min')
+        self.assertEqual(stats.batches, 2)
+        self.assertEqual(PriceObservation.objects.get(station_id=1).price, 3.1)
+
+        import_fuel_prices(io.StringIO(price_csv(rows)), batch_size=2, price_policy='mean')
+        self.assertAlmostEqual(PriceObservation.objects.get(station_id=1).price, 3.3)
+
+    def test_reimport_is_idempotent(self):
+        text = price_csv(history(5, 4))
+        first = import_fuel_prices(io.StringIO(text), batch_size=7)
+        version = snapshot_version()
+        second = import_fuel_prices(io.StringIO(text), batch_size=3)
+        self.assertEqual((first.read, first.written), (second.read, second.written))
+        self.assertEqual(Station.objects.count(), 5)
+        self.assertEqual(PriceObservation.objects.count(), 20)
+        # Nothing moved, so the snapshot stays at the same version
+        self.assertEqual(second.changed, 0)
+        self.assertEqual(snapshot_version(), version)
+
+    def test_invalid_rows_are_skipped(self):
+        text = price_csv([(1, 3.0, "2024-01-01"), (2, "n/a", "2024-01-01"), (3, 3.0, "yesterday"), (4, -1, "")])
+        text += ",NO ID,,Dallas,TX,,3.0,2024-01-01\n"
+        stats = import_fuel_prices(io.StringIO(text))
+        self.assertEqual((stats.read, stats.written, stats.skipped), (5, 1, 4))
+
+    def test_rows_without_a_date_use_the_default(self):
+        text = price_csv([(1, 3.0, "")])
+        import_fuel_prices(io.StringIO(text), default_date=datetime.date(2024, 5, 1))
+        self.assertEqual(PriceObservation.objects.get().date, datetime.date(2024, 5, 1))
+
+
+class LoadFuelDataCommandTests(TestCase):
+    def test_imports_a_path(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(price_csv(history(3, 2)))
+        self.addCleanup(os.unlink, f.name)
+        out = io.StringIO()
+        call_command('load_fuel_data', f.name, stdout=out)
+        self.assertIn("6 rows read, 6 upserted, 0 skipped", out.getvalue())
+        self.assertEqual(PriceObservation.objects.count(), 6)
+
+    def test_dash_reads_stdin(self):
+        stdin = io.TextIOWrapper(io.BytesIO(price_csv(history(2, 2)).encode()))
+        with mock.patch('sys.stdin', stdin):
+            call_command('load_fuel_data', '-', stdout=io.StringIO())
+        self.assertEqual(PriceObservation.objects.count(), 4)
+
+    def test_missing_file_is_a_command_error(self):
+        with self.assertRaisesMessage(CommandError, "Could not read"):
+            call_command('load_fuel_data', '/nonexistent/prices.csv', stdout=io.StringIO())
+
+    def test_invalid_date_is_a_command_error(self):
+        with self.assertRaisesMessage(CommandError, "Invalid --date"):
+            call_command('load_fuel_data', '-', '--date', '01/02/2024', stdout=io.StringIO())
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        Station.objects.bulk_create([Station(opis_id=i, name=f"STOP {i}") for i in (1, 2)])
+        self.day = datetime.date(2024, 1, 2)
+        self.assertEqual(refresh_latest_prices([self.observation(1, 3.0), self.observation(2, 3.5)]), 2)
+        self.version = snapshot_version()
+
+    def observation(self, opis_id, price, date=None):
+        return PriceObservation(station_id=opis_id, price=price, date=date or self.day)
+
+    def latest(self):
+        return {row.station_id: (row.price, row.date, row.version) for row in LatestPrice.objects.all()}
+
+    def test_only_changed_stations_are_written(self):
+        changed = refresh_latest_prices([self.observation(1, 3.0), self.observation(2, 3.4)])
+        self.assertEqual(changed, 1)
+        self.assertEqual(snapshot_version(), self.version + 1)
+        self.assertEqual(self.latest(), {1: (3.0, self.day, self.version), 2: (3.4, self.day, self.version + 1)})
+
+    def test_older_observation_is_ignored(self):
+        older = self.day - datetime.timedelta(days=1)
+        self.assertEqual(refresh_latest_prices([self.observation(1, 2.0, older)]), 0)
+        self.assertEqual(snapshot_version(), self.version)
+        self.assertEqual(self.latest()[1], (3.0, self.day, self.version))
+
+    def test_equal_price_is_a_no_op(self):
+        self.assertEqual(refresh_latest_prices([self.observation(1, 3.0), self.observation(2, 3.5)]), 0)
+        self.assertEqual(snapshot_version(), self.version)
+
+    def test_newer_date_moves_the_snapshot(self):
+        newer = self.day + datetime.timedelta(days=1)
+        self.assertEqual(refresh_latest_prices([self.observation(1, 3.0, newer)]), 1)
+        self.assertEqual(self.latest()[1], (3.0, newer, self.version + 1))
+
+    def test_newest_of_a_batch_wins(self):
+        newer = self.day + datetime.timedelta(days=1)
+        refresh_latest_prices([self.observation(2, 3.9, newer), self.observation(2, 3.1)])
+        self.assertEqual(self.latest()[2], (3.9, newer, self.version + 1))
+
+    def test_rebuild_takes_the_newest_price_in_constant_queries(self):
+        def rebuild():
+            with CaptureQueriesContext(connection) as queries:
+                version = rebuild_latest_prices()
+            return version, len(queries)
+
+        import_fuel_prices(io.StringIO(price_csv(history(3, 5))))
+        LatestPrice.objects.all().delete()
+        version, few = rebuild()
+        self.assertEqual(snapshot_version(), version)
+        self.assertEqual(self.latest()[2], (3.0 + 2 / 100 + 4 / 1000, datetime.date(2024, 1, 5), version))
+
+        import_fuel_prices(io.StringIO(price_csv(history(40, 5))))
+        _, many = rebuild()
+        self.assertEqual(many, few)
+        self.assertEqual(LatestPrice.objects.count(), 40)
+
+
+@override_settings(FUEL_STATION_SOURCE='datalake', FUEL_SNAPSHOT_POLL_SECONDS=60)
+class DatalakeStationTableTests(TestCase):
+    def setUp(self):
+        self.clock = [1000.0]
+        for patch in (
+            mock.patch.object(station_module, '_table', None),
+            mock.patch.object(station_module, '_snapshot_checked', 0.0),
+            mock.patch.object(station_module.time, 'monotonic', lambda: self.clock[0]),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        import_fuel_prices(io.StringIO(price_csv([(1, 3.0, "2024-01-01"), (2, 3.5, "2024-01-01")])))
+
+    def test_table_follows_the_snapshot_version(self):
+        table = station_module.get_station_table()
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.mtime, ('datalake', snapshot_version()))
+
+        import_fuel_prices(io.StringIO(price_csv([(3, 3.2, "2024-01-01")])))
+        # Within the poll interval the cached table is served without touching the database
+        self.clock[0] += 30
+        with self.assertNumQueries(0):
+            self.assertIs(station_module.get_station_table(), table)
+
+        self.clock[0] += 31
+        reloaded = station_module.get_station_table()
+        self.assertEqual(len(reloaded), 3)
+        self.assertEqual(reloaded.mtime, ('datalake', snapshot_version()))
+
+    def test_unchanged_version_keeps_the_table(self):
+        table = station_module.get_station_table()
+        self.clock[0] += 61
+        self.assertIs(station_module.get_station_table(), table)
+
+
+class MigrationTests(TransactionTestCase):
+    before = [('datalake', '0003_fuelprice_station_fields')]
+    after = [('datalake', '0005_latest_price_snapshot')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_fuel_prices_are_split_into_stations_and_observations(self):
+        apps = self.migrate(self.before)
+        FuelPrice = apps.get_model('datalake', 'FuelPrice')
+        day = datetime.date(2024, 1, 1)
+        FuelPrice.objects.bulk_create([
+            # Before 0003: no OPIS IDs
+            FuelPrice(station_name="STOP 1", price=3.0, date=day),
+            FuelPrice(station_name="SHARED", price=3.0, date=day),
+            FuelPrice(station_name="UNKNOWN", price=3.0, date=day),
+            FuelPrice(station_name="STOP 1", price=3.1, date=day + datetime.timedelta(days=1)),
+            # After 0003
+            FuelPrice(station_name="STOP 1", opis_id=1, state="TX", price=3.2, date=day + datetime.timedelta(days=1)),
+            FuelPrice(station_name="STOP 1", opis_id=1, state="TX", price=3.3, date=day + datetime.timedelta(days=2)),
+            FuelPrice(station_name="SHARED", opis_id=2, price=3.4, date=day),
+            FuelPrice(station_name="SHARED", opis_id=3, price=3.5, date=day),
+        ])
+
+        with self.assertLogs('datalake.migrations.0004_station_price_observation', 'WARNING') as logs:
+            apps = self.migrate(self.after)
+        self.assertIn("Dropped 2 FuelPrice rows", logs.output[0])
+        Station = apps.get_model('datalake', 'Station')
+        PriceObservation = apps.get_model('datalake', 'PriceObservation')
+        LatestPrice = apps.get_model('datalake', 'LatestPrice')
+        self.assertEqual(sorted(Station.objects.values_list('opis_id', flat=True)), [1, 2, 3])
+        self.assertEqual(Station.objects.get(pk=1).state, "TX")
+        # The unambiguous legacy row is kept, the later identified row wins the clash on day 2,
+        # and the ambiguous and unknown names are dropped
+        self.assertEqual(
+            list(PriceObservation.objects.filter(station_id=1).order_by('date').values_list('date', 'price')),
+            [(day, 3.0), (day + datetime.timedelta(days=1), 3.2), (day + datetime.timedelta(days=2), 3.3)],
+        )
+        self.assertEqual(PriceObservation.objects.count(), 5)
+        self.assertEqual(LatestPrice.objects.get(station_id=1).price, 3.3)
+        self.assertEqual(LatestPrice.objects.count(), 3)
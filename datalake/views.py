@@ -1,6 +1,6 @@
 from django.shortcuts import render
-from .models import FuelPrice
+from .queries import stations_with_latest_price
 
 def fuel_list(request):
-    fuels = FuelPrice.objects.all()
+    fuels = stations_with_latest_price().order_by('state', 'city', 'name')
     return render(request, 'fuel_list.html', {'fuels': fuels})
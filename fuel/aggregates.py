@@ -0,0 +1,237 @@
+import heapq
+
+import numpy as np
+
+from fuel.spatial import MILES_PER_DEGREE, CorridorHit, project_many
+from fuel.stations import get_station_table
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Side of the coarse price grid cells in projected miles
+REGION_CELL_MILES = 50.0
+
+_CELL_OFFSET = 1 << 20
+_CELL_STRIDE = 1 << 21
+
+
+def _pack(cx, cy):
+    return (cx + _CELL_OFFSET) * _CELL_STRIDE + (cy + _CELL_OFFSET)
+
+
+def _unpack(key):
+    return key // _CELL_STRIDE - _CELL_OFFSET, key % _CELL_STRIDE - _CELL_OFFSET
+
+
+class PriceStats:
+    """
+    Price distribution of a group of stations: count, min, max, mean,
+    PERCENTILES and the row index of the cheapest station
+    """
+
+    __slots__ = ("count", "min", "max", "mean", "percentiles", "cheapest")
+
+    def __init__(self, rows, prices):
+        values = prices[rows]
+        self.count = len(rows)
+        self.cheapest = int(rows[int(np.argmin(values))])
+        self.min = float(values.min())
+        self.max = float(values.max())
+        self.mean = float(values.mean())
+        self.percentiles = dict(zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()))
+
+    @property
+    def median(self):
+        return self.percentiles[50]
+
+    def as_dict(self, table):
+        i = self.cheapest
+        return {
+            "stations": self.count,
+            "min": round(self.min, 3),
+            **{f"p{q}": round(v, 3) for q, v in self.percentiles.items() if q != 50},
+            "median": round(self.median, 3),
+            "max": round(self.max, 3),
+            "mean": round(self.mean, 3),
+            "cheapest": {
+                "station_id": table.ids[i],
+                "name": table.names[i],
+                "address": table.addresses[i],
+                "city": table.cities[i],
+                "state": table.states[i],
+                "fuel_price": round(table.prices[i], 3),
+            },
+        }
+
+
+def _groups(keys):
+    # {key: row indices} preserving file order within each group
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    return {key: np.asarray(rows, dtype=np.int64) for key, rows in groups.items()}
+
+
+class PriceAggregates:
+    """
+    Precomputed price statistics for a StationTable.
+
+    Per state, per (state, city) and per cell of a coarse grid over the
+    projected station positions, so "where is diesel cheapest" questions are
+    dictionary lookups. States are also kept ranked by median price. Built
+    once per table, so every data load gets fresh aggregates.
+    """
+
+    def __init__(self, table, cell_miles=REGION_CELL_MILES):
+        self.table = table
+        self.cell_miles = cell_miles
+        prices = np.asarray(table.prices, dtype=np.float64)
+        states = [s.upper() for s in table.states]
+
+        self.by_state = {state: PriceStats(rows, prices) for state, rows in _groups(states).items()}
+        self.by_city = {
+            key: PriceStats(rows, prices)
+            for key, rows in _groups(zip(states, (c.lower() for c in table.cities))).items()
+        }
+        self.states_by_median = sorted(self.by_state, key=lambda s: (self.by_state[s].median, self.by_state[s].min, s))
+        self._cities_by_state = {}
+        for state, city in sorted(self.by_city, key=lambda k: (self.by_city[k].median, k)):
+            self._cities_by_state.setdefault(state, []).append(city)
+
+        # Coarse grid: packed cell keys sorted ascending, with each cell's stations and minimum price
+        xs, ys = project_many(table.lats, table.lons)
+        located = np.flatnonzero(~(np.isnan(xs) | np.isnan(ys)))
+        keys = _pack(
+            np.floor(xs[located] / cell_miles).astype(np.int64),
+            np.floor(ys[located] / cell_miles).astype(np.int64),
+        )
+        order = np.lexsort((prices[located], keys))
+        keys, rows = keys[order], located[order]
+        self.cell_keys, starts = np.unique(keys, return_index=True)
+        self.cell_starts = np.append(starts, len(keys))
+        self.cell_rows = rows  # cheapest first within each cell
+        self.cell_min = prices[rows[starts]] if len(rows) else np.empty(0)
+        self.xs, self.ys, self.prices = xs, ys, prices
+
+    def state(self, code):
+        return self.by_state.get((code or "").upper())
+
+    def city(self, state, city):
+        return self.by_city.get(((state or "").upper(), (city or "").lower()))
+
+    def cities_by_median(self, state):
+        """
+        City keys of `state`, cheapest median first
+        """
+        return self._cities_by_state.get((state or "").upper(), [])
+
+    def cell_of(self, lat, lng):
+        """
+        Index into the cell arrays of the grid cell containing a point, or None when it has no stations
+        """
+        x, y = project_many(lat, lng)
+        key = _pack(int(np.floor(x / self.cell_miles)), int(np.floor(y / self.cell_miles)))
+        k = int(np.searchsorted(self.cell_keys, key))
+        return k if k < len(self.cell_keys) and self.cell_keys[k] == key else None
+
+    def cell_stats(self, k):
+        rows = self.cell_rows[self.cell_starts[k]:self.cell_starts[k + 1]]
+        return PriceStats(rows, self.prices)
+
+    def cell_center(self, k):
+        """
+        (lat, lng) of the middle of cell k
+        """
+        cx, cy = _unpack(int(self.cell_keys[k]))
+        lat = (cy + 0.5) * self.cell_miles / MILES_PER_DEGREE
+        lng = (cx + 0.5) * self.cell_miles / (MILES_PER_DEGREE * np.cos(np.radians(lat)))
+        return float(lat), float(lng)
+
+    def heatmap(self):
+        """
+        One entry per non-empty grid cell: centre, station count and min/median price
+        """
+        cells = []
+        for k in range(len(self.cell_keys)):
+            lo, hi = self.cell_starts[k], self.cell_starts[k + 1]
+            lat, lng = self.cell_center(k)
+            cells.append({
+                "lat": round(lat, 4),
+                "lng": round(lng, 4),
+                "stations": int(hi - lo),
+                "min": round(float(self.cell_min[k]), 3),
+                "median": round(float(np.median(self.prices[self.cell_rows[lo:hi]])), 3),
+            })
+        return cells
+
+    def cheapest_along(self, xs, ys, cumulative, radius_miles, limit):
+        """
+        The `limit` cheapest stations within `radius_miles` of a projected
+        polyline, as CorridorHits cheapest first (ties in route order).
+
+        Branch and bound over the coarse grid: the cells the corridor
+        touches are visited in order of their minimum price, and the search
+        stops at the first cell whose minimum is above the current
+        limit-th best price, so most of the corridor is never measured exactly.
+        """
+        if len(xs) < 2 or not len(self.cell_keys) or limit <= 0:
+            return []
+        size = self.cell_miles
+        x1, y1, x2, y2 = xs[:-1], ys[:-1], xs[1:], ys[1:]
+        cx0 = np.floor((np.minimum(x1, x2) - radius_miles) / size).astype(np.int64)
+        cx1 = np.floor((np.maximum(x1, x2) + radius_miles) / size).astype(np.int64)
+        cy0 = np.floor((np.minimum(y1, y2) - radius_miles) / size).astype(np.int64)
+        cy1 = np.floor((np.maximum(y1, y2) + radius_miles) / size).astype(np.int64)
+        rows = cy1 - cy0 + 1
+        counts = (cx1 - cx0 + 1) * rows
+        seg = np.repeat(np.arange(len(x1)), counts)
+        local = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        keys = _pack(cx0[seg] + local // rows[seg], cy0[seg] + local % rows[seg])
+
+        # Keep (cell, segment) pairs whose cell has stations, grouped by cell
+        k = np.searchsorted(self.cell_keys, keys)
+        k[k == len(self.cell_keys)] = 0
+        present = self.cell_keys[k] == keys
+        k, seg = k[present], seg[present]
+        order = np.argsort(k, kind="stable")
+        k, seg = k[order], seg[order]
+        cells, first = np.unique(k, return_index=True)
+        bounds = np.append(first, len(k))
+
+        best = []  # max-heap of (-price, -along, row): the current `limit` best by (price, along)
+        found = {}
+        r2 = radius_miles * radius_miles
+        for c in np.argsort(self.cell_min[cells], kind="stable").tolist():
+            cell = cells[c]
+            if len(best) >= limit and self.cell_min[cell] > -best[0][0]:
+                break  # no station in this or any later cell can make the list
+            segs = seg[bounds[c]:bounds[c + 1]]
+            station = self.cell_rows[self.cell_starts[cell]:self.cell_starts[cell + 1]]
+            px, py = self.xs[station][:, None], self.ys[station][:, None]
+            dx, dy = x2[segs] - x1[segs], y2[segs] - y1[segs]
+            seg2 = dx * dx + dy * dy
+            with np.errstate(invalid="ignore", divide="ignore"):
+                t = np.where(seg2 > 0, ((px - x1[segs]) * dx + (py - y1[segs]) * dy) / seg2, 0.0)
+            t = np.clip(t, 0.0, 1.0)
+            ex, ey = x1[segs] + t * dx - px, y1[segs] + t * dy - py
+            d2 = ex * ex + ey * ey
+            nearest = np.argmin(d2, axis=1)
+            for s, row in enumerate(station.tolist()):
+                j = nearest[s]
+                if d2[s, j] > r2 or row in found:
+                    continue
+                si = segs[j]
+                along = cumulative[si] + t[s, j] * (cumulative[si + 1] - cumulative[si])
+                found[row] = CorridorHit(row, float(along), float(np.sqrt(d2[s, j])))
+                item = (-self.prices[row], -along, row)
+                if len(best) < limit:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+        return [found[row] for _, _, row in sorted(best, reverse=True)]
+
+
+def get_price_aggregates(table=None):
+    """
+    PriceAggregates for the current station table, built once per table
+    """
+    table = table or get_station_table()
+    return table.derived("price_aggregates", PriceAggregates)
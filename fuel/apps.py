@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 class FuelConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'fuel'
\ No newline at end of file
+    name = 'fuel'
+
+    def ready(self):
+        from config.metrics import REGISTRY
+        from fuel.stations import collect_station_metrics
+        REGISTRY.register_collector(collect_station_metrics)
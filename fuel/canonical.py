@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PRICE_POLICIES = ("min", "latest", "mean")
+DEFAULT_PRICE_POLICY = "min"
+
+
+def price_policy(policy=None):
+    """
+    Validated price policy: `policy`, else settings.FUEL_PRICE_POLICY, else 'min'
+    """
+    policy = policy or getattr(settings, "FUEL_PRICE_POLICY", DEFAULT_PRICE_POLICY)
+    if policy not in PRICE_POLICIES:
+        raise ImproperlyConfigured(f"Unknown fuel price policy {policy!r}, expected one of {', '.join(PRICE_POLICIES)}")
+    return policy
+
+
+class PriceMerger:
+    """
+    Folds repeated prices for the same key into one according to a policy:
+    the lowest ('min'), the last seen ('latest') or the average ('mean').
+
+    rotate() starts a new generation for streaming use: keys of the
+    previous generation are still merged with, older ones are forgotten.
+    """
+
+    __slots__ = ("policy", "_seen", "_previous")
+
+    def __init__(self, policy=None):
+        self.policy = price_policy(policy)
+        self._seen = {}
+        self._previous = {}
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, key):
+        return key in self._seen
+
+    def add(self, key, price):
+        """
+        Record `price` for `key` and return the merged price so far
+        """
+        seen = self._seen.get(key) or self._previous.get(key)
+        if seen is None:
+            self._seen[key] = [price, 1, price]
+            return price
+        merged, count, total = seen
+        count += 1
+        total += price
+        if self.policy == "min":
+            merged = min(merged, price)
+        elif self.policy == "latest":
+            merged = price
+        else:
+            merged = total / count
+        self._seen[key] = [merged, count, total]
+        return merged
+
+    def price(self, key):
+        return self._seen[key][0]
+
+    def rotate(self):
+        self._previous = self._seen
+        self._seen = {}
+
+    def clear(self):
+        self._seen.clear()
+        self._previous.clear()
+
+
+def canonicalize_table(table, policy=None):
+    """
+    StationTable with one row per (OPIS ID, address).
+
+    The CSV lists some sites several times under different names and
+    prices. Each site keeps its first row's details, in first-seen order,
+    and a price merged by `policy` (see PriceMerger). Returns (table,
+    number of duplicate rows dropped).
+    """
+    merger = PriceMerger(policy)
+    keep = []
+    for i in range(len(table)):
+        key = (table.ids[i], table.addresses[i])
+        if key not in merger:
+            keep.append(i)
+        merger.add(key, table.prices[i])
+
+    dropped = len(table) - len(keep)
+    if not dropped:
+        return table, 0
+
+    canonical = type(table)(
+        [table.ids[i] for i in keep],
+        [table.names[i] for i in keep],
+        [table.addresses[i] for i in keep],
+        [table.cities[i] for i in keep],
+        [table.states[i] for i in keep],
+        [table.rack_ids[i] for i in keep],
+        [merger.price((table.ids[i], table.addresses[i])) for i in keep],
+        lats=[table.lats[i] for i in keep],
+        lons=[table.lons[i] for i in keep],
+        source=table.source,
+        mtime=table.mtime,
+    )
+    return canonical, dropped
@@ -0,0 +1,181 @@
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b"FUELSNP\n"
+# 2: stations located only to their state are stored unplaced (NaN)
+FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct("<8sII")  # magic, format version, header length
+_ALIGN = 8
+
+# (column, struct format) of the fixed-width columns, one entry per station
+NUMERIC_COLUMNS = (("ids", "q"), ("rack_ids", "q"), ("prices", "d"), ("lats", "d"), ("lons", "d"))
+TEXT_COLUMNS = ("names", "addresses", "cities", "states")
+
+
+class StringPool:
+    """
+    Interned UTF-8 strings in a shared blob, decoded on first use and then reused
+    """
+
+    __slots__ = ("offsets", "blob", "_decoded")
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        self._decoded = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self._decoded)
+
+    def __getitem__(self, k):
+        value = self._decoded[k]
+        if value is None:
+            value = self._decoded[k] = str(self.blob[self.offsets[k]:self.offsets[k + 1]], "utf-8")
+        return value
+
+
+class StringColumn:
+    """
+    Read-only text column: a per-row index into a StringPool, so rows sharing
+    a value share one string object and nothing is decoded until read
+    """
+
+    __slots__ = ("pool", "index")
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.pool[k] for k in self.index[i]]
+        return self.pool[self.index[i]]
+
+    def __iter__(self):
+        pool = self.pool
+        return (pool[k] for k in self.index)
+
+
+def source_digest(paths):
+    """
+    Content hash of the files a snapshot was compiled from (missing files count as empty)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(os.path.basename(str(path)).encode() + b"\0")
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            digest.update(b"<missing>")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _pad(length):
+    return -length % _ALIGN
+
+
+def write_station_snapshot(table, path, digest, price_policy):
+    """
+    Compile a StationTable into a single versioned binary file at `path`.
+
+    Layout: magic, format version and header length, a JSON header (counts,
+    `digest` of the sources, price policy, section offsets), then 8-byte
+    aligned sections: the numeric columns as little-endian arrays, one
+    uint32 pool index per row for each text column, and the string pool
+    (uint32 offsets plus a UTF-8 blob). Written to a temporary file and
+    renamed into place, so readers never see a half-written snapshot.
+    """
+    pool_index = {}
+    sections = []
+    for name, fmt in NUMERIC_COLUMNS:
+        sections.append((name, np.asarray(getattr(table, name), dtype="<" + fmt).tobytes()))
+    for name in TEXT_COLUMNS:
+        index = np.fromiter(
+            (pool_index.setdefault(value, len(pool_index)) for value in getattr(table, name)),
+            dtype="<u4", count=len(table),
+        )
+        sections.append((name, index.tobytes()))
+    pool = sorted(pool_index, key=pool_index.get)
+    encoded = [value.encode("utf-8") for value in pool]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    sections.append(("pool_offsets", offsets.tobytes()))
+    sections.append(("pool_blob", b"".join(encoded)))
+
+    header = {
+        "format": FORMAT_VERSION,
+        "stations": len(table),
+        "strings": len(pool),
+        "source_digest": digest,
+        "price_policy": price_policy,
+        "built": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+    # Offsets depend on the header length, which depends on the offsets: lay out with room for the numbers
+    placeholder = {name: [0, len(data)] for name, data in sections}
+    header_bytes = json.dumps({**header, "sections": placeholder}).encode() + b" " * 16 * len(sections)
+    position = _PREAMBLE.size + len(header_bytes)
+    position += _pad(position)
+    layout = {}
+    for name, data in sections:
+        layout[name] = [position, len(data)]
+        position += len(data) + _pad(len(data))
+    header_bytes = json.dumps({**header, "sections": layout}).encode().ljust(len(header_bytes))
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * _pad(f.tell()))
+        for name, data in sections:
+            f.write(data)
+            f.write(b"\0" * _pad(len(data)))
+    os.replace(tmp, path)
+    return header
+
+
+def read_station_snapshot(path):
+    """
+    Memory-map a compiled snapshot. Returns (header, columns) where the
+    numeric columns are read-only memoryviews straight over the mapping and
+    the text columns are StringColumns. Raises ValueError for a file that
+    isn't a snapshot of this format.
+    """
+    if sys.byteorder != "little":
+        raise ValueError("Station snapshots are little-endian and are mapped as native arrays")
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    if len(view) < _PREAMBLE.size:
+        raise ValueError(f"{path} is not a station snapshot")
+    magic, version, header_length = _PREAMBLE.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a station snapshot")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported station snapshot format {version} in {path}")
+    header = json.loads(bytes(view[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+
+    def section(name, fmt=None):
+        offset, length = header["sections"][name]
+        if offset + length > len(view):
+            raise ValueError(f"Station snapshot {path} is truncated")
+        data = view[offset:offset + length]
+        return data.cast(fmt) if fmt else data
+
+    columns = {name: section(name, fmt) for name, fmt in NUMERIC_COLUMNS}
+    pool = StringPool(section("pool_offsets", "I"), section("pool_blob"))
+    for name in TEXT_COLUMNS:
+        columns[name] = StringColumn(pool, section(name, "I"))
+    return header, columns
@@ -0,0 +1,138 @@
+import os
+import csv
+import re
+import unicodedata
+
+from django.conf import settings
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+DEFAULT_COORDS_PATH = os.path.join(DATA_DIR, "station_coords.csv")
+GAZETTEER_DIR = os.path.join(DATA_DIR, "gazetteer")
+
+COORDS_HEADER = ["OPIS Truckstop ID", "Address", "City", "State", "Latitude", "Longitude", "Source"]
+
+# Too coarse to search along a route: a state centroid is typically hundreds of miles from the station
+UNPLACED_SOURCES = frozenset({"state", "missing"})
+
+
+def station_coords_path():
+    """
+    Path of the geocoded station cache (settings.FUEL_STATION_COORDS_CSV)
+    """
+    return str(getattr(settings, "FUEL_STATION_COORDS_CSV", DEFAULT_COORDS_PATH))
+
+
+_ABBREVIATIONS = {"st": "saint", "ste": "sainte", "ft": "fort", "mt": "mount", "pt": "port"}
+
+
+def place_key(city, state):
+    """
+    Gazetteer key for a place: accents, punctuation and spacing dropped and
+    common abbreviations spelled out, so 'St. Louis' meets 'Saint Louis'
+    and 'Mc Calla' meets 'McCalla'
+    """
+    name = unicodedata.normalize("NFKD", city).encode("ascii", "ignore").decode().lower()
+    words = re.findall(r"[a-z0-9]+", name.replace("'", ""))
+    return ("".join(_ABBREVIATIONS.get(w, w) for w in words), state.strip().upper())
+
+
+def load_gazetteer(directory=GAZETTEER_DIR, min_population=0):
+    """
+    Bundled centroid gazetteer as ({place_key: (lat, lon)}, {state: (lat, lon)}),
+    optionally only the places of at least `min_population` (GeoNames figure,
+    0 for postal towns). city_centroids.csv is generated by the build_gazetteer command.
+    """
+    cities, states = {}, {}
+    with open(os.path.join(directory, "city_centroids.csv"), newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if min_population and int(row.get("Population") or 0) < min_population:
+                continue
+            cities[place_key(row["City"], row["State"])] = (float(row["Latitude"]), float(row["Longitude"]))
+    with open(os.path.join(directory, "state_centroids.csv"), newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            states[row["State"].strip().upper()] = (float(row["Latitude"]), float(row["Longitude"]))
+    return cities, states
+
+
+def load_station_coords(path=None):
+    """
+    Previously geocoded coordinates as {(opis_id, address): (lat, lon, source)}
+    """
+    path = path or station_coords_path()
+    coords = {}
+    if not os.path.exists(path):
+        return coords
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                key = (int(row["OPIS Truckstop ID"]), row["Address"].strip())
+                coords[key] = (float(row["Latitude"]), float(row["Longitude"]), row.get("Source") or "cache")
+            except (KeyError, ValueError):
+                continue
+    return coords
+
+
+def locate_station(opis_id, address, city, state, cached, gazetteer, geocoder=None):
+    """
+    (lat, lon, source) for one station, or None when nothing matches.
+
+    Lookup order: the on-disk cache, the optional `geocoder(address, city, state)`
+    callable, the bundled city centroid, then the state centroid.
+    """
+    hit = cached.get((opis_id, address))
+    if hit is not None:
+        return hit
+    if geocoder is not None:
+        point = geocoder(address, city, state)
+        if point is not None:
+            return (point[0], point[1], "geocoder")
+    cities, states = gazetteer
+    point = cities.get(place_key(city, state))
+    if point is not None:
+        return (point[0], point[1], "city")
+    point = states.get(state.strip().upper())
+    if point is not None:
+        return (point[0], point[1], "state")
+    return None
+
+
+def placed(located):
+    """
+    Whether a locate_station() result is precise enough to put the station on or off a route
+    """
+    return located is not None and located[2] not in UNPLACED_SOURCES
+
+
+def geocode_stations(table, geocoder=None, cached=None, gazetteer=None):
+    """
+    Resolve (lat, lon, source) for every row of a StationTable with
+    locate_station(). Rows that resolve nowhere get (nan, nan, "missing").
+    """
+    cached = load_station_coords() if cached is None else cached
+    gazetteer = gazetteer or load_gazetteer()
+    missing = (float("nan"), float("nan"), "missing")
+
+    return [
+        locate_station(
+            table.ids[i], table.addresses[i], table.cities[i], table.states[i],
+            cached, gazetteer, geocoder,
+        ) or missing
+        for i in range(len(table))
+    ]
+
+
+def write_station_coords(table, results, path=None):
+    """
+    Write geocoding results for `table` to the station coordinate cache
+    """
+    path = path or station_coords_path()
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COORDS_HEADER)
+        for i, (lat, lon, source) in enumerate(results):
+            if source == "missing":
+                continue
+            writer.writerow([
+                table.ids[i], table.addresses[i], table.cities[i], table.states[i],
+                round(lat, 6), round(lon, 6), source,
+            ])
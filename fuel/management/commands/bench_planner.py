@@ -0,0 +1,38 @@
+import math
+import random
+import time
+from django.core.management.base import BaseCommand
+from fuel.planner import DEFAULT_MPG, DEFAULT_TANK_GALLONS, plan_fuel_stops
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the refuelling planner on synthetic routes with growing numbers of candidate stations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,100000', help='Comma separated candidate counts')
+        parser.add_argument('--route-miles', type=float, default=2800.0, help='Length of the synthetic route')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size, the best one is reported')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        route_miles = options['route_miles']
+        sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+
+        self.stdout.write(f"{'candidates':>10} {'best ms':>10} {'us/cand':>9} {'ns/(n log n)':>13} {'stops':>6} {'cost $':>10}")
+        for n in sizes:
+            positions = sorted(rng.uniform(0, route_miles) for _ in range(n))
+            prices = [round(rng.uniform(2.6, 4.8), 3) for _ in range(n)]
+
+            best = float('inf')
+            plan = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                plan = plan_fuel_stops(positions, prices, route_miles, DEFAULT_TANK_GALLONS, DEFAULT_MPG)
+                best = min(best, time.perf_counter() - started)
+
+            per_nlogn = best * 1e9 / (n * max(1.0, math.log2(n)))
+            self.stdout.write(
+                f"{n:>10} {best * 1000:>10.2f} {best * 1e6 / n:>9.2f} {per_nlogn:>13.1f} "
+                f"{len(plan.stops):>6} {plan.total_cost:>10.2f}"
+            )
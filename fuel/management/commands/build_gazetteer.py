@@ -0,0 +1,91 @@
+import csv
+import os
+import statistics
+from django.core.management.base import BaseCommand, CommandError
+from fuel.geocoding import GAZETTEER_DIR, place_key
+
+# GeoNames admin1 codes of the Canadian provinces and territories
+CA_PROVINCES = {
+    '01': 'AB', '02': 'BC', '03': 'MB', '04': 'NB', '05': 'NL', '07': 'NS', '08': 'ON',
+    '09': 'PE', '10': 'QC', '11': 'SK', '12': 'YT', '13': 'NT', '14': 'NU',
+}
+
+
+def read_geonames(path):
+    """
+    Populated places of a GeoNames dump (cities500.txt, US.txt, CA.txt, ...)
+    as (name, state, lat, lon, population), US and Canada only
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        for fields in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(fields) < 15 or fields[6] != 'P':
+                continue
+            country, admin1 = fields[8], fields[10]
+            state = admin1 if country == 'US' else CA_PROVINCES.get(admin1) if country == 'CA' else None
+            if state:
+                yield fields[1], state, float(fields[4]), float(fields[5]), int(fields[14] or 0)
+
+
+def read_postal(path):
+    """
+    Postal code centroids from a Zip,City,State,Latitude,Longitude CSV as (city, state, lat, lon)
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                lat, lon = float(row['Latitude']), float(row['Longitude'])
+            except (KeyError, ValueError):
+                continue
+            if lat or lon:  # 0,0 marks a code without a location
+                yield row['City'].strip(), row['State'].strip().upper(), lat, lon
+
+
+def merge_places(geonames, postal):
+    """
+    {place_key: (name, state, lat, lon, population)}. A GeoNames place wins
+    (the most populous one when a state has several of the name); postal
+    cities it lacks get population 0 and the median of their codes'
+    centroids, which a few far-off codes can't drag away from the town.
+    """
+    places, population = {}, {}
+    for name, state, lat, lon, people in geonames:
+        key = place_key(name, state)
+        if key not in places or people > population[key]:
+            places[key] = (name, state, lat, lon, people)
+            population[key] = people
+
+    codes = {}
+    for city, state, lat, lon in postal:
+        key = place_key(city, state)
+        if key not in places:
+            codes.setdefault(key, (city.title(), state, [], []))
+            codes[key][2].append(lat)
+            codes[key][3].append(lon)
+    for key, (city, state, lats, lons) in codes.items():
+        places[key] = (city, state, statistics.median(lats), statistics.median(lons), 0)
+    return places
+
+
+class Command(BaseCommand):
+    help = 'Builds the bundled city centroid gazetteer from GeoNames dumps and a postal code centroid CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--geonames', nargs='+', required=True,
+                            help='GeoNames dump files (tab separated, e.g. cities500.txt or US.txt and CA.txt)')
+        parser.add_argument('--postal', default=None, help='Zip,City,State,Latitude,Longitude CSV of postal code centroids')
+        parser.add_argument('--output', default=os.path.join(GAZETTEER_DIR, 'city_centroids.csv'))
+
+    def handle(self, *args, **options):
+        try:
+            geonames = [place for path in options['geonames'] for place in read_geonames(path)]
+            postal = list(read_postal(options['postal'])) if options['postal'] else []
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read gazetteer sources: {e}')
+        places = merge_places(geonames, postal)
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['City', 'State', 'Latitude', 'Longitude', 'Population'])
+            for name, state, lat, lon, people in sorted(places.values(), key=lambda p: (p[1], p[0])):
+                writer.writerow([name, state, round(lat, 4), round(lon, 4), people])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(places)} places to {options['output']}"))
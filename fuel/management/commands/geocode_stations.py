@@ -0,0 +1,61 @@
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from fuel.geocoding import geocode_stations, load_station_coords, station_coords_path, write_station_coords
+from fuel.stations import get_station_table
+
+
+def nominatim_geocoder(delay):
+    """
+    geocoder(address, city, state) backed by geopy's Nominatim client
+    """
+    try:
+        from geopy.geocoders import Nominatim
+    except ImportError:
+        raise CommandError("--online needs geopy. Install: pip install geopy")
+
+    client = Nominatim(user_agent="fuel-route-planner")
+    seen = {}
+
+    def lookup(query):
+        if query not in seen:
+            time.sleep(delay)  # Nominatim allows about one request per second
+            location = client.geocode(query, country_codes=["us", "ca"], timeout=10)
+            seen[query] = (location.latitude, location.longitude) if location else None
+        return seen[query]
+
+    def geocode(address, city, state):
+        # The street address places the stop itself; the city is the fallback
+        point = lookup(f"{address}, {city}, {state}") if address else None
+        return point or lookup(f"{city}, {state}")
+
+    return geocode
+
+
+class Command(BaseCommand):
+    help = 'Attaches latitude/longitude to every truckstop and writes the station coordinate cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Cache file to write (default: FUEL_STATION_COORDS_CSV)')
+        parser.add_argument('--online', action='store_true', help='Geocode station addresses (then their city) with Nominatim before the bundled gazetteer')
+        parser.add_argument('--delay', type=float, default=1.0, help='Seconds between online geocoder calls')
+        parser.add_argument('--refresh', action='store_true', help='Ignore coordinates already in the cache')
+
+    def handle(self, *args, **options):
+        table = get_station_table()
+        if not len(table):
+            raise CommandError('No stations loaded, check FUEL_PRICES_CSV')
+
+        output = options['output'] or station_coords_path()
+        cached = {} if options['refresh'] else load_station_coords(output)
+        geocoder = nominatim_geocoder(options['delay']) if options['online'] else None
+
+        started = time.perf_counter()
+        results = geocode_stations(table, geocoder=geocoder, cached=cached)
+        write_station_coords(table, results, output)
+
+        sources = Counter(source for _, _, source in results)
+        summary = ', '.join(f"{name}={count}" for name, count in sorted(sources.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Geocoded {len(results)} stations in {time.perf_counter() - started:.2f}s ({summary}) -> {output}'
+        ))
@@ -0,0 +1,175 @@
+from bisect import bisect_right
+
+DEFAULT_RANGE_MILES = 500.0
+DEFAULT_MPG = 10.0
+DEFAULT_TANK_GALLONS = DEFAULT_RANGE_MILES / DEFAULT_MPG
+
+_EPSILON = 1e-9
+
+
+class RouteNotCoverable(Exception):
+    """
+    Raised when a stretch of the route is longer than the vehicle's range
+    and has no station to refuel at.
+    """
+
+    def __init__(self, gap_start_miles, gap_end_miles):
+        self.gap_start_miles = gap_start_miles
+        self.gap_end_miles = gap_end_miles
+        super().__init__(
+            f"No fuel station reachable between mile {gap_start_miles:.1f} and mile {gap_end_miles:.1f}"
+        )
+
+    def __reduce__(self):
+        # Rebuilt from the gap, not the message, when it crosses a process boundary
+        return type(self), (self.gap_start_miles, self.gap_end_miles)
+
+
+class PlanStop:
+    __slots__ = ("candidate", "miles", "price", "gallons", "cost")
+
+    def __init__(self, candidate, miles, price, gallons):
+        self.candidate = candidate
+        self.miles = miles
+        self.price = price
+        self.gallons = gallons
+        self.cost = gallons * price
+
+
+class FuelPlan:
+    """
+    Stops bought at (total_cost is what is paid at the pump) and the fuel
+    in the tank at the start and the end of the route.
+
+    trip_cost is the cost of the fuel the trip burns: the purchases plus
+    the fuel drawn down from the starting tank, valued at `tank_price`.
+    Without it a trip driven on the starting tank alone would cost nothing.
+    """
+
+    __slots__ = ("stops", "total_gallons", "total_cost", "route_miles", "start_fuel", "end_fuel", "tank_price")
+
+    def __init__(self, stops, route_miles, start_fuel, end_fuel, tank_price=0.0):
+        self.stops = stops
+        self.route_miles = route_miles
+        self.start_fuel = start_fuel
+        self.end_fuel = end_fuel
+        self.tank_price = tank_price
+        self.total_gallons = sum(s.gallons for s in stops)
+        self.total_cost = sum(s.cost for s in stops)
+
+    @property
+    def trip_cost(self):
+        return self.total_cost + (self.start_fuel - self.end_fuel) * self.tank_price
+
+
+class _RangeMin:
+    """
+    Sparse table answering "index of the cheapest price in [lo, hi]" in O(1)
+    after an O(n log n) build.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        level = list(range(len(values)))
+        self.levels = [level]
+        width = 1
+        while 2 * width <= len(values):
+            prev = level
+            level = []
+            for i in range(len(values) - 2 * width + 1):
+                a, b = prev[i], prev[i + width]
+                level.append(a if values[a] <= values[b] else b)
+            self.levels.append(level)
+            width *= 2
+
+    def argmin(self, lo, hi):
+        k = (hi - lo + 1).bit_length() - 1
+        a, b = self.levels[k][lo], self.levels[k][hi - (1 << k) + 1]
+        return a if self.values[a] <= self.values[b] else b
+
+
+def plan_fuel_stops(positions, prices, route_miles, tank_gallons=DEFAULT_TANK_GALLONS,
+                    mpg=DEFAULT_MPG, start_fuel=None, tank_price=None):
+    """
+    Cheapest refuelling plan along a route.
+
+    `positions` are candidate station distances from the start in miles,
+    sorted ascending, and `prices` their price per gallon. The vehicle starts
+    with `start_fuel` gallons (a full tank when None) and may carry at most
+    `tank_gallons`. The starting fuel is valued at `tank_price` in the
+    plan's trip_cost, by default the mean price of the stations on the route.
+
+    Classic greedy for the fixed-route gas station problem: at each stop,
+    if a cheaper station is within range buy just enough to reach it,
+    otherwise fill up and move to the cheapest station within range. Next
+    cheaper stations come from a monotonic stack and range minima from a
+    sparse table, so the whole plan is O(n log n) in the number of candidates.
+
+    Returns a FuelPlan whose stops refer to candidates by index. Raises
+    RouteNotCoverable when some stretch of the route can't be driven.
+    """
+    if mpg <= 0 or tank_gallons <= 0:
+        raise ValueError("mpg and tank_gallons must be positive")
+
+    fuel = tank_gallons if start_fuel is None else max(0.0, min(float(start_fuel), tank_gallons))
+    range_miles = tank_gallons * mpg
+
+    # Stations past the destination are of no use
+    n = bisect_right(positions, route_miles)
+    first = bisect_right(positions, -_EPSILON)
+    stops = []
+    if tank_price is None:
+        tank_price = sum(prices[first:n]) / (n - first) if n > first else 0.0
+    start = fuel
+
+    def finish(end_fuel):
+        return FuelPlan(stops, route_miles, start, end_fuel, tank_price)
+
+    if route_miles <= fuel * mpg + _EPSILON:
+        return finish(fuel - route_miles / mpg)
+    if first >= n or positions[first] > fuel * mpg + _EPSILON:
+        reach = fuel * mpg
+        end = positions[first] if first < n else route_miles
+        raise RouteNotCoverable(reach, end)
+
+    # Next strictly cheaper station to the right of each candidate
+    next_cheaper = [n] * n
+    stack = []
+    for i in range(n - 1, first - 1, -1):
+        while stack and prices[stack[-1]] >= prices[i]:
+            stack.pop()
+        next_cheaper[i] = stack[-1] if stack else n
+        stack.append(i)
+
+    cheapest = _RangeMin(prices[:n]) if n else None
+
+    # Drive to the first candidate without buying; from there it's greedy
+    i = first
+    fuel -= positions[i] / mpg
+    while True:
+        here = positions[i]
+        limit = here + range_miles
+        j = next_cheaper[i]
+
+        if j < n and positions[j] <= limit + _EPSILON:
+            target = positions[j]
+            buy = max(0.0, (target - here) / mpg - fuel)
+        elif route_miles <= limit + _EPSILON:
+            target = route_miles
+            j = None
+            buy = max(0.0, (route_miles - here) / mpg - fuel)
+        else:
+            hi = bisect_right(positions, limit + _EPSILON, 0, n) - 1
+            if hi <= i:
+                raise RouteNotCoverable(here, positions[i + 1] if i + 1 < n else route_miles)
+            j = cheapest.argmin(i + 1, hi)
+            target = positions[j]
+            buy = tank_gallons - fuel
+
+        if buy > _EPSILON:
+            stops.append(PlanStop(i, here, prices[i], buy))
+            fuel += buy
+        fuel -= (target - here) / mpg
+        if j is None:
+            return finish(fuel)
+        i = j
@@ -0,0 +1,168 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+
+from config.codec import Fragment, dumps
+from fuel.stations import get_station_table
+
+
+class _Bucket:
+    """
+    Rows of one index key, kept both in file order and in price order
+    """
+
+    __slots__ = ("rows", "by_price", "prices")
+
+    def __init__(self, rows, table):
+        self.rows = rows
+        self.by_price = sorted(rows, key=lambda i: (table.prices[i], i))
+        self.prices = [table.prices[i] for i in self.by_price]
+
+
+class StationQueryIndex:
+    """
+    Precomputed lookups over a StationTable for the fuel price listing.
+
+    Every (state), (city) and (state, city) key maps to a bucket of rows
+    sorted by price, so a filtered, price-bounded, sorted page is two
+    bisects and a slice: O(log n + page) with no per-request scan.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        by_state, by_city, by_state_city = {}, {}, {}
+        for i in range(len(table)):
+            state = table.states[i].lower()
+            city = table.cities[i].lower()
+            by_state.setdefault(state, []).append(i)
+            by_city.setdefault(city, []).append(i)
+            by_state_city.setdefault((state, city), []).append(i)
+
+        self.all = _Bucket(list(range(len(table))), table)
+        self.by_state = {k: _Bucket(v, table) for k, v in by_state.items()}
+        self.by_city = {k: _Bucket(v, table) for k, v in by_city.items()}
+        self.by_state_city = {k: _Bucket(v, table) for k, v in by_state_city.items()}
+
+    def _bucket(self, state, city):
+        if state and city:
+            return self.by_state_city.get((state.lower(), city.lower()))
+        if state:
+            return self.by_state.get(state.lower())
+        if city:
+            return self.by_city.get(city.lower())
+        return self.all
+
+    def select(self, state=None, city=None, min_price=None, max_price=None, sort=None):
+        """
+        Matching row indices as a sequence (a list or a slice of one).
+
+        sort is 'price_asc', 'price_desc' or None. Without a sort the rows keep
+        file order, unless a price bound is given, in which case they come back
+        in price order.
+        """
+        bucket = self._bucket(state, city)
+        if bucket is None:
+            return []
+
+        if sort is None and min_price is None and max_price is None:
+            return bucket.rows
+
+        lo = 0 if min_price is None else bisect_left(bucket.prices, min_price)
+        hi = len(bucket.prices) if max_price is None else bisect_right(bucket.prices, max_price)
+        if lo >= hi:
+            return []
+        if sort == 'price_desc':
+            return _Reversed(bucket.by_price, lo, hi)
+        return _Slice(bucket.by_price, lo, hi)
+
+
+class _Slice:
+    """
+    Read-only window over a list without copying it
+    """
+
+    __slots__ = ("items", "lo", "hi")
+
+    def __init__(self, items, lo, hi):
+        self.items, self.lo, self.hi = items, lo, hi
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def __getitem__(self, s):
+        start, stop, _ = s.indices(len(self))
+        return self.items[self.lo + start:self.lo + max(start, stop)]
+
+
+class _Reversed(_Slice):
+
+    def __getitem__(self, s):
+        start, stop, _ = s.indices(len(self))
+        stop = max(start, stop)
+        window = self.items[self.hi - stop:self.hi - start]
+        window.reverse()
+        return window
+
+
+def get_query_index(table=None):
+    """
+    StationQueryIndex for the current station table, built once per table
+    """
+    table = table or get_station_table()
+    return table.derived("query_index", StationQueryIndex)
+
+
+def _row_fragments(table):
+    return [Fragment(dumps(table.row(i))) for i in range(len(table))]
+
+
+def get_row_fragments(table=None):
+    """
+    Every station row pre-serialized as a config.codec.Fragment, built once
+    per table, so listings splice rows in instead of re-encoding them
+    """
+    table = table or get_station_table()
+    return table.derived("row_json", _row_fragments)
+
+
+class ListingCache:
+    """
+    LRU of fuel price listing payloads, keyed on normalised query parameters.
+
+    One cache hangs off each StationTable, so a new table (CSV change or
+    datalake import) starts with an empty cache and stale pages are never
+    served.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_listing_cache(table=None):
+    """
+    ListingCache for the current station table (FUEL_PRICE_CACHE['MAX_ENTRIES'])
+    """
+    table = table or get_station_table()
+    max_entries = getattr(settings, 'FUEL_PRICE_CACHE', {}).get('MAX_ENTRIES', 2048)
+    return table.derived("listing_cache", lambda t: ListingCache(max_entries))
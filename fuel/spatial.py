@@ -0,0 +1,254 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = math.pi * EARTH_RADIUS_MILES / 180.0
+
+
+def project(lat, lon):
+    """
+    Sinusoidal projection of a point to planar (x, y) miles.
+
+    Distances between nearby points are close to great-circle distance,
+    which is all the corridor search needs.
+    """
+    y = lat * MILES_PER_DEGREE
+    x = lon * MILES_PER_DEGREE * math.cos(math.radians(lat))
+    return x, y
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def project_many(lats, lons):
+    """
+    Vectorised project() over arrays of latitudes and longitudes
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return lons * MILES_PER_DEGREE * np.cos(np.radians(lats)), lats * MILES_PER_DEGREE
+
+
+def haversine_many(lat1, lon1, lat2, lon2):
+    """
+    Vectorised haversine_miles() over arrays
+    """
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dl = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def cumulative_miles(lngs, lats):
+    """
+    Great-circle distance from the first vertex to every vertex, as an array
+    """
+    out = np.zeros(len(lats), dtype=np.float64)
+    if len(lats) > 1:
+        np.cumsum(haversine_many(lats[:-1], lngs[:-1], lats[1:], lngs[1:]), out=out[1:])
+    return out
+
+
+def _coords_array(route_coords):
+    coords = np.asarray(route_coords, dtype=np.float64)
+    return coords[:, :2] if coords.size else coords.reshape(0, 2)
+
+
+def polyline_miles(route_coords):
+    """
+    Great-circle length of a [lng, lat] polyline (or RouteGeometry) in miles
+    """
+    length = getattr(route_coords, "length_miles", None)
+    if length is not None:
+        return length
+    coords = _coords_array(route_coords)
+    if len(coords) < 2:
+        return 0.0
+    return float(haversine_many(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0]).sum())
+
+
+def _route_arrays(route):
+    # RouteGeometry carries its projection and distances, plain lists are converted here
+    if hasattr(route, "cumulative_miles"):
+        xs, ys = route.xy
+        return xs, ys, route.cumulative_miles
+    coords = _coords_array(route)
+    xs, ys = project_many(coords[:, 1], coords[:, 0])
+    return xs, ys, cumulative_miles(coords[:, 0], coords[:, 1])
+
+
+class CorridorHit:
+    __slots__ = ("index", "along_miles", "offset_miles")
+
+    def __init__(self, index, along_miles, offset_miles):
+        self.index = index
+        self.along_miles = along_miles
+        self.offset_miles = offset_miles
+
+    def __repr__(self):
+        return f"CorridorHit({self.index}, along={self.along_miles:.1f}, offset={self.offset_miles:.2f})"
+
+
+# Grid cells are packed into one int64 key so cell lookups are a searchsorted
+_CELL_OFFSET = 1 << 20
+_CELL_STRIDE = 1 << 21
+
+
+def _ranges(counts):
+    """
+    Position of each element within its run, for runs of the given lengths
+    """
+    total = int(counts.sum())
+    starts = np.cumsum(counts) - counts
+    return np.arange(total) - np.repeat(starts, counts)
+
+
+class StationGrid:
+    """
+    Uniform grid over projected station positions.
+
+    Stations without coordinates are left out. `corridor()` returns every
+    station within a distance of a route polyline without comparing each
+    station against each vertex: the route is rasterised into grid cells,
+    only stations in those cells are considered, and each candidate is
+    measured against the route segments that share its cells. All steps
+    run as NumPy array operations, there is no per-vertex Python loop.
+    """
+
+    def __init__(self, lats, lons, cell_miles=10.0):
+        self.cell_miles = cell_miles
+        self.xs, self.ys = project_many(lats, lons)
+        located = np.flatnonzero(~(np.isnan(self.xs) | np.isnan(self.ys)))
+        keys = self._keys(
+            np.floor(self.xs[located] / cell_miles).astype(np.int64),
+            np.floor(self.ys[located] / cell_miles).astype(np.int64),
+        )
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.stations = located[order]
+
+    def __len__(self):
+        return len(self.stations)
+
+    @staticmethod
+    def _keys(cx, cy):
+        return (cx + _CELL_OFFSET) * _CELL_STRIDE + (cy + _CELL_OFFSET)
+
+    def nearest(self, lat, lon):
+        """
+        (index, planar miles) of the located point closest to (lat, lon), or
+        None when the grid is empty.
+
+        Rings of cells are searched outward from the point's own cell until
+        the best hit is nearer than anything the next ring could hold; a point
+        so far away that the rings would cover more cells than there are
+        points is answered with one scan instead.
+        """
+        if not len(self.stations):
+            return None
+        size = self.cell_miles
+        x, y = project(lat, lon)
+        cx, cy = math.floor(x / size), math.floor(y / size)
+        best, best_d2 = None, math.inf
+        searched, ring = 0, 0
+        while searched < len(self.stations):
+            if ring == 0:
+                ring_x, ring_y = np.array([cx]), np.array([cy])
+            else:
+                side = np.arange(-ring, ring + 1)
+                inner = side[1:-1]
+                ring_x = cx + np.concatenate([side, side, np.full(len(inner), -ring), np.full(len(inner), ring)])
+                ring_y = cy + np.concatenate([np.full(len(side), -ring), np.full(len(side), ring), inner, inner])
+            keys = self._keys(ring_x, ring_y)
+            lo = np.searchsorted(self.keys, keys, side="left")
+            found = np.searchsorted(self.keys, keys, side="right") - lo
+            if found.any():
+                station = self.stations[np.repeat(lo, found) + _ranges(found)]
+                d2 = (self.xs[station] - x) ** 2 + (self.ys[station] - y) ** 2
+                k = int(np.argmin(d2))
+                if d2[k] < best_d2:
+                    best, best_d2 = int(station[k]), float(d2[k])
+            # Cells beyond this ring are at least `ring` cells from the point
+            if best is not None and best_d2 <= (ring * size) ** 2:
+                return best, math.sqrt(best_d2)
+            searched += len(keys)
+            ring += 1
+
+        d2 = (self.xs[self.stations] - x) ** 2 + (self.ys[self.stations] - y) ** 2
+        k = int(np.argmin(d2))
+        return int(self.stations[k]), math.sqrt(float(d2[k]))
+
+    def corridor(self, route, radius_miles):
+        """
+        Stations within `radius_miles` of `route` ([lng, lat] pairs or a RouteGeometry).
+
+        Returns CorridorHits ordered by distance along the route, each with the
+        station's projected position along the route and its offset from it.
+        """
+        if len(route) < 2 or not len(self.stations):
+            return []
+
+        size = self.cell_miles
+        xs, ys, cumulative = _route_arrays(route)
+        x1, y1, x2, y2 = xs[:-1], ys[:-1], xs[1:], ys[1:]
+
+        # Cells covered by each segment's bounding box, buffered by the radius
+        cx0 = np.floor((np.minimum(x1, x2) - radius_miles) / size).astype(np.int64)
+        cx1 = np.floor((np.maximum(x1, x2) + radius_miles) / size).astype(np.int64)
+        cy0 = np.floor((np.minimum(y1, y2) - radius_miles) / size).astype(np.int64)
+        cy1 = np.floor((np.maximum(y1, y2) + radius_miles) / size).astype(np.int64)
+        rows = cy1 - cy0 + 1
+        counts = (cx1 - cx0 + 1) * rows
+        seg = np.repeat(np.arange(len(x1)), counts)
+        local = _ranges(counts)
+        cell_keys = self._keys(cx0[seg] + local // rows[seg], cy0[seg] + local % rows[seg])
+
+        # Stations in each of those cells, as (segment, station) candidate pairs
+        lo = np.searchsorted(self.keys, cell_keys, side="left")
+        found = np.searchsorted(self.keys, cell_keys, side="right") - lo
+        seg = np.repeat(seg, found)
+        station = self.stations[np.repeat(lo, found) + _ranges(found)]
+        if not len(station):
+            return []
+
+        # Closest point of each candidate segment to its station
+        px, py = self.xs[station], self.ys[station]
+        dx, dy = x2[seg] - x1[seg], y2[seg] - y1[seg]
+        seg2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(seg2 > 0, ((px - x1[seg]) * dx + (py - y1[seg]) * dy) / seg2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        ex, ey = x1[seg] + t * dx - px, y1[seg] + t * dy - py
+        d2 = ex * ex + ey * ey
+
+        within = d2 <= radius_miles * radius_miles
+        station, seg, t, d2 = station[within], seg[within], t[within], d2[within]
+        if not len(station):
+            return []
+
+        # Keep each station's nearest segment, then order by distance along the route
+        order = np.lexsort((d2, station))
+        station, seg, t, d2 = station[order], seg[order], t[order], d2[order]
+        first = np.ones(len(station), dtype=bool)
+        first[1:] = station[1:] != station[:-1]
+        station, seg, t, d2 = station[first], seg[first], t[first], d2[first]
+        along = cumulative[seg] + t * (cumulative[seg + 1] - cumulative[seg])
+        order = np.argsort(along, kind="stable")
+
+        return [
+            CorridorHit(i, a, o)
+            for i, a, o in zip(station[order].tolist(), along[order].tolist(), np.sqrt(d2[order]).tolist())
+        ]
+
+
+def get_station_grid(table):
+    """
+    StationGrid for a StationTable, built once per table
+    """
+    return table.derived("station_grid", lambda t: StationGrid(t.lats, t.lons))
@@ -0,0 +1,366 @@
+import os
+import csv
+import logging
+import time
+import threading
+from array import array
+
+from django.conf import settings
+
+from fuel.canonical import canonicalize_table, price_policy
+from fuel.compiled import StringColumn, read_station_snapshot, source_digest
+from fuel.geocoding import GAZETTEER_DIR, geocode_stations, placed, station_coords_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "fuel_prices.csv")
+
+
+def station_csv_path():
+    """
+    Path of the fuel price CSV (settings.FUEL_PRICES_CSV, falls back to data/fuel_prices.csv)
+    """
+    return str(getattr(settings, "FUEL_PRICES_CSV", DEFAULT_CSV_PATH))
+
+
+class StationTable:
+    """
+    Columnar, read-only view of the station CSV.
+
+    Numeric columns are read-only memoryviews over typed arrays, text columns
+    are tuples of interned strings. Row i of every column is the same station.
+    Latitude/longitude are NaN for stations that could not be geocoded.
+    """
+
+    __slots__ = (
+        "ids", "names", "addresses", "cities", "states", "rack_ids", "prices",
+        "lats", "lons", "source", "mtime", "_derived", "_lock",
+    )
+
+    def __init__(self, ids, names, addresses, cities, states, rack_ids, prices,
+                 lats=None, lons=None, source=None, mtime=None):
+        self.ids = _readonly("l", ids)
+        self.names = _text(names)
+        self.addresses = _text(addresses)
+        self.cities = _text(cities)
+        self.states = _text(states)
+        self.rack_ids = _readonly("l", rack_ids)
+        self.prices = _readonly("d", prices)
+        nan = float("nan")
+        self.lats = _readonly("d", lats if lats is not None else [nan] * len(self.prices))
+        self.lons = _readonly("d", lons if lons is not None else [nan] * len(self.prices))
+        self.source = source
+        self.mtime = mtime
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.prices)
+
+    @property
+    def version(self):
+        """
+        Opaque token that changes whenever the table's data does (source plus mtime or snapshot version)
+        """
+        return f"{self.source}:{self.mtime}"
+
+    def with_coordinates(self, lats, lons):
+        """
+        Copy of this table with the given latitude/longitude columns
+        """
+        return StationTable(
+            self.ids, self.names, self.addresses, self.cities, self.states, self.rack_ids, self.prices,
+            lats=lats, lons=lons, source=self.source, mtime=self.mtime,
+        )
+
+    def derived(self, name, builder):
+        """
+        Structure built from this table by `builder(table)`, computed once and
+        kept for the table's lifetime (spatial index, query indexes, ...).
+        """
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = builder(self)
+                    self._derived[name] = value
+        return value
+
+    def row(self, i):
+        """
+        Station i as a dict using the CSV column names (coordinates are None when unknown)
+        """
+        lat, lon = self.lats[i], self.lons[i]
+        located = lat == lat and lon == lon
+        return {
+            "OPIS Truckstop ID": self.ids[i],
+            "Truckstop Name": self.names[i],
+            "Address": self.addresses[i],
+            "City": self.cities[i],
+            "State": self.states[i],
+            "Rack ID": self.rack_ids[i],
+            "Retail Price": self.prices[i],
+            "Latitude": lat if located else None,
+            "Longitude": lon if located else None,
+        }
+
+
+def _readonly(typecode, values):
+    if isinstance(values, memoryview):
+        return values
+    return memoryview(array(typecode, values)).toreadonly()
+
+
+def _text(values):
+    # Columns mapped from a compiled snapshot stay lazy, anything else becomes a tuple
+    return values if isinstance(values, StringColumn) else tuple(values)
+
+
+def _sniff_delimiter(first_line):
+    if '\t' in first_line:
+        return '\t'
+    if ';' in first_line:
+        return ';'
+    return ','
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_station_csv(path, mtime=None):
+    """
+    Parse the CSV at `path` into a canonical StationTable (one row per OPIS
+    ID and address, see fuel.canonical). Rows without a usable price are dropped.
+    """
+    ids, names, addresses, cities, states, rack_ids, prices = [], [], [], [], [], [], []
+    intern = {}
+
+    with open(path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        delimiter = _sniff_delimiter(f.readline())
+        f.seek(0)
+        reader = csv.reader(f, delimiter=delimiter)
+        headers = [h.strip() for h in next(reader, [])]
+        col = {h: i for i, h in enumerate(headers)}
+        try:
+            i_id = col["OPIS Truckstop ID"]
+            i_name = col["Truckstop Name"]
+            i_addr = col["Address"]
+            i_city = col["City"]
+            i_state = col["State"]
+            i_rack = col["Rack ID"]
+            i_price = col["Retail Price"]
+        except KeyError as e:
+            raise ValueError(f"Fuel CSV {path} is missing column {e}") from None
+
+        width = len(headers)
+        for row in reader:
+            if len(row) != width:
+                continue
+            try:
+                price = float(row[i_price].replace('$', '').replace(',', ''))
+            except ValueError:
+                continue
+            if price <= 0:
+                continue
+
+            city = row[i_city].strip()
+            state = row[i_state].strip().upper()
+            ids.append(_to_int(row[i_id]))
+            names.append(row[i_name].strip())
+            addresses.append(row[i_addr].strip())
+            cities.append(intern.setdefault(city, city))
+            states.append(intern.setdefault(state, state))
+            rack_ids.append(_to_int(row[i_rack]))
+            prices.append(price)
+
+    table = StationTable(ids, names, addresses, cities, states, rack_ids, prices, source=path, mtime=mtime)
+    table, dropped = canonicalize_table(table)
+    if dropped:
+        logger.info("Collapsed %d duplicate station rows in %s", dropped, path)
+    coords = geocode_stations(table)
+    # Stations only located to their state stay unplaced (NaN), out of the spatial index and planning
+    nan = float("nan")
+    points = [c[:2] if placed(c) else (nan, nan) for c in coords]
+    unplaced = sum(1 for c in coords if not placed(c))
+    if unplaced:
+        logger.info("%d of %d stations in %s have no position finer than their state", unplaced, len(points), path)
+    return table.with_coordinates([p[0] for p in points], [p[1] for p in points])
+
+
+def station_snapshot_path():
+    """
+    Path of the compiled station snapshot (settings.FUEL_STATION_SNAPSHOT), None when disabled
+    """
+    path = getattr(settings, "FUEL_STATION_SNAPSHOT", None)
+    return str(path) if path else None
+
+
+def snapshot_sources(path=None):
+    """
+    Files a compiled snapshot of the CSV at `path` is built from
+    """
+    return [
+        path or station_csv_path(), station_coords_path(),
+        os.path.join(GAZETTEER_DIR, "city_centroids.csv"), os.path.join(GAZETTEER_DIR, "state_centroids.csv"),
+    ]
+
+
+def load_compiled_table(path, source=None, mtime=None):
+    """
+    StationTable memory-mapped from a compiled snapshot (see fuel.compiled),
+    plus the snapshot header
+    """
+    header, columns = read_station_snapshot(path)
+    table = StationTable(
+        columns["ids"], columns["names"], columns["addresses"], columns["cities"], columns["states"],
+        columns["rack_ids"], columns["prices"], lats=columns["lats"], lons=columns["lons"],
+        source=source or path, mtime=mtime,
+    )
+    return table, header
+
+
+def _compiled_table(csv_path, mtime):
+    # The compiled snapshot when it was built from exactly these sources, else None
+    snapshot = station_snapshot_path()
+    if not snapshot or not os.path.exists(snapshot):
+        return None
+    try:
+        table, header = load_compiled_table(snapshot, source=csv_path, mtime=mtime)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring station snapshot %s: %s", snapshot, e)
+        return None
+    if header.get("source_digest") != source_digest(snapshot_sources(csv_path)) or \
+            header.get("price_policy") != price_policy():
+        logger.info("Station snapshot %s is out of date, parsing %s", snapshot, csv_path)
+        return None
+    return table
+
+
+def build_snapshot_table(version, rows):
+    """
+    StationTable from datalake.snapshot.snapshot_rows() output
+    """
+    ids, names, addresses, cities, states, rack_ids, prices, lats, lons = [], [], [], [], [], [], [], [], []
+    intern = {}
+    nan = float("nan")
+    for opis_id, name, address, city, state, rack_id, price, lat, lon in rows:
+        ids.append(opis_id)
+        names.append(name)
+        addresses.append(address)
+        cities.append(intern.setdefault(city, city))
+        states.append(intern.setdefault(state, state))
+        rack_ids.append(rack_id or 0)
+        prices.append(price)
+        lats.append(nan if lat is None else lat)
+        lons.append(nan if lon is None else lon)
+    return StationTable(
+        ids, names, addresses, cities, states, rack_ids, prices,
+        lats=lats, lons=lons, source="datalake", mtime=("datalake", version),
+    )
+
+
+_table = None
+_lock = threading.Lock()
+_snapshot_checked = 0.0
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _source_mtime(path):
+    # The station cache feeds the coordinate columns, so it counts as a source too
+    csv_mtime = _mtime(path)
+    if csv_mtime is None:
+        return None
+    return (csv_mtime, _mtime(station_coords_path()))
+
+
+def _datalake_table():
+    """
+    Shared StationTable built from the datalake LatestPrice snapshot.
+
+    The snapshot version is polled at most every FUEL_SNAPSHOT_POLL_SECONDS
+    and the table is only rebuilt when the version moved.
+    """
+    global _table, _snapshot_checked
+    from datalake.snapshot import snapshot_rows, snapshot_version
+
+    table = _table
+    now = time.monotonic()
+    if table is not None and table.source == "datalake" and now - _snapshot_checked < settings.FUEL_SNAPSHOT_POLL_SECONDS:
+        return table
+
+    with _lock:
+        table = _table
+        version = snapshot_version()
+        _snapshot_checked = now
+        if table is not None and table.mtime == ("datalake", version):
+            return table
+        table = build_snapshot_table(*snapshot_rows())
+        logger.info("Loaded %d stations from datalake snapshot v%s", len(table), table.mtime[1])
+        _table = table
+    return table
+
+
+def get_station_table():
+    """
+    Shared StationTable for the configured source.
+
+    With FUEL_STATION_SOURCE = 'datalake' the table mirrors the LatestPrice
+    snapshot. Otherwise the CSV is loaded on first use and reloaded when the
+    file's mtime changes: memory-mapped from the compiled snapshot
+    (FUEL_STATION_SNAPSHOT) when that was built from the same CSV, else
+    parsed. Either way the new table is built off to the side and swapped
+    in with a single assignment, so callers holding the previous table keep
+    a consistent snapshot.
+    """
+    global _table
+    if getattr(settings, "FUEL_STATION_SOURCE", "csv") == "datalake":
+        return _datalake_table()
+
+    path = station_csv_path()
+    mtime = _source_mtime(path)
+
+    table = _table
+    if table is not None and table.source == path and table.mtime == mtime:
+        return table
+
+    with _lock:
+        table = _table
+        if table is not None and table.source == path and table.mtime == mtime:
+            return table
+        if mtime is None:
+            logger.error("Fuel CSV not found: %s", path)
+            table = StationTable([], [], [], [], [], [], [], source=path, mtime=None)
+        else:
+            table = _compiled_table(path, mtime)
+            if table is not None:
+                logger.info("Mapped %d stations from snapshot %s", len(table), station_snapshot_path())
+            else:
+                table = parse_station_csv(path, mtime=mtime)
+                logger.info("Loaded %d stations from %s", len(table), path)
+        _table = table
+    return table
+
+
+def collect_station_metrics():
+    """
+    Scrape-time samples for config.metrics: size of the loaded station table and its indexes
+    """
+    table = _table
+    if table is None:
+        return []
+    samples = [('fuelroute_stations', 'gauge', 'Stations in the shared station table', None, len(table))]
+    grid = table._derived.get("station_grid")
+    if grid is not None:
+        samples.append(('fuelroute_stations_indexed', 'gauge', 'Geocoded stations in the spatial index', None, len(grid)))
+    return samples
@@ -1,3 +1,442 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from config import codec
+
+from fuel.canonical import PriceMerger, canonicalize_table
+from fuel.compiled import write_station_snapshot
+from fuel.query import get_query_index
+from fuel import stations
+from fuel.stations import StationTable, _compiled_table, get_station_table, load_compiled_table
+
+
+def _table(rows):
+    ids, names, addresses, prices = zip(*rows)
+    n = len(rows)
+    return StationTable(ids, names, addresses, ["Gila Bend"] * n, ["AZ"] * n, [930] * n, prices)
+
+
+class CanonicalizeTableTests(SimpleTestCase):
+    rows = [
+        (20, "PILOT TRAVEL CENTER #1243", "I-8, EXIT 119 & SR-85", 3.899),
+        (21, "LOVES #301", "I-8, EXIT 115", 3.5),
+        (20, "PILOT #1243", "I-8, EXIT 119 & SR-85", 3.799),
+    ]
+
+    def test_collapses_rows_by_id_and_address(self):
+        table, dropped = canonicalize_table(_table(self.rows), "min")
+        self.assertEqual(dropped, 1)
+        self.assertEqual(list(table.ids), [20, 21])
+        self.assertEqual(table.names[0], "PILOT TRAVEL CENTER #1243")
+        self.assertEqual(list(table.prices), [3.799, 3.5])
+
+    def test_price_policies(self):
+        for policy, expected in (("latest", 3.799), ("mean", (3.899 + 3.799) / 2)):
+            table, _ = canonicalize_table(_table(self.rows), policy)
+            self.assertAlmostEqual(table.prices[0], expected)
+
+    def test_unknown_policy_is_rejected(self):
+        from django.core.exceptions import ImproperlyConfigured
+        with self.assertRaises(ImproperlyConfigured):
+            PriceMerger("max")
+
+
+class StationTableReloadTests(SimpleTestCase):
+    header = "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n"
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, "prices.csv")
+        overrides = override_settings(
+            FUEL_PRICES_CSV=self.path, FUEL_STATION_SNAPSHOT=None,
+            FUEL_STATION_COORDS_CSV=os.path.join(tmp, "coords.csv"),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patch = mock.patch.object(stations, "_table", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def write(self, prices, bump=0):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(self.header)
+            for i, price in enumerate(prices, 1):
+                f.write(f"{i},STOP {i},I-20 EXIT {i},Abilene,TX,1,{price}\n")
+        mtime = os.stat(self.path).st_mtime_ns + bump
+        os.utime(self.path, ns=(mtime, mtime))
+
+    def test_table_is_shared_until_the_csv_changes(self):
+        self.write([3.1, 3.2])
+        table = get_station_table()
+        self.assertIs(get_station_table(), table)
+        built = []
+        table.derived("probe", lambda t: built.append(t) or len(t))
+        table.derived("probe", lambda t: built.append(t) or len(t))
+        self.assertEqual(len(built), 1)
+
+        self.write([2.9, 3.0, 3.3], bump=10 ** 9)
+        fresh = get_station_table()
+        self.assertIsNot(fresh, table)
+        self.assertEqual(list(fresh.prices), [2.9, 3.0, 3.3])
+        # Derived structures belong to their table and are rebuilt for the new one
+        self.assertEqual(fresh.derived("probe", len), 3)
+        # Holders of the previous table keep a consistent view
+        self.assertEqual(list(table.prices), [3.1, 3.2])
+        self.assertEqual(table.derived("probe", len), 2)
+
+    def test_missing_csv_gives_an_empty_table(self):
+        with self.assertLogs("fuel.stations", "ERROR"):
+            table = get_station_table()
+        self.assertEqual(len(table), 0)
+        self.write([3.1])
+        self.assertEqual(len(get_station_table()), 1)
+
+
+class GeocodingTests(SimpleTestCase):
+    gazetteer = ({("abilene", "TX"): (32.45, -99.73)}, {"TX": (31.0, -100.0)})
+
+    def test_lookup_order(self):
+        from fuel.geocoding import locate_station, placed
+
+        cached = {(7, "I-20 EXIT 1"): (32.4, -99.8, "cache")}
+        self.assertEqual(locate_station(7, "I-20 EXIT 1", "Abilene", "TX", cached, self.gazetteer)[2], "cache")
+        geocoder = lambda address, city, state: (32.5, -99.7) if city == "Abilene" else None  # noqa: E731
+        self.assertEqual(locate_station(8, "", "Abilene", "TX", {}, self.gazetteer, geocoder)[2], "geocoder")
+        self.assertEqual(locate_station(8, "", "abilene ", "tx", {}, self.gazetteer), (32.45, -99.73, "city"))
+
+        state_only = locate_station(8, "", "Nowhere", "TX", {}, self.gazetteer)
+        self.assertEqual(state_only[2], "state")
+        self.assertIsNone(locate_station(8, "", "Nowhere", "ZZ", {}, self.gazetteer))
+        self.assertFalse(placed(state_only))
+        self.assertFalse(placed(None))
+        self.assertTrue(placed((32.45, -99.73, "city")))
+
+    def test_state_only_stations_stay_out_of_route_search(self):
+        from fuel.spatial import StationGrid
+        from fuel.stations import parse_station_csv
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "prices.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n")
+                f.write("1,CITY STOP,I-20 EXIT 286,Abilene,TX,1,3.1\n")
+                f.write("2,STATE STOP,I-10 EXIT 1,Nowhere,TX,1,2.9\n")
+            with override_settings(FUEL_STATION_COORDS_CSV=os.path.join(tmp, "coords.csv")):
+                table = parse_station_csv(path)
+        self.assertAlmostEqual(table.row(0)["Latitude"], 32.45, places=2)
+        self.assertIsNone(table.row(1)["Latitude"])
+        self.assertEqual(len(StationGrid(table.lats, table.lons)), 1)
+
+    def test_place_names_are_normalised(self):
+        from fuel.geocoding import place_key
+
+        self.assertEqual(place_key("St. Louis", "mo"), place_key("Saint Louis", "MO"))
+        self.assertEqual(place_key("Mc Calla", "AL"), place_key("McCalla", "AL"))
+        self.assertEqual(place_key("Montréal", "QC"), place_key("Montreal", "QC"))
+        self.assertNotEqual(place_key("Springfield", "IL"), place_key("Springfield", "MO"))
+
+    def test_gazetteer_prefers_geonames_and_medians_postal_codes(self):
+        from fuel.management.commands.build_gazetteer import merge_places
+
+        geonames = [("Springfield", "IL", 39.8, -89.6, 100), ("Springfield", "IL", 41.0, -88.0, 5)]
+        postal = [
+            ("SPRINGFIELD", "IL", 10.0, 10.0),
+            ("HOPE HULL", "AL", 32.27, -86.35), ("HOPE HULL", "AL", 32.25, -86.36), ("HOPE HULL", "AL", 40.0, -70.0),
+        ]
+        places = merge_places(geonames, postal)
+        self.assertEqual(places[("springfield", "IL")], ("Springfield", "IL", 39.8, -89.6, 100))
+        self.assertEqual(places[("hopehull", "AL")], ("Hope Hull", "AL", 32.27, -86.35, 0))
+
+    def test_shipped_stations_are_placed(self):
+        from fuel.stations import parse_station_csv
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with override_settings(FUEL_STATION_COORDS_CSV=os.path.join(tmp, "coords.csv")):
+                table = parse_station_csv(settings.FUEL_PRICES_CSV)
+        placed = sum(1 for lat in table.lats if lat == lat)
+        self.assertGreaterEqual(placed / len(table), 0.98)
+
+
+class StationGridTests(SimpleTestCase):
+
+    def test_corridor_matches_brute_force(self):
+        import numpy as np
+        from fuel.spatial import StationGrid, project_many
+
+        rng = np.random.default_rng(7)
+        lats = rng.uniform(34.0, 37.0, 2000)
+        lons = rng.uniform(-100.0, -95.0, 2000)
+        lats[:50] = np.nan  # unplaced stations are never hits
+        route = [[-99.5, 34.5], [-98.0, 35.5], [-97.9, 35.6], [-96.0, 35.0], [-95.5, 36.5]]
+        hits = StationGrid(lats, lons, cell_miles=7.0).corridor(route, 8.0)
+
+        # Distance from every station to every segment, in the same projection
+        xs, ys = project_many([p[1] for p in route], [p[0] for p in route])
+        px, py = project_many(lats, lons)
+        x1, y1, dx, dy = xs[:-1], ys[:-1], np.diff(xs), np.diff(ys)
+        t = np.clip(((px[:, None] - x1) * dx + (py[:, None] - y1) * dy) / (dx * dx + dy * dy), 0, 1)
+        d = np.hypot(x1 + t * dx - px[:, None], y1 + t * dy - py[:, None]).min(axis=1)
+        expected = set(np.flatnonzero(d <= 8.0).tolist())
+
+        self.assertEqual({h.index for h in hits}, expected)
+        self.assertTrue(all(h.index >= 50 for h in hits))
+        along = [h.along_miles for h in hits]
+        self.assertEqual(along, sorted(along))
+        for h in hits:
+            self.assertAlmostEqual(h.offset_miles, d[h.index], places=6)
+
+
+def _cheapest_purchase(positions, prices, route_miles, tank, start):
+    """
+    Minimum purchase cost by DP over (station, whole gallons in the tank),
+    or None when the route can't be driven. With 1 mpg and whole-mile
+    positions the optimum buys whole gallons, so the DP is exact.
+    """
+    inf = float("inf")
+    # cost[f]: cheapest way to be at the current point with f gallons
+    cost = [inf] * (tank + 1)
+    cost[start] = 0.0
+    here = 0
+    for position, price in [*zip(positions, prices), (route_miles, None)]:
+        leg = position - here
+        cost = [cost[f + leg] if f + leg <= tank else inf for f in range(tank + 1)]
+        if price is None:
+            break
+        for f in range(1, tank + 1):
+            cost[f] = min(cost[f], cost[f - 1] + price)
+        here = position
+    best = min(cost)
+    return None if best == inf else best
+
+
+class PlannerTests(SimpleTestCase):
+
+    def test_matches_brute_force_on_small_cases(self):
+        import random
+        from fuel.planner import RouteNotCoverable, plan_fuel_stops
+
+        rng = random.Random(3)
+        for _ in range(400):
+            route_miles = rng.randint(0, 40)
+            positions = sorted(rng.randint(0, route_miles) for _ in range(rng.randint(0, 6)))
+            prices = [rng.choice([3.0, 3.25, 3.5, 4.0]) for _ in positions]
+            tank = rng.randint(3, 12)
+            start = rng.randint(0, tank)
+            expected = _cheapest_purchase(positions, prices, route_miles, tank, start)
+            case = (positions, prices, route_miles, tank, start)
+            try:
+                plan = plan_fuel_stops(positions, prices, route_miles, tank_gallons=tank, mpg=1, start_fuel=start)
+            except RouteNotCoverable:
+                self.assertIsNone(expected, case)
+                continue
+            self.assertIsNotNone(expected, case)
+            self.assertAlmostEqual(plan.total_cost, expected, msg=case)
+            self.assertAlmostEqual(plan.end_fuel, start + plan.total_gallons - route_miles)
+            self.assertTrue(all(s.gallons > 0 for s in plan.stops))
+
+    def test_uncoverable_gap(self):
+        from fuel.planner import RouteNotCoverable, plan_fuel_stops
+
+        with self.assertRaises(RouteNotCoverable) as ctx:
+            plan_fuel_stops([100, 150, 400], [3.0, 3.0, 3.0], 500, tank_gallons=20, mpg=10)
+        self.assertEqual((ctx.exception.gap_start_miles, ctx.exception.gap_end_miles), (150, 400))
+        # Empty tank and no station at the start
+        with self.assertRaises(RouteNotCoverable):
+            plan_fuel_stops([5], [3.0], 50, tank_gallons=20, mpg=10, start_fuel=0)
+
+    def test_station_at_mile_zero(self):
+        from fuel.planner import plan_fuel_stops
+
+        plan = plan_fuel_stops([0, 150], [3.0, 4.0], 300, tank_gallons=20, mpg=10, start_fuel=0)
+        self.assertEqual([(s.miles, s.gallons) for s in plan.stops], [(0, 20), (150, 10)])
+        self.assertAlmostEqual(plan.total_cost, 100.0)
+        self.assertAlmostEqual(plan.end_fuel, 0.0)
+
+    def test_zero_length_route(self):
+        from fuel.planner import plan_fuel_stops
+
+        plan = plan_fuel_stops([0], [3.0], 0, start_fuel=0)
+        self.assertEqual(plan.stops, [])
+        self.assertEqual((plan.total_cost, plan.trip_cost), (0, 0))
+
+    def test_trip_cost_counts_fuel_from_the_starting_tank(self):
+        from fuel.planner import plan_fuel_stops
+
+        # Short enough to drive on the full starting tank: nothing bought, still not free
+        plan = plan_fuel_stops([10, 20], [3.0, 4.0], 35, tank_gallons=50, mpg=10)
+        self.assertEqual(plan.total_cost, 0)
+        self.assertAlmostEqual(plan.trip_cost, 3.5 * 3.5)
+        plan = plan_fuel_stops([], [], 35, tank_gallons=50, mpg=10, tank_price=3.2)
+        self.assertAlmostEqual(plan.trip_cost, 3.5 * 3.2)
+
+
+class CompiledSnapshotTests(SimpleTestCase):
+
+    def test_round_trip_and_staleness(self):
+        nan = float("nan")
+        table = _table(CanonicalizeTableTests.rows).with_coordinates([32.9, nan, 32.9], [-112.7, nan, -112.7])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stations.snapshot')
+            write_station_snapshot(table, path, digest="abc", price_policy="min")
+            mapped, header = load_compiled_table(path)
+            self.assertEqual(header["source_digest"], "abc")
+            self.assertIsInstance(mapped.ids, memoryview)
+            self.assertEqual([mapped.row(i) for i in range(3)], [table.row(i) for i in range(3)])
+            # Rows sharing a value share one decoded string
+            self.assertIs(mapped.cities[0], mapped.cities[2])
+
+            with override_settings(FUEL_STATION_SNAPSHOT=path):
+                self.assertIsNone(_compiled_table(settings.FUEL_PRICES_CSV, mtime=None))
+
+
+class QueryIndexTests(SimpleTestCase):
+    def _table(self):
+        import random
+
+        rng = random.Random(3)
+        n = 300
+        states = [rng.choice(["TX", "OK", "NM"]) for _ in range(n)]
+        cities = [rng.choice(["Amarillo", "Dalhart", "Clovis"]) for _ in range(n)]
+        # Whole cents with plenty of ties, so ordering within equal prices is exercised
+        prices = [round(rng.uniform(3.0, 3.3), 2) for _ in range(n)]
+        return StationTable(list(range(n)), [f"Stop {i}" for i in range(n)], [""] * n, cities, states, [0] * n, prices)
+
+    def test_select_matches_a_scan(self):
+        table = self._table()
+        index = get_query_index(table)
+        for state, city, lo, hi in (
+            (None, None, None, None), ("tx", None, None, None), (None, "CLOVIS", 3.1, None),
+            ("NM", "Dalhart", None, 3.2), ("OK", None, 3.05, 3.15), ("TX", None, 3.4, None), ("ZZ", None, None, None),
+        ):
+            expected = [
+                i for i in range(len(table))
+                if (state is None or table.states[i] == state.upper())
+                and (city is None or table.cities[i].lower() == city.lower())
+                and (lo is None or table.prices[i] >= lo) and (hi is None or table.prices[i] <= hi)
+            ]
+            by_price = sorted(expected, key=lambda i: (table.prices[i], i))
+            for sort in (None, "price_asc", "price_desc"):
+                rows = index.select(state=state, city=city, min_price=lo, max_price=hi, sort=sort)
+                self.assertEqual(len(rows), len(expected))
+                if sort == "price_desc":
+                    want = by_price[::-1]
+                elif sort or lo is not None or hi is not None:
+                    want = by_price
+                else:
+                    want = expected
+                self.assertEqual(rows[0:len(rows)], want, (state, city, lo, hi, sort))
+                # Pages are windows of the same order
+                self.assertEqual(rows[5:15], want[5:15])
+                self.assertEqual(rows[len(rows) + 10:len(rows) + 20], [])
+
+    def test_listing_cache_is_lru_and_per_table(self):
+        from fuel.query import ListingCache, get_listing_cache
+
+        cache = ListingCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+        table = self._table()
+        self.assertIs(get_listing_cache(table), get_listing_cache(table))
+        self.assertIsNot(get_listing_cache(self._table()), get_listing_cache(table))
+
+
+class FuelPriceListTests(SimpleTestCase):
+
+    def test_codecs_render_the_same_listing(self):
+        table = get_station_table()
+        bodies = []
+        for name in ("stdlib", "orjson"):
+            with override_settings(JSON_CODEC=name):
+                response = self.client.get('/api/fuel-prices/', {'state': 'TX', 'sort': 'price_asc', 'page_size': 5})
+            self.assertEqual(response.status_code, 200)
+            bodies.append(response.json())
+        self.assertEqual(bodies[0], bodies[1])
+        cheapest = get_query_index(table).select(state='TX', sort='price_asc')[0:1][0]
+        self.assertEqual(bodies[0]["results"][0], table.row(cheapest))
+
+    def test_conditional_get_until_the_data_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'fuel_prices.csv')
+            shutil.copy(settings.FUEL_PRICES_CSV, csv_path)
+            with override_settings(FUEL_PRICES_CSV=csv_path):
+                first = self.client.get('/api/fuel-prices/', {'state': 'TX', 'page': 2})
+                etag = first['ETag']
+                self.assertIn('max-age=', first['Cache-Control'])
+                # Parameter order and case don't change the page
+                again = self.client.get('/api/fuel-prices/?page=2&state=tx', HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.content, b'')
+
+                mtime = os.stat(csv_path).st_mtime_ns + 10 ** 9
+                os.utime(csv_path, ns=(mtime, mtime))
+                fresh = self.client.get('/api/fuel-prices/', {'state': 'TX', 'page': 2}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(fresh.status_code, 200)
+                self.assertNotEqual(fresh['ETag'], etag)
+                self.assertEqual(fresh.json(), first.json())
+
+    def test_fragments_are_spliced_verbatim(self):
+        body = codec.dumps_fragments({"count": 2, "results": [codec.Fragment(b'{"a":1}'), {"b": 2}]})
+        self.assertEqual(body, b'{"count":2,"results":[{"a":1},{"b":2}]}')
+        with override_settings(JSON_CODEC="stdlib"):
+            self.assertEqual(codec.loads(codec.dumps_indented([codec.Fragment(b'{"a":1}')], 2)), [{"a": 1}])
+
+
+class PriceAggregatesTests(SimpleTestCase):
+    def _table(self):
+        # Stations along the 35th parallel plus one far off it, cheaper than all of them
+        n = 40
+        lons = [-110 + 0.25 * i for i in range(n)] + [-100.0]
+        lats = [35.0 + (0.05 if i % 2 else -0.05) for i in range(n)] + [40.0]
+        prices = [3.0 + ((i * 7) % 13) / 10 for i in range(n)] + [2.5]
+        states = ["AZ" if i < 20 else "NM" for i in range(n)] + ["CO"]
+        cities = [f"Town {i % 4}" for i in range(n)] + ["Denver"]
+        return StationTable(
+            list(range(n + 1)), [f"Stop {i}" for i in range(n + 1)], [""] * (n + 1), cities, states,
+            [0] * (n + 1), prices, lats=lats, lons=lons,
+        )
+
+    def test_regional_stats(self):
+        from fuel.aggregates import PriceAggregates
+
+        table = self._table()
+        aggregates = PriceAggregates(table)
+        az = aggregates.state("az")
+        self.assertEqual(az.count, 20)
+        self.assertAlmostEqual(az.min, min(table.prices[:20]))
+        self.assertEqual(aggregates.states_by_median[0], "CO")
+        self.assertEqual(aggregates.city("NM", "town 1").count, 5)
+        k = aggregates.cell_of(40.0, -100.0)
+        self.assertEqual(aggregates.cell_stats(k).cheapest, 40)
+
+    def test_pruned_ranking_matches_the_corridor(self):
+        from fuel.aggregates import PriceAggregates
+        from fuel.spatial import StationGrid
+        from routes.geometry import RouteGeometry
+
+        table = self._table()
+        route = RouteGeometry([[-110.5 + 0.01 * i, 35.0] for i in range(1100)])
+        xs, ys = route.xy
+        ranked = PriceAggregates(table).cheapest_along(xs, ys, route.cumulative_miles, 10.0, 5)
+        hits = StationGrid(table.lats, table.lons).corridor(route, 10.0)
+        expected = sorted(hits, key=lambda h: (table.prices[h.index], h.along_miles))[:5]
+        self.assertEqual([h.index for h in ranked], [h.index for h in expected])
+        self.assertNotIn(40, [h.index for h in ranked])
+
+    def test_regions_endpoint(self):
+        response = self.client.get('/api/fuel-prices/regions/?limit=3')
+        self.assertEqual(response.status_code, 200)
+        states = response.json()["states"]
+        self.assertLessEqual(len(states), 3)
+        self.assertEqual([s["median"] for s in states], sorted(s["median"] for s in states))
+        again = self.client.get('/api/fuel-prices/regions/?limit=3', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import dummy_view, fuel_price_list
+from .views import dummy_view, fuel_price_heatmap, fuel_price_list, fuel_price_regions
 
 urlpatterns = [
     path('ping/', dummy_view),
     path('fuel-prices/', fuel_price_list),
+    path('fuel-prices/regions/', fuel_price_regions),
+    path('fuel-prices/heatmap/', fuel_price_heatmap),
 ]
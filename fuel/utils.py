@@ -1,152 +1,224 @@
-import os
-import csv
-import math
+import hashlib
+import logging
+from bisect import bisect_left
+
+from config.metrics import span
+from fuel.aggregates import get_price_aggregates
+from fuel.planner import DEFAULT_MPG, DEFAULT_TANK_GALLONS, plan_fuel_stops
+from fuel.query import ListingCache
+from fuel.spatial import CorridorHit, get_station_grid, polyline_miles
+from fuel.stations import get_station_table
+from routes.geometry import RouteGeometry
+
+logger = logging.getLogger(__name__)
+
+# How far off the route polyline a station may be and still count as "on the way"
+CORRIDOR_RADIUS_MILES = 10.0
+# Leg corridors kept per station table by leg_corridor()
+CORRIDOR_CACHE_ENTRIES = 512
+
 
 def load_fuel_data():
     """
-    SIMPLE CSV loader - just get the data
-    """
-    try:
-        # Try to find the CSV
-        base_dir = os.path.dirname(os.path.dirname(__file__))
-        csv_path = os.path.join(base_dir, "data", "fuel-prices-for-be-assessment.csv")
-        
-        if not os.path.exists(csv_path):
-            print(f"[ERROR] CSV not found: {csv_path}")
-            # Try current directory
-            csv_path = "fuel-prices-for-be-assessment.csv"
-        
-        print(f"[DEBUG] Loading CSV from: {csv_path}")
-        
-        with open(csv_path, 'r', encoding='utf-8', errors='ignore') as f:
-            # Read first line to check format
-            first_line = f.readline().strip()
-            f.seek(0)
-            
-            print(f"[DEBUG] First line: {first_line[:100]}...")
-            
-            # Try to guess delimiter
-            if '\t' in first_line:
-                delimiter = '\t'
-            elif ';' in first_line:
-                delimiter = ';'
-            else:
-                delimiter = ','
-            
-            reader = csv.reader(f, delimiter=delimiter)
-            rows = list(reader)
-            
-            if not rows:
-                print("[ERROR] CSV is empty")
-                return []
-            
-            # Convert to list of dicts
-            headers = [h.strip() for h in rows[0]]
-            print(f"[DEBUG] Headers: {headers}")
-            
-            data = []
-            for i, row in enumerate(rows[1:], 1):
-                if i <= 5:  # Print first 5 rows for debugging
-                    print(f"[DEBUG] Row {i}: {row}")
-                
-                if len(row) == len(headers):
-                    row_dict = {headers[j]: val.strip() for j, val in enumerate(row)}
-                    data.append(row_dict)
-            
-            print(f"[DEBUG] Loaded {len(data)} rows")
-            return data
-            
-    except Exception as e:
-        print(f"[ERROR] Could not load CSV: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
+    Station rows as a list of dicts keyed by the CSV column names.
+
+    Built from the shared in-memory station table, the CSV is not re-read.
+    """
+    table = get_station_table()
+    return [table.row(i) for i in range(len(table))]
+
+
+def as_route_geometry(route_coords):
+    if isinstance(route_coords, RouteGeometry):
+        return route_coords
+    return RouteGeometry(route_coords)
+
+
+def corridor_stations(route_coords, radius_miles=CORRIDOR_RADIUS_MILES, table=None):
+    """
+    Stations within `radius_miles` of the route ([lng, lat] pairs), ordered along the route
+    """
+    table = table or get_station_table()
+    return get_station_grid(table).corridor(route_coords, radius_miles)
+
+
+def stop_from_hit(table, hit):
+    i = hit.index
+    row = table.row(i)
+    return {
+        "station_id": table.ids[i],
+        "name": table.names[i],
+        "address": table.addresses[i],
+        "state": table.states[i][:2],
+        "city": table.cities[i] or "Unknown",
+        "fuel_price": round(table.prices[i], 3),
+        "lat": row["Latitude"],
+        "lng": row["Longitude"],
+        "miles_from_start": round(hit.along_miles, 1),
+    }
+
+
+def get_corridor_cache(table):
+    """
+    LRU of corridor hits per leg geometry, kept per station table
+    """
+    return table.derived("corridor_cache", lambda t: ListingCache(CORRIDOR_CACHE_ENTRIES))
+
+
+def leg_corridor(geometry, radius_miles=CORRIDOR_RADIUS_MILES, table=None):
+    """
+    corridor_stations() for one leg, memoised on the leg's exact vertices,
+    so a leg shared by several routes (waypoint routes, matrix cells,
+    repeated lanes) is projected once per station table
+    """
+    table = table or get_station_table()
+    geometry = as_route_geometry(geometry)
+    key = (hashlib.blake2b(geometry.coords.tobytes(), digest_size=16).digest(), radius_miles)
+    cache = get_corridor_cache(table)
+    hits = cache.get(key)
+    if hits is None:
+        hits = corridor_stations(geometry, radius_miles, table=table)
+        cache.put(key, hits)
+    return hits
+
+
+def _route_hits(route_coords, legs, table):
+    # Corridor hits of a route made of legs starting at the given vertices, along miles on the whole route
+    if not legs or len(legs) < 2:
+        return leg_corridor(route_coords, table=table)
+    cumulative = route_coords.cumulative_miles
+    bounds = [leg["first_vertex"] for leg in legs] + [len(route_coords) - 1]
+    hits = []
+    previous = set()
+    for lo, hi in zip(bounds, bounds[1:]):
+        offset = float(cumulative[lo])
+        leg_hits = leg_corridor(RouteGeometry(route_coords.coords[lo:hi + 1]), table=table)
+        # A station near a waypoint is in the corridor of both legs there, keep it once
+        hits.extend(
+            CorridorHit(hit.index, offset + hit.along_miles, hit.offset_miles) for hit in leg_hits
+            if hit.index not in previous or hit.along_miles > 2 * CORRIDOR_RADIUS_MILES
+        )
+        previous = {hit.index for hit in leg_hits}
+    return hits
+
+
+def route_candidates(route_coords, route_miles=None, table=None, legs=None):
+    """
+    Corridor stations of a route as (hits, positions, prices), positions
+    being road miles from the start: the projection along the polyline
+    rescaled so its length matches `route_miles` (the distance reported by
+    the routing service). `legs` is the 'legs' list of a waypoint route
+    (routes.services.join_legs); each leg's corridor is looked up separately.
+    """
+    table = table or get_station_table()
+    route_coords = as_route_geometry(route_coords)
+    geometry_miles = polyline_miles(route_coords)
+    if route_miles is None:
+        route_miles = geometry_miles
+    scale = route_miles / geometry_miles if geometry_miles > 0 else 1.0
+
+    with span("corridor"):
+        hits = _route_hits(route_coords, legs, table)
+    positions = [hit.along_miles * scale for hit in hits]
+    prices = [table.prices[hit.index] for hit in hits]
+    return hits, positions, prices
+
+
+def mean_price(table):
+    """
+    Average price over all stations of a table (0.0 when it is empty)
+    """
+    return table.derived("mean_price", lambda t: sum(t.prices) / len(t) if len(t) else 0.0)
+
+
+def plan_candidates(table, hits, positions, prices, route_miles, tank_gallons=DEFAULT_TANK_GALLONS,
+                    mpg=DEFAULT_MPG, start_fuel=None, offset_miles=0.0):
+    """
+    Plan over route_candidates() output. With `offset_miles` only the part
+    of the route past that mile is planned, starting there with `start_fuel`.
+    Returns (plan, stops) with plan positions relative to `offset_miles` and
+    stop miles from the start of the route. The plan's trip_cost values the
+    starting fuel at the mean price of the stations ahead.
+    """
+    first = bisect_left(positions, offset_miles)
+    if offset_miles:
+        positions = [p - offset_miles for p in positions[first:]]
+        prices = prices[first:]
+    with span("plan"):
+        # With no station on the route the starting fuel is valued at the average price of all stations
+        plan = plan_fuel_stops(positions, prices, route_miles - offset_miles,
+                               tank_gallons=tank_gallons, mpg=mpg, start_fuel=start_fuel,
+                               tank_price=None if prices else mean_price(table))
+
+    stops = []
+    for stop in plan.stops:
+        row = stop_from_hit(table, hits[first + stop.candidate])
+        row["miles_from_start"] = round(offset_miles + stop.miles, 1)
+        row["gallons"] = round(stop.gallons, 2)
+        row["cost"] = round(stop.cost, 2)
+        stops.append(row)
+    return plan, stops
+
+
+def plan_route_fuel(route_coords, route_miles=None, tank_gallons=DEFAULT_TANK_GALLONS,
+                    mpg=DEFAULT_MPG, start_fuel=None, table=None, legs=None):
+    """
+    Cheapest refuelling plan for a route given as [lng, lat] pairs or a RouteGeometry.
+
+    Returns (plan, stops) where stops are stop dicts with the gallons and
+    cost bought at each (see route_candidates for how stations are placed).
+    Raises fuel.planner.RouteNotCoverable when the range can't bridge a gap.
+    """
+    with span("fuel_data"):
+        table = table or get_station_table()
+    route_coords = as_route_geometry(route_coords)
+    if route_miles is None:
+        route_miles = polyline_miles(route_coords)
+    hits, positions, prices = route_candidates(route_coords, route_miles, table=table, legs=legs)
+    return plan_candidates(table, hits, positions, prices, route_miles,
+                           tank_gallons=tank_gallons, mpg=mpg, start_fuel=start_fuel)
+
+
+def cheapest_on_route(route_coords, limit=10, radius_miles=CORRIDOR_RADIUS_MILES, route_miles=None, table=None):
+    """
+    The `limit` cheapest stations within `radius_miles` of a route, cheapest
+    first, as stop dicts with miles_from_start rescaled to `route_miles` and
+    the station's offset_miles from the route.
+
+    Uses the coarse price grid of fuel.aggregates to skip every part of the
+    corridor whose regional minimum can't beat the stations already found.
+    """
+    table = table or get_station_table()
+    route_coords = as_route_geometry(route_coords)
+    xs, ys = route_coords.xy
+    cumulative = route_coords.cumulative_miles
+    geometry_miles = float(cumulative[-1]) if len(cumulative) else 0.0
+    scale = route_miles / geometry_miles if route_miles is not None and geometry_miles > 0 else 1.0
+
+    with span("cheapest"):
+        ranked = get_price_aggregates(table).cheapest_along(xs, ys, cumulative, radius_miles, limit)
+    stops = []
+    for hit in ranked:
+        row = stop_from_hit(table, hit)
+        row["miles_from_start"] = round(hit.along_miles * scale, 1)
+        row["offset_miles"] = round(hit.offset_miles, 2)
+        stops.append(row)
+    return stops
+
 
 def best_fuel_stops(route_coords):
     """
-    ULTRA-SIMPLE: Just return 2 fuel stops from the CSV
+    Stops of the cheapest refuelling plan along `route_coords` (500 mile range, 10 MPG)
     """
-    print("\n" + "="*60)
-    print("🛑 FINDING FUEL STOPS (SIMPLE MODE)")
-    
-    # 1. Load data
-    fuel_data = load_fuel_data()
-    
-    if not fuel_data:
-        print("[WARNING] No fuel data - returning mock data")
+    table = get_station_table()
+
+    if not len(table):
+        logger.warning("No fuel data - returning mock data")
         # Return mock data for testing
         return [
             {"state": "TX", "city": "Houston", "fuel_price": 3.15},
             {"state": "TX", "city": "Dallas", "fuel_price": 3.25}
         ]
-    
-    print(f"[DEBUG] First row: {list(fuel_data[0].keys())}")
-    
-    # 2. Find ANY 2 rows with fuel prices
-    stops_found = []
-    
-    for i, row in enumerate(fuel_data):
-        if len(stops_found) >= 2:
-            break
-        
-        try:
-            # Try to find a price in ANY column
-            price = None
-            state = "N/A"
-            city = "Unknown"
-            
-            # Look for state and city
-            for key, value in row.items():
-                key_lower = key.lower()
-                if 'state' in key_lower and value:
-                    state = value.strip()[:2].upper()  # Just first 2 chars
-                if 'city' in key_lower and value:
-                    city = value.strip()
-            
-            # Look for ANY number that looks like a fuel price ($1.50 to $10.00)
-            for key, value in row.items():
-                if not value:
-                    continue
-                    
-                # Clean the value
-                val_clean = str(value).replace('$', '').replace(',', '').strip()
-                
-                # Check if it's a number
-                if val_clean.replace('.', '', 1).isdigit():
-                    num = float(val_clean)
-                    if 1.0 <= num <= 10.0:  # Reasonable fuel price range
-                        price = round(num, 3)
-                        print(f"[DEBUG] Found price ${price} in column '{key}'")
-                        break
-            
-            if price:
-                stops_found.append({
-                    "state": state,
-                    "city": city,
-                    "fuel_price": price
-                })
-                print(f"[DEBUG] Added: {city}, {state}, ${price}")
-        
-        except Exception as e:
-            print(f"[DEBUG] Skipping row {i}: {e}")
-            continue
-    
-    # 3. If we didn't find enough, create mock data
-    if len(stops_found) < 2:
-        print("[WARNING] Not enough valid stations, adding defaults")
-        default_stops = [
-            {"state": "TX", "city": "Austin", "fuel_price": 3.15},
-            {"state": "TX", "city": "San Antonio", "fuel_price": 3.20}
-        ]
-        
-        # Add defaults to reach 2 stops
-        for stop in default_stops:
-            if len(stops_found) < 2:
-                stops_found.append(stop)
-    
-    print(f"✅ Returning {len(stops_found)} fuel stops")
-    for stop in stops_found:
-        print(f"   - {stop['city']}, {stop['state']}: ${stop['fuel_price']}")
-    print("="*60)
-    
-    return stops_found
\ No newline at end of file
+
+    _, stops = plan_route_fuel(route_coords, table=table)
+    return stops
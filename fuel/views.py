@@ -1,42 +1,237 @@
-import requests
-from fuel.utils import best_fuel_stops
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from config.metrics import REGISTRY
+from fuel.aggregates import get_price_aggregates
+from fuel.query import get_listing_cache, get_query_index, get_row_fragments
+from fuel.stations import get_station_table
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+LISTING_REQUESTS = REGISTRY.counter(
+    "fuelroute_fuel_listing_requests_total", "Fuel price listing requests by cache outcome", labels=("result",),
+)
+
+
+@api_view(['GET'])
+def dummy_view(request):
+    return Response({"status": "ok"})
+
+
+def _positive_int(value, default):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    return number if number > 0 else default
+
+
+def _listing_params(query, default_size):
+    """
+    Normalised listing parameters (the response cache key, in a fixed order),
+    or a client error message
+    """
+    sort = query.get('sort') or None
+    try:
+        min_price = float(query['min_price']) if query.get('min_price') else None
+        max_price = float(query['max_price']) if query.get('max_price') else None
+    except ValueError:
+        return None, "min_price and max_price must be numbers"
+    if sort not in (None, 'price_asc', 'price_desc'):
+        return None, "sort must be price_asc or price_desc"
+    return {
+        'state': (query.get('state') or '').strip().lower() or None,
+        'city': (query.get('city') or '').strip().lower() or None,
+        'min_price': min_price,
+        'max_price': max_price,
+        'sort': sort,
+        'page_size': min(_positive_int(query.get('page_size'), default_size), MAX_PAGE_SIZE),
+        'page': _positive_int(query.get('page'), 1),
+    }, None
+
+
+def _page_url(request, params, page, default_size):
+    # Links are built from the normalised parameters, so equal queries give byte-identical pages
+    query = {k: v for k, v in params.items() if v is not None and k not in ('page', 'page_size')}
+    if params['page_size'] != default_size:
+        query['page_size'] = params['page_size']
+    if page > 1:
+        query['page'] = page
+    return request.build_absolute_uri(request.path + ('?' + urlencode(query) if query else ''))
+
+
+def _listing_page(request, table, params, default_size):
+    """
+    Listing payload for normalised `params`, or None when the page is out of range
+    """
+    rows = get_query_index(table).select(
+        state=params['state'], city=params['city'],
+        min_price=params['min_price'], max_price=params['max_price'], sort=params['sort'],
+    )
+    page, page_size = params['page'], params['page_size']
+    count = len(rows)
+    offset = (page - 1) * page_size
+    if offset >= count and page != 1:
+        return None
+
+    fragments = get_row_fragments(table)
+    return {
+        "count": count,
+        "next": _page_url(request, params, page + 1, default_size) if offset + page_size < count else None,
+        "previous": _page_url(request, params, page - 1, default_size) if page > 1 else None,
+        "results": [fragments[i] for i in rows[offset:offset + page_size]],
+    }
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def _cache_headers(request, table, key):
+    # Strong ETag over the table version, the renderer and the normalised query `key`
+    representation = f"{table.version}|{request.accepted_renderer.format}|{key!r}"
+    digest = hashlib.blake2b(representation.encode(), digest_size=16).hexdigest()
+    return {
+        'ETag': f'"{digest}"',
+        'Cache-Control': f"public, max-age={getattr(settings, 'FUEL_PRICE_CACHE', {}).get('MAX_AGE_SECONDS', 60)}",
+        'Vary': 'Accept',
+    }
+
 
 @api_view(['GET'])
 def fuel_price_list(request):
+    """
+    Filtered, sorted, paginated station prices.
+
+    Pages are cached per station table on the normalised query, and carry a
+    strong ETag derived from the table version and that query, so a poll
+    with a matching If-None-Match is answered 304 without touching the index.
+    """
+    default_size = getattr(settings, 'REST_FRAMEWORK', {}).get('PAGE_SIZE') or DEFAULT_PAGE_SIZE
+    params, message = _listing_params(request.GET, default_size)
+    if message:
+        return Response({"error": message}, status=400)
+
+    table = get_station_table()
+    key = (request.build_absolute_uri(request.path), tuple(params.items()))
+    headers = _cache_headers(request, table, key)
+
+    if _etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+        LISTING_REQUESTS.labels('not_modified').inc()
+        return Response(status=304, headers=headers)
+
+    cache = get_listing_cache(table)
+    payload = cache.get(key)
+    if payload is None:
+        LISTING_REQUESTS.labels('miss').inc()
+        payload = _listing_page(request, table, params, default_size)
+        if payload is None:
+            return Response({"detail": "Invalid page."}, status=404)
+        cache.put(key, payload)
+    else:
+        LISTING_REQUESTS.labels('hit').inc()
+    return Response(payload, headers=headers)
+
+
+def _region_payload(table, aggregates, query, limit):
+    """
+    Regional price stats for a normalised query, or (None, error message)
+    """
+    if query['lat'] is not None:
+        k = aggregates.cell_of(query['lat'], query['lng'])
+        if k is None:
+            return {"region": None}, None
+        lat, lng = aggregates.cell_center(k)
+        return {
+            "region": {
+                "cell_miles": aggregates.cell_miles,
+                "lat": round(lat, 4),
+                "lng": round(lng, 4),
+                **aggregates.cell_stats(k).as_dict(table),
+            },
+        }, None
+    if query['state'] is None:
+        return {
+            "count": len(aggregates.states_by_median),
+            "states": [
+                {"state": state, **aggregates.state(state).as_dict(table)}
+                for state in aggregates.states_by_median[:limit]
+            ],
+        }, None
+    stats = aggregates.state(query['state'])
+    if stats is None:
+        return None, f"No stations in state {query['state'].upper()}"
+    if query['city'] is not None:
+        city = aggregates.city(query['state'], query['city'])
+        if city is None:
+            return None, f"No stations in {query['city']}, {query['state'].upper()}"
+        return {"state": query['state'].upper(), "city": query['city'], **city.as_dict(table)}, None
+    cities = aggregates.cities_by_median(query['state'])
+    ranked = []
+    for city in cities[:limit]:
+        city_stats = aggregates.city(query['state'], city)
+        ranked.append({"city": table.cities[city_stats.cheapest], **city_stats.as_dict(table)})
+    return {
+        "state": query['state'].upper(),
+        **stats.as_dict(table),
+        "city_count": len(cities),
+        "cities": ranked,
+    }, None
+
+
+@api_view(['GET'])
+def fuel_price_regions(request):
+    """
+    Where diesel is cheapest, from the precomputed price aggregates.
+
+    No parameters: states ranked by median price. ?state=TX: that state's
+    stats and its cities ranked by median. ?state=TX&city=Dallas: one city.
+    ?lat=..&lng=..: the coarse grid cell around a point. `limit` caps the
+    ranked lists. Cached and revalidated like the price listing.
+    """
     try:
-        # Fetch live fuel prices from internal API
-        response = requests.get("http://127.0.0.1:8000/api/fuel-prices/")
-        fuel_data = response.json().get("fuel_prices", [])
-    except Exception as e:
-        return Response({"error": f"Failed to fetch fuel prices: {str(e)}"}, status=500)
-
-    # --- Filters ---
-    state = request.GET.get('state')
-    city = request.GET.get('city')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-
-    if state:
-        fuel_data = [row for row in fuel_data if row.get('State') and row['State'].lower() == state.lower()]
-    if city:
-        fuel_data = [row for row in fuel_data if row.get('City') and row['City'].lower() == city.lower()]
-    if min_price:
-        fuel_data = [row for row in fuel_data if row.get('Retail Price') and float(row['Retail Price']) >= float(min_price)]
-    if max_price:
-        fuel_data = [row for row in fuel_data if row.get('Retail Price') and float(row['Retail Price']) <= float(max_price)]
-
-    # --- Sort ---
-    sort = request.GET.get('sort')
-    if sort == 'price_asc':
-        fuel_data.sort(key=lambda x: float(x.get('Retail Price', 0)))
-    elif sort == 'price_desc':
-        fuel_data.sort(key=lambda x: float(x.get('Retail Price', 0)), reverse=True)
-
-    # --- Pagination ---
-    paginator = PageNumberPagination()
-    result_page = paginator.paginate_queryset(fuel_data, request)
-    
-    return paginator.get_paginated_response(result_page)
\ No newline at end of file
+        lat = float(request.GET['lat']) if request.GET.get('lat') else None
+        lng = float(request.GET['lng']) if request.GET.get('lng') else None
+    except ValueError:
+        return Response({"error": "lat and lng must be numbers"}, status=400)
+    if (lat is None) != (lng is None):
+        return Response({"error": "lat and lng must be given together"}, status=400)
+    query = {
+        'state': (request.GET.get('state') or '').strip().lower() or None,
+        'city': (request.GET.get('city') or '').strip().lower() or None,
+        'lat': lat,
+        'lng': lng,
+    }
+    limit = min(_positive_int(request.GET.get('limit'), DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+
+    table = get_station_table()
+    headers = _cache_headers(request, table, ('regions', tuple(query.items()), limit))
+    if _etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+        return Response(status=304, headers=headers)
+
+    payload, message = _region_payload(table, get_price_aggregates(table), query, limit)
+    if message:
+        return Response({"error": message}, status=404)
+    return Response(payload, headers=headers)
+
+
+@api_view(['GET'])
+def fuel_price_heatmap(request):
+    """
+    Coarse price grid: one entry per cell with stations (centre, count, min and median price)
+    """
+    table = get_station_table()
+    headers = _cache_headers(request, table, 'heatmap')
+    if _etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+        return Response(status=304, headers=headers)
+    aggregates = get_price_aggregates(table)
+    return Response({"cell_miles": aggregates.cell_miles, "cells": aggregates.heatmap()}, headers=headers)
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class RoutesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'routes'
+
+    def ready(self):
+        from config.metrics import REGISTRY
+        from routes.cache import collect_cache_metrics
+        from routes.planning import collect_planning_metrics
+        from routes.resilience import collect_ors_metrics
+        REGISTRY.register_collector(collect_cache_metrics)
+        REGISTRY.register_collector(collect_ors_metrics)
+        REGISTRY.register_collector(collect_planning_metrics)
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from routes.graph import RoadGraph
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRAPH_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "road_graph")
+
+
+class RoutingBackend:
+    """
+    Source of routes for a lane.
+
+    route() returns the normalised route dict produced by
+    routes.services.parse_route_response ({'geometry', 'distance_meters',
+    'duration_seconds', 'format'}) and raises RoutingError on failure.
+    """
+
+    name = None
+    # True when route_from() answers many destinations with shared work rather than one route() each
+    one_to_many = False
+
+    def route(self, start_coords, end_coords, profile):
+        raise NotImplementedError
+
+    async def route_async(self, start_coords, end_coords, profile):
+        return await sync_to_async(self.route, thread_sensitive=False)(start_coords, end_coords, profile)
+
+    def route_from(self, start_coords, ends, profile):
+        """
+        Routes from one start to each of `ends`: a list with a route dict or
+        the RoutingError raised for that destination, in order
+        """
+        from routes.services import RoutingError
+
+        routes = []
+        for end_coords in ends:
+            try:
+                routes.append(self.route(start_coords, end_coords, profile))
+            except RoutingError as e:
+                routes.append(e)
+        return routes
+
+    def cache_profile(self, profile):
+        """
+        Profile part of the route cache key, so backends never share entries
+        """
+        return profile if self.name == "ors" else f"{self.name}:{profile}"
+
+
+class ORSBackend(RoutingBackend):
+    """
+    OpenRouteService directions over the pooled HTTP clients
+    """
+
+    name = "ors"
+
+    def route(self, start_coords, end_coords, profile):
+        from routes.services import request_route
+        return request_route(start_coords, end_coords, profile)
+
+    async def route_async(self, start_coords, end_coords, profile):
+        from routes.services import request_route_async
+        return await request_route_async(start_coords, end_coords, profile)
+
+
+class LocalGraphBackend(RoutingBackend):
+    """
+    Routes computed in-process with A* over a memory-mapped RoadGraph
+    (one shortest-path tree per start for route_from).
+
+    Start and end snap to the nearest graph node; points further than
+    `max_snap_miles` from the network are refused. The profile is ignored,
+    the graph carries a single set of travel times.
+    """
+
+    name = "local"
+    one_to_many = True
+
+    def __init__(self, directory, max_snap_miles):
+        self.directory = str(directory)
+        self.max_snap_miles = max_snap_miles
+        self._graph = None
+        self._lock = threading.Lock()
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            with self._lock:
+                if self._graph is None:
+                    try:
+                        self._graph = RoadGraph.load(self.directory)
+                    except (OSError, ValueError) as e:
+                        from routes.services import RoutingError
+                        raise RoutingError(f"Local road graph unavailable: {e}", graph_dir=self.directory)
+                    logger.info("Road graph loaded: %d nodes, %d edges", len(self._graph), self._graph.edge_count)
+        return self._graph
+
+    def _snap(self, coords, which):
+        from routes.services import RoutingError
+
+        node, miles = self.graph.nearest_node(coords[0], coords[1])
+        if miles > self.max_snap_miles:
+            raise RoutingError(
+                f"No road within {self.max_snap_miles} miles of the {which} point", snap_miles=round(miles, 1),
+            )
+        return node
+
+    def route(self, start_coords, end_coords, profile):
+        from routes.services import RoutingError
+
+        source = self._snap(start_coords, "start")
+        target = self._snap(end_coords, "end")
+        path = self.graph.shortest_path(source, target)
+        if path is None:
+            raise RoutingError("No route between these points on the local road graph")
+        return self._route_dict(start_coords, end_coords, path)
+
+    def route_from(self, start_coords, ends, profile):
+        """
+        All routes from one start with a single shortest-path tree search
+        """
+        from routes.services import RoutingError
+
+        source = self._snap(start_coords, "start")
+        targets = []
+        for end_coords in ends:
+            try:
+                targets.append(self._snap(end_coords, "end"))
+            except RoutingError as e:
+                targets.append(e)
+        paths = self.graph.shortest_path_tree(source, [t for t in targets if not isinstance(t, RoutingError)])
+        routes = []
+        for end_coords, target in zip(ends, targets):
+            if isinstance(target, RoutingError):
+                routes.append(target)
+            elif target not in paths:
+                routes.append(RoutingError("No route between these points on the local road graph"))
+            else:
+                routes.append(self._route_dict(start_coords, end_coords, paths[target]))
+        return routes
+
+    def _route_dict(self, start_coords, end_coords, path):
+        graph = self.graph
+        nodes, meters, seconds = path
+        geometry = [list(start_coords[:2])]
+        geometry += np.column_stack((graph.node_lon[nodes], graph.node_lat[nodes])).tolist()
+        geometry.append(list(end_coords[:2]))
+        return {
+            'geometry': geometry,
+            'distance_meters': meters,
+            'duration_seconds': seconds,
+            'format': 'local',
+        }
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def make_backend(name):
+    if name == "ors":
+        return ORSBackend()
+    if name == "local":
+        return LocalGraphBackend(
+            getattr(settings, "ROUTE_GRAPH_DIR", DEFAULT_GRAPH_DIR),
+            getattr(settings, "ROUTE_GRAPH_MAX_SNAP_MILES", 50.0),
+        )
+    raise ImproperlyConfigured(f"Unknown ROUTING_BACKEND {name!r}, expected 'ors' or 'local'")
+
+
+def get_routing_backend():
+    """
+    Shared backend selected by settings.ROUTING_BACKEND ('ors' or 'local')
+    """
+    global _backend
+    name = getattr(settings, "ROUTING_BACKEND", "ors")
+    backend = _backend
+    if backend is None or backend.name != name:
+        with _backend_lock:
+            backend = _backend
+            if backend is None or backend.name != name:
+                backend = _backend = make_backend(name)
+    return backend
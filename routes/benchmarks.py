@@ -0,0 +1,245 @@
+import datetime
+import io
+import itertools
+import os
+import json
+import platform
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.db import DatabaseError, transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from fuel.stations import (
+    get_station_table, load_compiled_table, parse_station_csv, station_csv_path, station_snapshot_path,
+)
+from fuel.utils import best_fuel_stops, load_fuel_data
+from routes.resilience import reset_ors_guard
+from routes.testing import StubORSServer, straight_line_route
+
+# Houston -> Atlanta, ~700 miles with coverable gaps on the bundled station data
+LANE = ([-95.37, 29.76], [-84.39, 33.75])
+DEFAULT_VERTICES = (100, 1000, 10000, 50000)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def latency_stats(seconds, elapsed=None):
+    """
+    {'runs', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'[, 'rps']} from per-call durations
+    """
+    ordered = sorted(seconds)
+    stats = {"runs": len(ordered)}
+    for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        stats[name] = round(percentile(ordered, q) * 1000, 3)
+    stats["max_ms"] = round(ordered[-1] * 1000, 3)
+    if elapsed:
+        stats["rps"] = round(len(ordered) / elapsed, 1)
+    return stats
+
+
+def peak_memory_kib(fn):
+    """
+    Peak traced allocation of one call to fn(), in KiB (a separate run, tracing slows code down)
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def measure(fn, runs, warmup=1):
+    for _ in range(warmup):
+        fn()
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    stats = latency_stats(seconds)
+    stats["peak_kib"] = peak_memory_kib(fn)
+    return stats
+
+
+def load_test(request, total, concurrency):
+    """
+    Fire `total` requests with `concurrency` threads, each with its own test
+    Client. `request(client)` returns the response. Returns latency stats
+    plus req/s and the count of non-2xx answers.
+    """
+    local = threading.local()
+    statuses = []
+
+    def one(_):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = Client()
+        started = time.perf_counter()
+        response = request(client)
+        statuses.append(response.status_code)
+        return time.perf_counter() - started
+
+    request(Client())  # warm up caches and connection pools
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        seconds = list(pool.map(one, range(total)))
+    stats = latency_stats(seconds, elapsed=time.perf_counter() - started)
+    stats["errors"] = sum(1 for s in statuses if not 200 <= s < 300)
+    return stats
+
+
+def bench_calculate_route(vertices, total, concurrency, path="/routes/calculate-route/", **options):
+    body = json.dumps({"start": LANE[0], "end": LANE[1], **options})
+    with StubORSServer(vertices=vertices) as stub, override_settings(
+        ORS_API_KEY="bench-key",
+        ORS_BASE_URL=stub.url,
+        ROUTING_BACKEND="ors",
+        ROUTE_CACHE={"DISABLED": True},
+        ORS_RESILIENCE={"RATE_PER_SECOND": 1e6, "BURST": 1e6, "COALESCE": False},
+    ):
+        reset_ors_guard()
+        try:
+            return load_test(
+                lambda c: _consume(c.post(path, body, content_type="application/json")),
+                total, concurrency,
+            )
+        finally:
+            reset_ors_guard()
+
+
+def _consume(response):
+    # Streamed bodies are only produced when read
+    if response.streaming:
+        b"".join(response.streaming_content)
+    return response
+
+
+def bench_fuel_prices(total, concurrency):
+    queries = [
+        {},
+        {"state": "TX", "sort": "price_asc"},
+        {"city": "Houston"},
+        {"min_price": "3.0", "max_price": "3.5", "sort": "price_desc", "page": "2"},
+    ]
+    counter = itertools.count()
+    return load_test(lambda c: c.get("/api/fuel-prices/", queries[next(counter) % len(queries)]), total, concurrency)
+
+
+def bench_best_fuel_stops(vertices, runs):
+    coords = straight_line_route(LANE[0], LANE[1], vertices)["features"][0]["geometry"]["coordinates"]
+    return measure(lambda: best_fuel_stops(coords), runs)
+
+
+def bench_importer(runs):
+    """
+    Import the bundled CSV into the datalake inside a transaction that is
+    rolled back, so the database is left untouched. None when the datalake
+    tables don't exist (migrations not applied).
+    """
+    from datalake.importer import import_fuel_prices
+
+    with open(station_csv_path(), encoding="utf-8") as f:
+        text = f.read()
+
+    def run():
+        with transaction.atomic():
+            import_fuel_prices(io.StringIO(text), default_date=datetime.date(2000, 1, 1))
+            transaction.set_rollback(True)
+
+    try:
+        stats = measure(run, runs, warmup=0)
+    except DatabaseError:
+        return None
+    stats["rows"] = text.count("\n") - 1
+    stats["rows_per_second"] = round(stats["rows"] / (stats["p50_ms"] / 1000), 1)
+    return stats
+
+
+def run_suite(vertices=DEFAULT_VERTICES, requests=200, concurrency=8, runs=10, progress=None):
+    """
+    Run every benchmark and return {'meta': ..., 'results': {name: stats}}
+    """
+    results = {}
+
+    def record(name, stats):
+        if stats is not None:
+            results[name] = stats
+            if progress:
+                progress(name, stats)
+
+    get_station_table()  # parse once up front so no benchmark pays for the cold load
+    path = station_csv_path()
+    record("micro.parse_station_csv", measure(lambda: parse_station_csv(path), max(1, runs // 5), warmup=0))
+    snapshot = station_snapshot_path()
+    if snapshot and os.path.exists(snapshot):
+        record("micro.map_station_snapshot", measure(lambda: load_compiled_table(snapshot), runs))
+    record("micro.load_fuel_data", measure(load_fuel_data, runs))
+    for n in vertices:
+        record(f"micro.best_fuel_stops.v{n}", bench_best_fuel_stops(n, runs))
+    record("micro.import_fuel_prices", bench_importer(max(1, runs // 5)))
+
+    for n in vertices:
+        # Huge geometries make every request slow, scale the request count down with them
+        total = max(concurrency, requests * 1000 // max(n, 1000))
+        record(f"endpoint.calculate_route.v{n}", bench_calculate_route(n, total, concurrency))
+    largest = max(vertices)
+    total = max(concurrency, requests * 1000 // max(largest, 1000))
+    for encoding in ("coords", "polyline", "binary"):
+        record(f"endpoint.route_geometry.{encoding}.v{largest}", bench_calculate_route(
+            largest, total, concurrency, path="/routes/route-geometry/", encoding=encoding,
+        ))
+    record("endpoint.fuel_prices", bench_fuel_prices(requests * 5, concurrency))
+
+    return {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}",
+            "numpy": np.__version__,
+            "requests": requests,
+            "concurrency": concurrency,
+            "runs": runs,
+        },
+        "results": results,
+    }
+
+
+# Lower is better for latency/memory, higher for throughput
+_LOWER_IS_BETTER = ("p50_ms", "p95_ms", "peak_kib")
+_HIGHER_IS_BETTER = ("rps", "rows_per_second")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of `results` against `baseline` results: [(benchmark, metric, baseline, current, change)].
+
+    A metric regresses when it is worse than the baseline by more than
+    `tolerance` (0.25 = 25%). Benchmarks missing on either side are ignored.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in _LOWER_IS_BETTER + _HIGHER_IS_BETTER:
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if metric in _LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append((name, metric, old, new, change))
+    return regressions
@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from config import codec
+
+DEFAULT_SETTINGS = {
+    'PATH': os.path.join(os.path.dirname(os.path.dirname(__file__)), 'route_cache.sqlite3'),
+    'TTL_SECONDS': 7 * 24 * 3600,
+    'MAX_ENTRIES': 10000,
+    # 3 decimals of a degree is ~110 m, close enough to call it the same depot
+    'PRECISION': 3,
+    # Expired entries are kept this much longer to be served stale while ORS is down
+    'STALE_SECONDS': 30 * 24 * 3600,
+}
+
+
+def route_cache_key(start, end, profile, precision=DEFAULT_SETTINGS['PRECISION']):
+    """
+    Cache key for a lane: profile plus start/end snapped to `precision` decimals
+    """
+    def snap(point):
+        return ','.join(f"{round(float(v), precision):.{precision}f}" for v in point[:2])
+    return f"{profile}|{snap(start)}|{snap(end)}"
+
+
+class RouteCache:
+    """
+    Persistent route store in a local SQLite file.
+
+    Entries expire `ttl_seconds` after they were written but stay available
+    to get(allow_stale=True) for another `stale_seconds`. Size is checked
+    every `max_entries // 100` writes rather than on each one (a COUNT is a
+    full scan in SQLite); once past `max_entries` the least recently used
+    entries are evicted in bulk down to 90% of it. Hit/miss counters are
+    kept per process.
+    """
+
+    def __init__(self, path, ttl_seconds, max_entries, precision, stale_seconds=0):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.precision = precision
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._check_every = max(1, max_entries // 100) if max_entries else 0
+        self._low_water = max_entries - max_entries // 10 if max_entries else 0
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS route_cache ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+                ' created_at REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS route_cache_last_used ON route_cache (last_used)')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def key(self, start, end, profile):
+        return route_cache_key(start, end, profile, self.precision)
+
+    def get(self, key, allow_stale=False):
+        """
+        Cached value for `key`, or None when missing or expired. With
+        `allow_stale` expired entries still inside the stale window are returned.
+        """
+        conn = self._connection()
+        row = conn.execute('SELECT value, created_at FROM route_cache WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self._count('misses')
+            return None
+        age = now - row[1]
+        if self.ttl_seconds and age > self.ttl_seconds:
+            if age > self.ttl_seconds + self.stale_seconds:
+                conn.execute('DELETE FROM route_cache WHERE key = ?', (key,))
+                self._count('expired')
+                self._count('misses')
+                return None
+            if not allow_stale:
+                self._count('misses')
+                return None
+        conn.execute('UPDATE route_cache SET last_used = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        return codec.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO route_cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)',
+            (key, codec.dumps(value), now, now),
+        )
+        if self.max_entries:
+            with self._stats_lock:
+                self._writes += 1
+                due = self._writes % self._check_every == 0
+            if due:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        (count,) = conn.execute('SELECT COUNT(*) FROM route_cache').fetchone()
+        if count <= self.max_entries:
+            return
+        overflow = count - self._low_water
+        conn.execute(
+            'DELETE FROM route_cache WHERE key IN '
+            '(SELECT key FROM route_cache ORDER BY last_used LIMIT ?)',
+            (overflow,),
+        )
+        with self._stats_lock:
+            self.evictions += overflow
+
+    def clear(self):
+        self._connection().execute('DELETE FROM route_cache')
+
+    def stats(self):
+        (size,) = self._connection().execute('SELECT COUNT(*) FROM route_cache').fetchone()
+        with self._stats_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'entries': size,
+            }
+
+
+def cache_settings():
+    """
+    settings.ROUTE_CACHE over DEFAULT_SETTINGS
+    """
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ROUTE_CACHE', {})}
+
+
+def lane_key(start, end, profile):
+    """
+    Route cache key for a lane at the configured PRECISION, also used to
+    tell lanes apart when the cache is disabled (coalescing, batch dedupe)
+    """
+    return route_cache_key(start, end, profile, cache_settings()['PRECISION'])
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_route_cache():
+    """
+    Process-wide RouteCache configured from settings.ROUTE_CACHE, or None when disabled
+    """
+    global _cache
+    options = cache_settings()
+    if options.get('DISABLED'):
+        return None
+    if _cache is None or _cache.path != str(options['PATH']):
+        with _cache_lock:
+            if _cache is None or _cache.path != str(options['PATH']):
+                _cache = RouteCache(
+                    options['PATH'], options['TTL_SECONDS'], options['MAX_ENTRIES'], options['PRECISION'],
+                    options['STALE_SECONDS'],
+                )
+    return _cache
+
+
+def collect_cache_metrics():
+    """
+    Scrape-time samples for config.metrics from the process route cache
+    """
+    cache = _cache
+    if cache is None:
+        return []
+    stats = cache.stats()
+    help_text = 'Route cache lookups by result'
+    return [
+        ('fuelroute_route_cache_lookups_total', 'counter', help_text, {'result': 'hit'}, stats['hits']),
+        ('fuelroute_route_cache_lookups_total', 'counter', help_text, {'result': 'miss'}, stats['misses']),
+        ('fuelroute_route_cache_expired_total', 'counter', 'Route cache entries dropped as expired', None, stats['expired']),
+        ('fuelroute_route_cache_evictions_total', 'counter', 'Route cache LRU evictions', None, stats['evictions']),
+        ('fuelroute_route_cache_entries', 'gauge', 'Routes stored in the route cache', None, stats['entries']),
+    ]
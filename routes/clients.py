@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # async endpoint unavailable without httpx
+    httpx = None
+
+DEFAULT_HTTP_SETTINGS = {
+    'TIMEOUT': 30,
+    'MAX_CONNECTIONS': 20,
+    'MAX_KEEPALIVE': 10,
+    'KEEPALIVE_EXPIRY': 30,
+    'MAX_CONCURRENCY': 50,
+    'PER_HOST_LIMIT': 20,
+}
+
+
+def http_settings():
+    return {**DEFAULT_HTTP_SETTINGS, **getattr(settings, 'ORS_HTTP', {})}
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_sync_session():
+    """
+    Process-wide requests.Session with a keep-alive connection pool for ORS calls
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                options = http_settings()
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=options['MAX_CONNECTIONS'],
+                    pool_block=True,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+class AsyncRoutingClient:
+    """
+    Pooled keep-alive httpx.AsyncClient with bounded concurrency.
+
+    MAX_CONCURRENCY caps in-flight requests overall and PER_HOST_LIMIT caps
+    them per upstream host; callers beyond either limit wait their turn
+    instead of opening more sockets.
+    """
+
+    def __init__(self, options):
+        if httpx is None:
+            raise RuntimeError("The async routing client needs httpx. Install: pip install httpx")
+        self.options = options
+        self.client = httpx.AsyncClient(
+            timeout=options['TIMEOUT'],
+            limits=httpx.Limits(
+                max_connections=options['MAX_CONNECTIONS'],
+                max_keepalive_connections=options['MAX_KEEPALIVE'],
+                keepalive_expiry=options['KEEPALIVE_EXPIRY'],
+            ),
+        )
+        self.concurrency = asyncio.Semaphore(options['MAX_CONCURRENCY'])
+        self.per_host = {}
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        limit = self.per_host.get(host)
+        if limit is None:
+            limit = self.per_host[host] = asyncio.Semaphore(self.options['PER_HOST_LIMIT'])
+        return limit
+
+    async def post(self, url, **kwargs):
+        async with self.concurrency, self._host_limit(url):
+            return await self.client.post(url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# httpx clients are bound to the event loop they were first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    AsyncRoutingClient for the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncRoutingClient(http_settings())
+    return client
@@ -0,0 +1,198 @@
+import numpy as np
+
+from fuel.spatial import cumulative_miles, project_many
+
+
+def decode_polyline(encoded, precision=5, dimensions=2):
+    """
+    Decode a Google encoded polyline to an (n, 2) array of [lng, lat].
+
+    `dimensions=3` reads polylines that carry a third value per vertex
+    (ORS with elevation=true); the elevation is dropped.
+    Vectorised: the 5-bit chunks are split, shifted and summed per value
+    with array operations instead of a per-character loop.
+    Raises ValueError on a truncated or malformed string.
+    """
+    if dimensions not in (2, 3):
+        raise ValueError(f"Polyline dimensions must be 2 or 3, got {dimensions}")
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+    try:
+        chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    except UnicodeEncodeError:
+        raise ValueError("Encoded polyline contains non-ASCII characters") from None
+    if chunks.min() < 0 or chunks.max() > 0x3f:
+        raise ValueError("Encoded polyline contains invalid characters")
+
+    last = chunks < 0x20  # chunk without the continuation bit ends a value
+    if not last[-1]:
+        raise ValueError("Encoded polyline is truncated")
+    ends = np.flatnonzero(last)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    if len(starts) % dimensions:
+        raise ValueError(f"Encoded polyline value count is not a multiple of {dimensions}")
+
+    value_of = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    shifts = 5 * (np.arange(len(chunks)) - starts[value_of])
+    if shifts.max() > 30:
+        raise ValueError("Encoded polyline value is out of range")
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    coords = np.empty((len(deltas) // dimensions, 2), dtype=np.float64)
+    scale = 10.0 ** precision
+    coords[:, 1] = np.cumsum(deltas[0::dimensions]) / scale
+    coords[:, 0] = np.cumsum(deltas[1::dimensions]) / scale
+    return coords
+
+
+def encode_polyline(coords, precision=5):
+    """
+    Google encoded polyline of an (n, 2) array of [lng, lat], the inverse of decode_polyline.
+
+    Vectorised the same way: every value is split into its 5-bit chunks at
+    once and the characters are picked out with a mask.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(coords):
+        return ""
+    scaled = np.round(coords[:, ::-1] * 10.0 ** precision).astype(np.int64)  # lat, lng order
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    shifted = values[:, None] >> (5 * np.arange(8))
+    needed = np.maximum((shifted > 0).sum(axis=1), 1)
+    position = np.arange(8)
+    chunks = (shifted & 0x1f) | np.where(position < (needed - 1)[:, None], 0x20, 0)
+    return (chunks[position < needed[:, None]] + 63).astype(np.uint8).tobytes().decode("ascii")
+
+
+# Miles covered by one 256px web-mercator tile pixel at zoom 0 on the equator
+MILES_PER_PIXEL_Z0 = 97.2735
+MAX_ZOOM = 22
+
+
+def tolerance_for_zoom(zoom, latitude=0.0):
+    """
+    Simplification tolerance in miles that is invisible at web-map `zoom`
+    (one pixel at that zoom and latitude)
+    """
+    zoom = min(max(float(zoom), 0.0), MAX_ZOOM)
+    return float(MILES_PER_PIXEL_Z0 * np.cos(np.radians(latitude)) / 2.0 ** zoom)
+
+
+def simplify_indices(xs, ys, tolerance):
+    """
+    Indices of the vertices kept by Douglas-Peucker at `tolerance` (same
+    units as xs/ys). The first and last vertex are always kept.
+    """
+    n = len(xs)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    tol2 = tolerance * tolerance
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        x0, y0 = xs[first], ys[first]
+        dx, dy = xs[last] - x0, ys[last] - y0
+        px, py = xs[first + 1:last] - x0, ys[first + 1:last] - y0
+        seg2 = dx * dx + dy * dy
+        if seg2 > 0:
+            t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+            px = px - t * dx
+            py = py - t * dy
+        d2 = px * px + py * py
+        k = int(np.argmax(d2))
+        if d2[k] > tol2:
+            split = first + 1 + k
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+class RouteGeometry:
+    """
+    Route polyline held as a contiguous (n, 2) float64 array of [lng, lat].
+
+    The planar projection and cumulative great-circle distance are computed
+    once, on first use, and shared by the corridor search, the distance
+    checks and simplification.
+    """
+
+    __slots__ = ("coords", "_xy", "_cumulative")
+
+    def __init__(self, coords):
+        coords = np.ascontiguousarray(coords, dtype=np.float64)
+        if coords.ndim != 2 or coords.shape[1] < 2:
+            coords = coords.reshape(-1, 2) if coords.size else np.empty((0, 2), dtype=np.float64)
+        self.coords = np.ascontiguousarray(coords[:, :2])
+        self._xy = None
+        self._cumulative = None
+
+    @classmethod
+    def from_polyline(cls, encoded, precision=5, dimensions=2):
+        return cls(decode_polyline(encoded, precision, dimensions))
+
+    def __len__(self):
+        return len(self.coords)
+
+    @property
+    def lngs(self):
+        return self.coords[:, 0]
+
+    @property
+    def lats(self):
+        return self.coords[:, 1]
+
+    @property
+    def xy(self):
+        """
+        (xs, ys) of the vertices in projected miles (see fuel.spatial.project)
+        """
+        if self._xy is None:
+            self._xy = project_many(self.lats, self.lngs)
+        return self._xy
+
+    @property
+    def cumulative_miles(self):
+        """
+        Great-circle miles from the start to each vertex
+        """
+        if self._cumulative is None:
+            self._cumulative = cumulative_miles(self.lngs, self.lats)
+        return self._cumulative
+
+    @property
+    def length_miles(self):
+        return float(self.cumulative_miles[-1]) if len(self) else 0.0
+
+    def simplify(self, tolerance_miles):
+        """
+        Douglas-Peucker simplified copy, no vertex further than `tolerance_miles` from the original
+        """
+        xs, ys = self.xy
+        return RouteGeometry(self.coords[simplify_indices(xs, ys, tolerance_miles)])
+
+    def encode_polyline(self, precision=5):
+        return encode_polyline(self.coords, precision)
+
+    def float32_bytes(self):
+        """
+        Vertices as little-endian float32 lng, lat pairs (8 bytes per vertex)
+        """
+        return self.coords.astype("<f4").tobytes()
+
+    def tolist(self, decimals=None):
+        """
+        Vertices as [[lng, lat], ...], optionally rounded
+        """
+        coords = self.coords if decimals is None else np.round(self.coords, decimals)
+        return coords.tolist()
+
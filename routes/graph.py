@@ -0,0 +1,244 @@
+import heapq
+import json
+import os
+
+import numpy as np
+
+from fuel.spatial import StationGrid, haversine_many
+
+FORMAT_VERSION = 1
+METERS_PER_MILE = 1609.344
+# Straight-line distance over this speed never overestimates travel time on the graph
+DEFAULT_MAX_SPEED_MPS = 36.0  # ~80 mph
+
+_ARRAYS = ("node_lat", "node_lon", "indptr", "indices", "distance", "duration")
+
+
+class RoadGraph:
+    """
+    Directed road graph in compressed sparse row (CSR) form.
+
+    Node n's outgoing edges are indices[indptr[n]:indptr[n + 1]], with the
+    matching distance (meters) and duration (seconds) entries. On disk it
+    is a directory of .npy arrays plus meta.json; load() memory-maps the
+    arrays so opening a large graph costs no parsing and pages are shared
+    between worker processes.
+    """
+
+    def __init__(self, node_lat, node_lon, indptr, indices, distance, duration, max_speed_mps=DEFAULT_MAX_SPEED_MPS):
+        self.node_lat = node_lat
+        self.node_lon = node_lon
+        self.indptr = indptr
+        self.indices = indices
+        self.distance = distance
+        self.duration = duration
+        self.max_speed_mps = max_speed_mps
+        self._grid = None
+
+    def __len__(self):
+        return len(self.node_lat)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported road graph format {meta.get('format')!r} in {directory}")
+        arrays = [
+            np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in _ARRAYS
+        ]
+        return cls(*arrays, max_speed_mps=meta.get("max_speed_mps", DEFAULT_MAX_SPEED_MPS))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "format": FORMAT_VERSION,
+                "nodes": len(self),
+                "edges": self.edge_count,
+                "max_speed_mps": self.max_speed_mps,
+            }, f, indent=2)
+
+    @classmethod
+    def from_edges(cls, node_lat, node_lon, sources, targets, distance, duration):
+        """
+        Build the CSR arrays from parallel edge lists (one entry per direction)
+        """
+        node_lat = np.asarray(node_lat, dtype=np.float64)
+        node_lon = np.asarray(node_lon, dtype=np.float64)
+        sources = np.asarray(sources, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        counts = np.bincount(sources, minlength=len(node_lat))
+        indptr = np.zeros(len(node_lat) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        distance = np.asarray(distance, dtype=np.float32)[order]
+        duration = np.asarray(duration, dtype=np.float32)[order]
+        speeds = distance / np.maximum(duration, 1e-3)
+        return cls(
+            node_lat, node_lon, indptr,
+            np.asarray(targets, dtype=np.int32)[order], distance, duration,
+            max_speed_mps=max(DEFAULT_MAX_SPEED_MPS, float(speeds.max()) if len(speeds) else 0.0),
+        )
+
+    def nearest_node(self, lng, lat):
+        """
+        (node, miles) for the node closest to a point, found through a grid
+        over the node positions built on first use
+        """
+        if self._grid is None:
+            self._grid = StationGrid(self.node_lat, self.node_lon)
+        node, _ = self._grid.nearest(lat, lng)
+        return node, float(haversine_many(lat, lng, self.node_lat[node], self.node_lon[node]))
+
+    def shortest_path(self, source, target):
+        """
+        Fastest path by duration with A*, as (nodes, meters, seconds), or None
+        when `target` can't be reached. The heuristic is straight-line
+        distance over the graph's top speed, so it is admissible.
+        """
+        # Remaining-time lower bound for every node in one vectorised pass
+        estimate = haversine_many(self.node_lat, self.node_lon, self.node_lat[target], self.node_lon[target])
+        estimate *= METERS_PER_MILE / self.max_speed_mps
+
+        def heuristic(node):
+            return float(estimate[node])
+
+        best = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        heap = [(heuristic(source), 0.0, source)]
+        # Plain ndarray views: scalar indexing of memmaps is several times slower
+        indptr, indices, duration = np.asarray(self.indptr), np.asarray(self.indices), np.asarray(self.duration)
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            lo, hi = int(indptr[node]), int(indptr[node + 1])
+            for nxt, seconds in zip(indices[lo:hi].tolist(), duration[lo:hi].tolist()):
+                new_cost = cost + seconds
+                if new_cost < best.get(nxt, float("inf")):
+                    best[nxt] = new_cost
+                    parent[nxt] = node
+                    heapq.heappush(heap, (new_cost + heuristic(nxt), new_cost, nxt))
+        else:
+            return None
+
+        nodes = [target]
+        while parent[nodes[-1]] != -1:
+            nodes.append(parent[nodes[-1]])
+        nodes.reverse()
+        return nodes, self._path_meters(nodes), best[target]
+
+    def shortest_path_tree(self, source, targets):
+        """
+        Fastest paths from `source` to every node in `targets` with one
+        Dijkstra search, stopped once all targets are settled: paths to
+        nearby targets share the prefix the search already explored.
+        Returns {target: (nodes, meters, seconds)}, unreachable targets left out.
+        """
+        pending = set(targets)
+        best = {source: 0.0}
+        meters = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        heap = [(0.0, source)]
+        # Plain ndarray views: scalar indexing of memmaps is several times slower
+        indptr, indices = np.asarray(self.indptr), np.asarray(self.indices)
+        duration, distance = np.asarray(self.duration), np.asarray(self.distance)
+        while heap and pending:
+            cost, node = heapq.heappop(heap)
+            if node in closed:
+                continue
+            closed.add(node)
+            pending.discard(node)
+            lo, hi = int(indptr[node]), int(indptr[node + 1])
+            edges = zip(indices[lo:hi].tolist(), duration[lo:hi].tolist(), distance[lo:hi].tolist())
+            for nxt, seconds, edge_meters in edges:
+                new_cost = cost + seconds
+                if new_cost < best.get(nxt, float("inf")):
+                    best[nxt] = new_cost
+                    meters[nxt] = meters[node] + edge_meters
+                    parent[nxt] = node
+                    heapq.heappush(heap, (new_cost, nxt))
+
+        paths = {}
+        for target in set(targets) - pending:
+            nodes = [target]
+            while parent[nodes[-1]] != -1:
+                nodes.append(parent[nodes[-1]])
+            nodes.reverse()
+            paths[target] = (nodes, meters[target], best[target])
+        return paths
+
+    def _path_meters(self, nodes):
+        """
+        Length of a node path: every outgoing edge of the path's nodes is
+        gathered at once, and of the edges to the next node the fastest
+        (the one the search used) is counted
+        """
+        if len(nodes) < 2:
+            return 0.0
+        nodes = np.asarray(nodes, dtype=np.int64)
+        indptr = np.asarray(self.indptr)
+        lo, hi = indptr[nodes[:-1]], indptr[nodes[:-1] + 1]
+        counts = hi - lo
+        step = np.repeat(np.arange(len(lo)), counts)
+        edge = np.repeat(lo, counts) + np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        to_next = np.asarray(self.indices)[edge] == nodes[1:][step]
+        step, edge = step[to_next], edge[to_next]
+        # Parallel edges: order each step's edges by duration and keep the first
+        order = np.lexsort((np.asarray(self.duration)[edge], step))
+        step, edge = step[order], edge[order]
+        first = np.ones(len(step), dtype=bool)
+        first[1:] = step[1:] != step[:-1]
+        return float(np.asarray(self.distance)[edge[first]].astype(np.float64).sum())
+
+
+def gazetteer_graph(cities, neighbours=4, spacing_miles=10.0, detour=1.2, speed_mph=60.0):
+    """
+    Coarse highway graph between city centroids for offline use and tests.
+
+    Each city is linked both ways to its `neighbours` nearest cities by a
+    straight road with a node every `spacing_miles`. Road length is the
+    great-circle distance times `detour`.
+    """
+    names = sorted(cities)
+    lat = np.array([cities[n][0] for n in names])
+    lon = np.array([cities[n][1] for n in names])
+    node_lat, node_lon = list(lat), list(lon)
+    sources, targets, distance, duration = [], [], [], []
+    speed_mps = speed_mph * METERS_PER_MILE / 3600.0
+
+    links = set()
+    for i in range(len(names)):
+        miles = haversine_many(lat[i], lon[i], lat, lon)
+        for j in np.argsort(miles)[1:neighbours + 1].tolist():
+            links.add((min(i, j), max(i, j)))
+
+    for i, j in sorted(links):
+        miles = float(haversine_many(lat[i], lon[i], lat[j], lon[j]))
+        steps = max(1, int(np.ceil(miles / spacing_miles)))
+        chain = [i]
+        for k in range(1, steps):
+            node_lat.append(lat[i] + (lat[j] - lat[i]) * k / steps)
+            node_lon.append(lon[i] + (lon[j] - lon[i]) * k / steps)
+            chain.append(len(node_lat) - 1)
+        chain.append(j)
+        meters = miles * detour * METERS_PER_MILE / steps
+        for a, b in zip(chain, chain[1:]):
+            sources += [a, b]
+            targets += [b, a]
+            distance += [meters, meters]
+            duration += [meters / speed_mps] * 2
+
+    return RoadGraph.from_edges(node_lat, node_lon, sources, targets, distance, duration)
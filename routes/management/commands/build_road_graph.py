@@ -0,0 +1,64 @@
+import csv
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from fuel.geocoding import load_gazetteer
+from routes.graph import RoadGraph, gazetteer_graph
+
+
+class Command(BaseCommand):
+    help = 'Builds the memory-mapped road graph used by ROUTING_BACKEND=local'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', help='CSV with id,lat,lon columns')
+        parser.add_argument('--edges', help='CSV with source,target,distance_m,duration_s[,oneway] columns')
+        parser.add_argument('--gazetteer', action='store_true',
+                            help='Build the coarse city-to-city graph from the bundled gazetteer instead')
+        parser.add_argument('--neighbours', type=int, default=4, help='Links per city with --gazetteer')
+        parser.add_argument('--min-population', type=int, default=100000,
+                            help='Only gazetteer places this populous become graph cities with --gazetteer')
+        parser.add_argument('--output', default=None, help='Graph directory (default: ROUTE_GRAPH_DIR)')
+
+    def handle(self, *args, **options):
+        output = options['output'] or str(settings.ROUTE_GRAPH_DIR)
+        if options['gazetteer']:
+            cities, _ = load_gazetteer(min_population=options['min_population'])
+            graph = gazetteer_graph(cities, neighbours=options['neighbours'])
+        elif options['nodes'] and options['edges']:
+            graph = self._from_csv(options['nodes'], options['edges'])
+        else:
+            raise CommandError('Pass --nodes and --edges, or --gazetteer')
+
+        graph.save(output)
+        self.stdout.write(self.style.SUCCESS(
+            f'Road graph written to {output}: {len(graph)} nodes, {graph.edge_count} edges'
+        ))
+
+    def _from_csv(self, nodes_path, edges_path):
+        try:
+            with open(nodes_path, newline='', encoding='utf-8') as f:
+                nodes = {}
+                lats, lons = [], []
+                for row in csv.DictReader(f):
+                    nodes[row['id']] = len(lats)
+                    lats.append(float(row['lat']))
+                    lons.append(float(row['lon']))
+
+            sources, targets, distance, duration = [], [], [], []
+            with open(edges_path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    a, b = nodes[row['source']], nodes[row['target']]
+                    meters, seconds = float(row['distance_m']), float(row['duration_s'])
+                    sources.append(a)
+                    targets.append(b)
+                    distance.append(meters)
+                    duration.append(seconds)
+                    if row.get('oneway', '').strip().lower() not in ('1', 'true', 'yes'):
+                        sources.append(b)
+                        targets.append(a)
+                        distance.append(meters)
+                        duration.append(seconds)
+        except OSError as e:
+            raise CommandError(f'Could not read graph CSV: {e}')
+        except (KeyError, ValueError) as e:
+            raise CommandError(f'Bad graph CSV row: {e}')
+        return RoadGraph.from_edges(lats, lons, sources, targets, distance, duration)
@@ -0,0 +1,64 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from routes.benchmarks import DEFAULT_VERTICES, compare, run_suite
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the route and fuel endpoints and hot paths, and compares against a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vertices', type=int, nargs='+', default=list(DEFAULT_VERTICES),
+                            help='Synthetic route sizes to benchmark')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint load test')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads for load tests')
+        parser.add_argument('--runs', type=int, default=10, help='Timed runs per micro-benchmark')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+                            help='Baseline JSON to compare against')
+        parser.add_argument('--update-baseline', action='store_true', help='Overwrite the baseline with these results')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown before a metric counts as a regression (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        def progress(name, stats):
+            shown = ', '.join(f'{k}={v}' for k, v in stats.items())
+            self.stdout.write(f'{name}: {shown}')
+
+        report = run_suite(
+            vertices=options['vertices'],
+            requests=options['requests'],
+            concurrency=options['concurrency'],
+            runs=options['runs'],
+            progress=progress,
+        )
+
+        if options['output']:
+            self._write(options['output'], report)
+
+        baseline_path = options['baseline']
+        if options['update_baseline']:
+            self._write(baseline_path, report)
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}, run with --update-baseline'))
+            return
+
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report['results'], baseline.get('results', {}), options['tolerance'])
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+            return
+        for name, metric, old, new, change in regressions:
+            self.stdout.write(self.style.ERROR(f'{name} {metric}: {old} -> {new} ({change:+.0%})'))
+        raise CommandError(f'{len(regressions)} benchmark regression(s) beyond {options["tolerance"]:.0%}')
+
+    def _write(self, path, report):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
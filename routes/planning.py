@@ -0,0 +1,336 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from config.metrics import REGISTRY
+from fuel.utils import plan_route_fuel
+from routes.geometry import RouteGeometry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    # 'inline' (request thread), 'thread' or 'process'
+    'MODE': 'inline',
+    'WORKERS': os.cpu_count() or 1,
+    # Jobs admitted at once (running plus queued); further callers wait up to QUEUE_TIMEOUT_SECONDS
+    'MAX_PENDING': None,
+    'QUEUE_TIMEOUT_SECONDS': 5.0,
+    # Process workers: multiprocessing start method, and the route size from which
+    # geometry is handed over in shared memory instead of being pickled
+    'START_METHOD': 'spawn',
+    'SHARED_MEMORY_MIN_POINTS': 2000,
+}
+
+PLANNING_JOBS = REGISTRY.counter(
+    "fuelroute_planning_jobs_total", "Fuel planning jobs by executor mode and outcome", labels=("mode", "result"),
+)
+
+
+class PlanningOverloaded(Exception):
+    """
+    Raised when planning can't take a job now: no slot freed up within
+    QUEUE_TIMEOUT_SECONDS, or the worker pool broke twice in a row
+    """
+
+    def __init__(self, retry_after, message="Route planning is at capacity, try again shortly"):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class InlinePlanner:
+    """
+    Plans in the calling thread. The other planners share its interface:
+    plan(route_geometry, route_miles, options, legs=None, table=None)
+    returns plan_route_fuel()'s (plan, stops), `options` being its vehicle
+    keyword arguments (tank_gallons, mpg, start_fuel).
+    """
+
+    mode = "inline"
+
+    def plan(self, route_geometry, route_miles, options, legs=None, table=None):
+        result = plan_route_fuel(route_geometry, route_miles=route_miles, table=table, legs=legs, **options)
+        PLANNING_JOBS.labels(self.mode, "ok").inc()
+        return result
+
+    def stats(self):
+        return {"mode": self.mode}
+
+    def warm(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class _PooledPlanner(InlinePlanner):
+    """
+    Planning on a worker pool behind a bounded admission semaphore: at
+    most `max_pending` jobs are running or queued, later callers block for
+    a slot up to `queue_timeout` and then get PlanningOverloaded, so a
+    burst turns into backpressure instead of an unbounded queue.
+    """
+
+    def __init__(self, workers, max_pending, queue_timeout):
+        self.workers = workers
+        self.max_pending = max_pending or 2 * workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.pool = self._make_pool()
+
+    def _make_pool(self):
+        raise NotImplementedError
+
+    def _run(self, route_geometry, route_miles, options, legs, table):
+        raise NotImplementedError
+
+    def plan(self, route_geometry, route_miles, options, legs=None, table=None):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            PLANNING_JOBS.labels(self.mode, "rejected").inc()
+            raise PlanningOverloaded(retry_after=round(self.queue_timeout, 1))
+        with self._lock:
+            self.in_flight += 1
+        try:
+            result = self._run(route_geometry, route_miles, options, legs, table)
+        except Exception:
+            PLANNING_JOBS.labels(self.mode, "error").inc()
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+        PLANNING_JOBS.labels(self.mode, "ok").inc()
+        return result
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ThreadPlanner(_PooledPlanner):
+    """
+    Planning on a thread pool: bounds concurrency, the NumPy parts run
+    without the GIL but the planner loop itself still holds it
+    """
+
+    mode = "thread"
+
+    def _make_pool(self):
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="planner")
+
+    def _run(self, route_geometry, route_miles, options, legs, table):
+        return self.pool.submit(
+            plan_route_fuel, route_geometry, route_miles=route_miles, table=table, legs=legs, **options,
+        ).result()
+
+
+def _init_worker(settings_module):
+    # Each worker loads the station table and its spatial index once, before its first job
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+    from fuel.spatial import get_station_grid
+    from fuel.stations import get_station_table
+    table = get_station_table()
+    get_station_grid(table)
+    logger.info("Planning worker %d ready with %d stations", os.getpid(), len(table))
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _plan_job(coords, shared, route_miles, options, legs):
+    """
+    Worker side of ProcessPlanner: `coords` is the [lng, lat] array, or
+    None with `shared` = (name, rows) of a shared memory block holding it
+    """
+    block = None
+    if shared is not None:
+        name, rows = shared
+        # Pool workers share the parent's resource tracker, which already knows the block;
+        # the parent unlinks it once the job is done
+        block = shared_memory.SharedMemory(name=name)
+        coords = np.ndarray((rows, 2), dtype=np.float64, buffer=block.buf)
+    try:
+        return plan_route_fuel(RouteGeometry(coords), route_miles=route_miles, legs=legs, **options)
+    finally:
+        if block is not None:
+            del coords
+            try:
+                block.close()
+            except BufferError:
+                # A view is still held by an exception traceback; the mapping goes when that is collected
+                pass
+
+
+class ProcessPlanner(_PooledPlanner):
+    """
+    Planning on a pool of prewarmed worker processes, so planning scales
+    with cores instead of serialising on the GIL.
+
+    Workers set up Django and load the station table and grid once (see
+    _init_worker), and keep them reloaded like any other process. Routes
+    of SHARED_MEMORY_MIN_POINTS vertices or more are copied once into a
+    shared memory block that the worker maps, instead of being pickled.
+    Each worker plans against its own copy of the station table, so the
+    `table` argument is ignored.
+
+    A worker that dies (OOM, a signal) breaks the whole pool: it is
+    replaced with a fresh one and the job retried once, after which the
+    caller gets PlanningOverloaded.
+    """
+
+    mode = "process"
+
+    def __init__(self, workers, max_pending, queue_timeout, start_method, shared_memory_min_points):
+        self.start_method = start_method
+        self.shared_memory_min_points = shared_memory_min_points
+        self._pool_lock = threading.Lock()
+        self.restarts = 0
+        super().__init__(workers, max_pending, queue_timeout)
+        self._warmed = False
+
+    def _make_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_init_worker,
+            initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", "config.settings"),),
+        )
+
+    def warm(self):
+        """
+        Start every worker now (and let it load the station index) rather than on the first requests
+        """
+        if not self._warmed:
+            pids = {f.result() for f in [self.pool.submit(_worker_ready) for _ in range(self.workers)]}
+            self._warmed = True
+            logger.info("Planning pool warm: %d worker processes", len(pids))
+
+    def _replace_pool(self, broken):
+        with self._pool_lock:
+            # Concurrent callers all see the same broken pool; only the first replaces it
+            if self.pool is broken:
+                logger.warning("Planning worker died, starting a new process pool")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.pool = self._make_pool()
+                self._warmed = False
+                self.restarts += 1
+
+    def _call(self, *args):
+        for _ in range(2):
+            pool = self.pool
+            try:
+                return pool.submit(_plan_job, *args).result()
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+        raise PlanningOverloaded(retry_after=1.0, message="Route planning workers restarted, try again shortly")
+
+    def _run(self, route_geometry, route_miles, options, legs, table):
+        coords = np.ascontiguousarray(route_geometry.coords, dtype=np.float64)
+        if len(coords) < self.shared_memory_min_points:
+            return self._call(coords, None, route_miles, options, legs)
+
+        block = shared_memory.SharedMemory(create=True, size=max(coords.nbytes, 1))
+        try:
+            np.ndarray(coords.shape, dtype=np.float64, buffer=block.buf)[:] = coords
+            return self._call(None, (block.name, len(coords)), route_miles, options, legs)
+        finally:
+            block.close()
+            block.unlink()
+
+    def stats(self):
+        return {**super().stats(), "restarts": self.restarts}
+
+
+def planning_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'PLANNING_EXECUTOR', {})}
+
+
+def make_planner(options):
+    mode = options['MODE']
+    if mode == "inline":
+        return InlinePlanner()
+    if mode == "thread":
+        return ThreadPlanner(options['WORKERS'], options['MAX_PENDING'], options['QUEUE_TIMEOUT_SECONDS'])
+    if mode == "process":
+        return ProcessPlanner(
+            options['WORKERS'], options['MAX_PENDING'], options['QUEUE_TIMEOUT_SECONDS'],
+            options['START_METHOD'], options['SHARED_MEMORY_MIN_POINTS'],
+        )
+    raise ImproperlyConfigured(f"Unknown PLANNING_EXECUTOR mode {mode!r}, expected 'inline', 'thread' or 'process'")
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def get_planner():
+    """
+    Shared planner selected by settings.PLANNING_EXECUTOR['MODE']
+    """
+    global _planner
+    mode = planning_settings()['MODE']
+    planner = _planner
+    if planner is None or planner.mode != mode:
+        with _planner_lock:
+            planner = _planner
+            if planner is None or planner.mode != mode:
+                if planner is not None:
+                    planner.shutdown()
+                planner = _planner = make_planner(planning_settings())
+    return planner
+
+
+def reset_planner():
+    """
+    Shut down the shared planner so the next call builds one from the current settings (tests)
+    """
+    global _planner
+    with _planner_lock:
+        if _planner is not None:
+            _planner.shutdown()
+        _planner = None
+
+
+def warm_planner():
+    """
+    Create the configured planner and start its workers (called from the WSGI/ASGI entry points)
+    """
+    planner = get_planner()
+    planner.warm()
+    return planner
+
+
+def collect_planning_metrics():
+    """
+    Scrape-time samples for config.metrics: planning pool occupancy
+    """
+    planner = _planner
+    if planner is None or planner.mode == "inline":
+        return []
+    return [
+        ('fuelroute_planning_in_flight', 'gauge', 'Planning jobs running or queued', None, planner.in_flight),
+        ('fuelroute_planning_capacity', 'gauge', 'Planning jobs admitted at once', None, planner.max_pending),
+    ]
@@ -0,0 +1,330 @@
+import asyncio
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+DEFAULT_SETTINGS = {
+    # ORS free tier: 40 directions requests per minute
+    'RATE_PER_SECOND': 40 / 60,
+    'BURST': 10,
+    # How long a request may queue for a token before giving up
+    'MAX_WAIT_SECONDS': 5.0,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_SECONDS': 30.0,
+    'COALESCE': True,
+}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key across threads.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait and get the same result (or exception) instead of
+    repeating the work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = [threading.Event(), None, None]
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+
+        try:
+            call[1] = fn()
+            return call[1]
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines. In-flight calls are tracked per event loop.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.leaders += 1
+        future = calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here so an unawaited future doesn't warn
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, up to `burst` saved up
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.rejected = 0
+
+    def _reserve(self, max_wait):
+        # Take a token now or reserve the next one, returning how long to sleep (None = rejected)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate if self.rate > 0 else None
+            if wait is None or wait > max_wait:
+                self.rejected += 1
+                return None
+            self._tokens -= 1
+            self.granted += 1
+            return wait
+
+    def acquire(self, max_wait=0.0):
+        """
+        Take one token, sleeping up to `max_wait` seconds for it. Returns False when none came in time.
+        """
+        wait = self._reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def acquire_async(self, max_wait=0.0):
+        wait = self._reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+    def stats(self):
+        with self._lock:
+            available = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'available': round(available, 2),
+                'granted': self.granted,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive upstream failures.
+
+    closed: calls go through. open: calls are refused until `reset_seconds`
+    have passed. half_open: one trial call is let through; success closes
+    the circuit, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self.opened = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._state = self.HALF_OPEN
+            self._trial = False
+        return self._state
+
+    def retry_after(self):
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def allow(self):
+        """
+        Whether a call may go upstream now
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def release(self):
+        """
+        Hand back a half-open trial that never reached upstream (refused by the quota, cancelled)
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'short_circuited': self.short_circuited,
+            }
+
+
+class UpstreamGuard:
+    """
+    Rate limit, circuit breaker and request coalescing for one upstream
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.bucket = TokenBucket(options['RATE_PER_SECOND'], options['BURST'])
+        self.breaker = CircuitBreaker(options['FAILURE_THRESHOLD'], options['RESET_SECONDS'])
+        self.flights = SingleFlight()
+        self.async_flights = AsyncSingleFlight()
+        self.stale_served = 0
+        self._lock = threading.Lock()
+
+    def record_stale(self):
+        """
+        Count a stale cached route served in place of a failed upstream call
+        """
+        with self._lock:
+            self.stale_served += 1
+
+    def stats(self):
+        return {
+            'circuit': self.breaker.stats(),
+            'rate_limit': self.bucket.stats(),
+            'single_flight': {
+                'leaders': self.flights.leaders + self.async_flights.leaders,
+                'coalesced': self.flights.coalesced + self.async_flights.coalesced,
+            },
+            'stale_served': self.stale_served,
+        }
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_ors_guard():
+    """
+    Process-wide UpstreamGuard for ORS, configured from settings.ORS_RESILIENCE
+    """
+    global _guard
+    options = {**DEFAULT_SETTINGS, **getattr(settings, 'ORS_RESILIENCE', {})}
+    if _guard is None or _guard.options != options:
+        with _guard_lock:
+            if _guard is None or _guard.options != options:
+                _guard = UpstreamGuard(options)
+    return _guard
+
+
+def reset_ors_guard():
+    """
+    Drop the ORS guard so the next call starts from a closed circuit and full bucket (tests)
+    """
+    global _guard
+    with _guard_lock:
+        _guard = None
+
+
+_CIRCUIT_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def collect_ors_metrics():
+    """
+    Scrape-time samples for config.metrics: circuit state, quota and coalescing counters
+    """
+    guard = _guard
+    if guard is None:
+        return []
+    stats = guard.stats()
+    circuit, bucket, flights = stats['circuit'], stats['rate_limit'], stats['single_flight']
+    return [
+        ('fuelroute_ors_circuit_state', 'gauge', 'ORS circuit (0 closed, 1 half open, 2 open)', None,
+         _CIRCUIT_STATES[circuit['state']]),
+        ('fuelroute_ors_circuit_opened_total', 'counter', 'Times the ORS circuit opened', None, circuit['opened']),
+        ('fuelroute_ors_short_circuited_total', 'counter', 'Calls refused by the open circuit', None,
+         circuit['short_circuited']),
+        ('fuelroute_ors_tokens_available', 'gauge', 'Tokens left in the ORS rate limiter', None, bucket['available']),
+        ('fuelroute_ors_rate_limited_total', 'counter', 'Calls refused by the ORS rate limiter', None, bucket['rejected']),
+        ('fuelroute_route_fetches_total', 'counter', 'Route cache misses by coalescing role', {'role': 'leader'},
+         flights['leaders']),
+        ('fuelroute_route_fetches_total', 'counter', 'Route cache misses by coalescing role', {'role': 'coalesced'},
+         flights['coalesced']),
+        ('fuelroute_stale_routes_total', 'counter', 'Stale cached routes served while upstream failed', None,
+         stats['stale_served']),
+    ]
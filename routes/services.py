@@ -1,49 +1,473 @@
-print("[+] [DEBUG] services.py loaded")  # Confirms the file was loaded.
-
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from config import codec
+from config.metrics import REGISTRY, span
+from routes.backends import get_routing_backend
+from routes.cache import get_route_cache, lane_key
+from routes.clients import get_async_client, get_sync_session, http_settings
+from routes.geometry import decode_polyline
+from routes.resilience import get_ors_guard
 
-def get_route_details(start_coords, end_coords):
-    url = 'https://api.openrouteservice.org/v2/directions/driving-car'
+logger = logging.getLogger(__name__)
 
-    # Convert input to lists in case they are passed as tuples
-    if isinstance(start_coords, tuple):
-        start_coords = list(start_coords)
-    if isinstance(end_coords, tuple):
-        end_coords = list(end_coords)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "fuelroute_upstream_errors_total", "Failed or refused routing upstream calls", labels=("reason",),
+)
 
-    headers = {
-        'Authorization': settings.ORS_API_KEY,
-        'Content-Type': 'application/json'
+ORS_BASE_URL = 'https://api.openrouteservice.org'
+DEFAULT_PROFILE = 'driving-car'
+
+
+class RoutingError(Exception):
+    """
+    Routing service failure. `extra` holds additional fields for the error response.
+
+    `status` is the HTTP status to answer with; `transient` marks upstream
+    trouble (network errors, 5xx, 429) that trips the circuit breaker and
+    may be answered from a stale cached route.
+    """
+
+    def __init__(self, message, status=500, transient=False, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.transient = transient
+        self.extra = extra
+
+
+class UpstreamUnavailable(RoutingError):
+    """
+    ORS skipped on purpose: the circuit is open or the request quota is used up
+    """
+
+    def __init__(self, message, status=503, **extra):
+        super().__init__(message, status=status, transient=True, **extra)
+
+
+def ors_api_key():
+    key = getattr(settings, 'ORS_API_KEY', '') or os.getenv('ORS_API_KEY', '')
+    return key.strip()
+
+
+def parse_route_response(route_data):
+    """
+    Normalise an ORS directions response (GeoJSON or default format) to
+    {'geometry': [[lng, lat], ...], 'distance_meters', 'duration_seconds', 'format'}
+    """
+    route_geometry = []
+    distance_meters = 0
+    duration_seconds = 0
+
+    # Format 1: GeoJSON (with "features")
+    if "features" in route_data:
+        route_format = "geojson"
+        features = route_data.get("features", [])
+        if features:
+            feature = features[0]
+            geometry = feature.get("geometry", {})
+
+            if isinstance(geometry, dict) and "coordinates" in geometry:
+                route_geometry = geometry["coordinates"]
+
+            properties = feature.get("properties", {})
+            if "summary" in properties:
+                summary = properties["summary"]
+                distance_meters = summary.get("distance", 0)
+                duration_seconds = summary.get("duration", 0)
+            elif "segments" in properties and properties["segments"]:
+                segments = properties["segments"]
+                distance_meters = sum(seg.get("distance", 0) for seg in segments)
+                duration_seconds = sum(seg.get("duration", 0) for seg in segments)
+
+    # Format 2: Default format (with "routes")
+    elif "routes" in route_data:
+        route_format = "default"
+        routes = route_data.get("routes", [])
+        if routes:
+            route = routes[0]
+            geometry = route.get("geometry", {})
+
+            if isinstance(geometry, dict) and "coordinates" in geometry:
+                route_geometry = geometry["coordinates"]
+            elif isinstance(geometry, str):
+                # Encoded polyline
+                elevation = route_data.get("metadata", {}).get("query", {}).get("elevation")
+                try:
+                    route_geometry = decode_polyline(geometry, dimensions=3 if elevation else 2).tolist()
+                except ValueError as e:
+                    raise RoutingError(f"Could not decode route polyline: {e}")
+
+            summary = route.get("summary", {})
+            distance_meters = summary.get("distance", 0)
+            duration_seconds = summary.get("duration", 0)
+
+    else:
+        raise RoutingError(
+            "Unexpected ORS response format",
+            ors_response_keys=list(route_data.keys()),
+            sample_response=json.dumps(route_data)[:500],
+        )
+
+    if not route_geometry:
+        raise RoutingError("Could not extract route geometry")
+
+    return {
+        'geometry': route_geometry,
+        'distance_meters': distance_meters,
+        'duration_seconds': duration_seconds,
+        'format': route_format,
     }
 
+
+def _directions_request(start_coords, end_coords, profile):
+    """
+    (url, request kwargs) for an ORS directions call
+    """
+    api_key = ors_api_key()
+    if not api_key:
+        raise RoutingError(
+            "ORS_API_KEY not found. Check your .env file.",
+            debug="Set ORS_API_KEY=your_key_here in .env file",
+        )
+
+    base_url = getattr(settings, 'ORS_BASE_URL', ORS_BASE_URL).rstrip('/')
+    url = f"{base_url}/v2/directions/{profile}"
+    headers = {
+        'Authorization': api_key,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
     payload = {
-        'coordinates': [start_coords, end_coords]
+        'coordinates': [list(start_coords), list(end_coords)]
     }
+    return url, {'headers': headers, 'json': payload, 'params': {'format': 'geojson'}}
 
+
+def _directions_result(status_code, content):
+    # content is the raw body: the codec parses bytes directly, text is only decoded for errors
+    if status_code != 200:
+        text = content.decode("utf-8", errors="replace")
+        logger.warning("ORS returned %s", status_code, extra={"ors_error": text[:200]})
+        UPSTREAM_ERRORS.labels(f"http_{status_code}").inc()
+        raise RoutingError(
+            f"ORS API returned error {status_code}",
+            transient=status_code >= 500 or status_code == 429,
+            ors_status=status_code,
+            ors_error=text[:500] if text else "No error message",
+        )
     try:
-        print("[DEBUG] Sending POST request to ORS API...")
-        print(f"[DEBUG] Payload: {payload}")
-        print(f"[DEBUG] Headers: {headers}")
+        route_data = codec.loads(content)
+    except ValueError as e:
+        UPSTREAM_ERRORS.labels("invalid_json").inc()
+        raise RoutingError(f"ORS returned invalid JSON: {e}", transient=True)
+    return parse_route_response(route_data)
+
+
+def _network_error(e):
+    logger.warning("ORS request failed: %s", e)
+    UPSTREAM_ERRORS.labels("network").inc()
+    return RoutingError(
+        f"Network error: {str(e)}",
+        transient=True,
+        debug="Check internet connection or ORS API availability",
+    )
+
 
-        response = requests.post(url, json=payload, headers=headers)
+def _admit(guard, granted):
+    if not granted:
+        UPSTREAM_ERRORS.labels("quota").inc()
+        raise UpstreamUnavailable(
+            "ORS request quota exhausted, try again shortly",
+            status=429,
+            retry_after=round(1 / guard.bucket.rate, 1) if guard.bucket.rate else None,
+        )
 
-        print(f"[DEBUG] Received response with status code: {response.status_code}")
-        print(f"[DEBUG] Raw API Response: {response.text}")
 
-        response.raise_for_status()  # Raises error if not 2XX
+def _refuse_if_open(guard):
+    if not guard.breaker.allow():
+        UPSTREAM_ERRORS.labels("circuit_open").inc()
+        raise UpstreamUnavailable(
+            "ORS is unavailable (circuit open), failing fast",
+            retry_after=round(guard.breaker.retry_after(), 1),
+        )
 
-        data = response.json()
 
-        route = data['features'][0]['properties']['segments'][0]
-        geometry = data['features'][0]['geometry']['coordinates']
+def _record(guard, error):
+    if error is None or not error.transient:
+        guard.breaker.record_success()
+    elif isinstance(error, UpstreamUnavailable):
+        # Refused before reaching ORS: says nothing about its health
+        guard.breaker.release()
+    else:
+        guard.breaker.record_failure()
+
+
+def request_route(start_coords, end_coords, profile=DEFAULT_PROFILE):
+    """
+    Call ORS directions for one lane over the pooled session and return the normalised route (no caching).
+
+    Calls pass the ORS circuit breaker and token bucket first (see routes.resilience).
+    A half-open trial call that doesn't reach ORS is handed back to the breaker.
+    """
+    url, kwargs = _directions_request(start_coords, end_coords, profile)
+    guard = get_ors_guard()
+    _refuse_if_open(guard)
+    try:
+        _admit(guard, guard.bucket.acquire(guard.options['MAX_WAIT_SECONDS']))
+        try:
+            response = get_sync_session().post(url, timeout=http_settings()['TIMEOUT'], **kwargs)
+        except requests.RequestException as e:
+            raise _network_error(e)
+        route = _directions_result(response.status_code, response.content)
+    except RoutingError as e:
+        _record(guard, e)
+        raise
+    except BaseException:
+        guard.breaker.release()
+        raise
+    _record(guard, None)
+    return route
 
-        return {
-            'distance_km': round(route['distance'] / 1000, 2),
-            'duration_min': round(route['duration'] / 60, 2),
-            'path': geometry
-        }
 
-    except requests.RequestException as e:
-        print(f"[ERROR] Routing API call failed: {e}")
-        return {'error': f'Routing service failed: {str(e)}'}
\ No newline at end of file
+async def request_route_async(start_coords, end_coords, profile=DEFAULT_PROFILE):
+    """
+    Async request_route over the pooled keep-alive httpx client
+    """
+    import httpx
+
+    url, kwargs = _directions_request(start_coords, end_coords, profile)
+    guard = get_ors_guard()
+    _refuse_if_open(guard)
+    try:
+        _admit(guard, await guard.bucket.acquire_async(guard.options['MAX_WAIT_SECONDS']))
+        try:
+            response = await get_async_client().post(url, **kwargs)
+        except httpx.HTTPError as e:
+            raise _network_error(e)
+        route = _directions_result(response.status_code, response.content)
+    except RoutingError as e:
+        _record(guard, e)
+        raise
+    except BaseException:
+        guard.breaker.release()
+        raise
+    _record(guard, None)
+    return route
+
+
+def _stale_route(cache, key, error):
+    """
+    Expired cached route to answer with while upstream is failing, or None
+    """
+    if cache is None or not error.transient:
+        return None
+    route = cache.get(key, allow_stale=True)
+    if route is None:
+        return None
+    get_ors_guard().record_stale()
+    logger.warning("Serving stale route for %s: %s", key, error.message)
+    route['cached'] = True
+    route['stale'] = True
+    return route
+
+
+def fetch_route(start_coords, end_coords, profile=DEFAULT_PROFILE, use_cache=True):
+    """
+    Normalised route for a lane, served from the route cache when possible
+    and otherwise from the configured routing backend (ORS or the local graph).
+
+    Concurrent misses for the same lane share one backend call. When the
+    backend is failing, an expired cached route is served instead if there
+    is one (flagged 'stale'). The returned dict has a 'cached' flag telling
+    whether the backend was skipped.
+    """
+    backend = get_routing_backend()
+    cache = get_route_cache() if use_cache else None
+    cache_profile = backend.cache_profile(profile)
+    key = lane_key(start_coords, end_coords, cache_profile)
+
+    if cache:
+        route = cache.get(key)
+        if route is not None:
+            route['cached'] = True
+            return route
+
+    def load():
+        with span("upstream"):
+            route = backend.route(start_coords, end_coords, profile)
+        if cache:
+            cache.set(key, route)
+        return route
+
+    guard = get_ors_guard()
+    try:
+        route = guard.flights.do(key, load) if guard.options['COALESCE'] else load()
+    except RoutingError as e:
+        route = _stale_route(cache, key, e)
+        if route is None:
+            raise
+        return route
+    # Coalesced callers share the leader's dict, each gets its own copy
+    route = dict(route)
+    route['cached'] = False
+    return route
+
+
+async def fetch_route_async(start_coords, end_coords, profile=DEFAULT_PROFILE, use_cache=True):
+    """
+    Async fetch_route: cache lookups run in a worker thread, ORS goes through the async client
+    """
+    backend = get_routing_backend()
+    cache = get_route_cache() if use_cache else None
+    cache_profile = backend.cache_profile(profile)
+    key = lane_key(start_coords, end_coords, cache_profile)
+
+    if cache:
+        route = await sync_to_async(cache.get, thread_sensitive=False)(key)
+        if route is not None:
+            route['cached'] = True
+            return route
+
+    async def load():
+        with span("upstream"):
+            route = await backend.route_async(start_coords, end_coords, profile)
+        if cache:
+            await sync_to_async(cache.set, thread_sensitive=False)(key, route)
+        return route
+
+    guard = get_ors_guard()
+    try:
+        route = await (guard.async_flights.do(key, load) if guard.options['COALESCE'] else load())
+    except RoutingError as e:
+        route = await sync_to_async(_stale_route, thread_sensitive=False)(cache, key, e)
+        if route is None:
+            raise
+        return route
+    route = dict(route)
+    route['cached'] = False
+    return route
+
+
+def join_legs(legs):
+    """
+    One normalised route out of consecutive leg routes. Carries 'legs'
+    (distance, duration and first vertex of each leg in the joined geometry).
+    """
+    geometry = []
+    summary = []
+    for leg in legs:
+        coords = leg['geometry']
+        # Each leg starts where the previous one ended, keep that vertex once
+        if geometry and coords and list(coords[0][:2]) == list(geometry[-1][:2]):
+            coords = coords[1:]
+        summary.append({
+            'distance_meters': leg['distance_meters'],
+            'duration_seconds': leg['duration_seconds'],
+            'first_vertex': max(0, len(geometry) - 1),
+            'cached': leg.get('cached', False),
+        })
+        geometry.extend(coords)
+    return {
+        'geometry': geometry,
+        'distance_meters': sum(leg['distance_meters'] for leg in legs),
+        'duration_seconds': sum(leg['duration_seconds'] for leg in legs),
+        'format': legs[0]['format'],
+        'cached': all(leg.get('cached', False) for leg in legs),
+        'stale': any(leg.get('stale', False) for leg in legs),
+        'legs': summary,
+    }
+
+
+def fetch_route_via(points, profile=DEFAULT_PROFILE, use_cache=True):
+    """
+    Route through `points` in order ([start, waypoint..., end]).
+
+    Each leg is a fetch_route() of its own, so legs come out of the route
+    cache independently and a leg shared with other routes is fetched once.
+    Two points give the plain fetch_route() result.
+    """
+    if len(points) == 2:
+        return fetch_route(points[0], points[1], profile, use_cache)
+    pairs = list(zip(points, points[1:]))
+    with ThreadPoolExecutor(max_workers=min(len(pairs), http_settings()['PER_HOST_LIMIT'])) as executor:
+        legs = list(executor.map(
+            lambda pair, context: context.run(fetch_route, pair[0], pair[1], profile, use_cache),
+            pairs, [contextvars.copy_context() for _ in pairs],
+        ))
+    return join_legs(legs)
+
+
+async def fetch_route_via_async(points, profile=DEFAULT_PROFILE, use_cache=True):
+    """
+    Async fetch_route_via, legs fetched concurrently
+    """
+    if len(points) == 2:
+        return await fetch_route_async(points[0], points[1], profile, use_cache)
+    legs = await asyncio.gather(*(
+        fetch_route_async(a, b, profile, use_cache) for a, b in zip(points, points[1:])
+    ))
+    return join_legs(legs)
+
+
+def fetch_routes_from(start_coords, ends, profile=DEFAULT_PROFILE, use_cache=True):
+    """
+    Routes from one start to each of `ends` (a route dict or a RoutingError
+    per destination, in order). Cached lanes are served from the route
+    cache; backends with one-to-many support answer the rest with one
+    shared search, others go through fetch_route() lane by lane.
+    """
+    backend = get_routing_backend()
+    if not backend.one_to_many:
+        routes = []
+        for end_coords in ends:
+            try:
+                routes.append(fetch_route(start_coords, end_coords, profile, use_cache))
+            except RoutingError as e:
+                routes.append(e)
+        return routes
+
+    cache = get_route_cache() if use_cache else None
+    cache_profile = backend.cache_profile(profile)
+    routes = [None] * len(ends)
+    missing = []
+    for i, end_coords in enumerate(ends):
+        route = cache.get(cache.key(start_coords, end_coords, cache_profile)) if cache else None
+        if route is not None:
+            route['cached'] = True
+            routes[i] = route
+        else:
+            missing.append(i)
+    if missing:
+        try:
+            with span("upstream"):
+                found = backend.route_from(start_coords, [ends[i] for i in missing], profile)
+        except RoutingError as e:
+            found = [e] * len(missing)
+        for i, route in zip(missing, found):
+            if not isinstance(route, RoutingError):
+                if cache:
+                    cache.set(cache.key(start_coords, ends[i], cache_profile), route)
+                route = {**route, 'cached': False}
+            routes[i] = route
+    return routes
+
+
+def get_route_details(start_coords, end_coords, waypoints=()):
+    try:
+        route = fetch_route_via([start_coords, *waypoints, end_coords])
+    except RoutingError as e:
+        logger.warning("Routing failed: %s", e.message)
+        return {'error': f'Routing service failed: {e.message}'}
+
+    return {
+        'distance_km': round(route['distance_meters'] / 1000, 2),
+        'duration_min': round(route['duration_seconds'] / 60, 2),
+        'path': route['geometry']
+    }
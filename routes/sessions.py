@@ -0,0 +1,283 @@
+import secrets
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from config.metrics import REGISTRY, span
+from fuel.spatial import project_many
+from fuel.stations import get_station_table
+from fuel.utils import CORRIDOR_RADIUS_MILES, plan_candidates, route_candidates
+from routes.geometry import RouteGeometry
+
+DEFAULT_SETTINGS = {
+    'TTL_SECONDS': 6 * 3600,
+    'MAX_SESSIONS': 10000,
+    # Further off the route than this and an update fetches a new route to the destination
+    'REROUTE_MILES': CORRIDOR_RADIUS_MILES,
+}
+
+# How far behind the last known position a position update may snap (GPS jitter, a missed exit)
+_REWIND_MILES = 5.0
+
+SESSION_UPDATES = REGISTRY.counter(
+    "fuelroute_route_session_updates_total", "Route session updates by outcome", labels=("result",),
+)
+
+
+class RouteSession:
+    """
+    A planned route kept for re-planning as the truck drives it.
+
+    Holds the route geometry, the corridor candidates (positions already in
+    road miles) and the last plan. An update moves the truck along the
+    route and re-solves the remaining suffix only: no routing call, no
+    corridor search, just the greedy planner over the stations ahead.
+    Candidates are rebuilt when the station table changes underneath.
+    """
+
+    # Everything an update may change, saved so a failed update can be undone
+    _STATE = (
+        "geometry", "route_miles", "legs", "scale", "waypoints", "table", "hits", "positions", "prices",
+        "miles", "fuel", "plan", "stops", "revision", "reroutes",
+    )
+
+    def __init__(self, route_geometry, route_miles, params, table=None, legs=None):
+        self.id = secrets.token_urlsafe(16)
+        self.params = params
+        self.lock = threading.Lock()
+        self.revision = 0
+        self.reroutes = 0
+        self._set_route(route_geometry, route_miles, params["waypoints"], legs, table)
+        self.miles = 0.0
+        self.fuel = params["tank_gallons"] if params["start_fuel"] is None else params["start_fuel"]
+        self.plan = None
+        self.stops = []
+
+    def _set_route(self, route_geometry, route_miles, waypoints, legs, table=None):
+        self.geometry = route_geometry
+        self.route_miles = route_miles
+        self.legs = legs
+        geometry_miles = route_geometry.length_miles
+        self.scale = route_miles / geometry_miles if geometry_miles > 0 else 1.0
+        # (waypoint, road miles from the start) for the stops still ahead
+        cumulative = route_geometry.cumulative_miles
+        self.waypoints = [
+            (point, float(cumulative[leg["first_vertex"]]) * self.scale)
+            for point, leg in zip(waypoints, (legs or [])[1:])
+        ]
+        self._load_candidates(table or get_station_table())
+
+    def _load_candidates(self, table):
+        self.table = table
+        self.hits, self.positions, self.prices = route_candidates(
+            self.geometry, self.route_miles, table=table, legs=self.legs,
+        )
+
+    def replan(self):
+        """
+        Re-solve the route past the current position with the current fuel.
+        Raises fuel.planner.RouteNotCoverable.
+        """
+        table = get_station_table()
+        if table is not self.table:
+            self._load_candidates(table)
+        self.plan, self.stops = plan_candidates(
+            self.table, self.hits, self.positions, self.prices, self.route_miles,
+            tank_gallons=self.params["tank_gallons"], mpg=self.params["mpg"],
+            start_fuel=self.fuel, offset_miles=self.miles,
+        )
+        self.revision += 1
+        return self.plan, self.stops
+
+    def locate(self, lng, lat):
+        """
+        (road miles from the start, miles off the route) of a position,
+        snapped to the nearest part of the route not behind the truck
+        """
+        xs, ys = self.geometry.xy
+        cumulative = self.geometry.cumulative_miles
+        if len(xs) < 2:
+            return 0.0, 0.0
+        px, py = project_many(lat, lng)
+        behind = self.miles / self.scale - _REWIND_MILES
+        lo = max(0, bisect_right(cumulative, behind) - 1) if behind > 0 else 0
+        lo = min(lo, len(xs) - 2)
+        x1, y1, x2, y2 = xs[lo:-1], ys[lo:-1], xs[lo + 1:], ys[lo + 1:]
+        dx, dy = x2 - x1, y2 - y1
+        seg2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.clip(np.where(seg2 > 0, ((px - x1) * dx + (py - y1) * dy) / seg2, 0.0), 0.0, 1.0)
+        ex, ey = x1 + t * dx - px, y1 + t * dy - py
+        d2 = ex * ex + ey * ey
+        j = int(np.argmin(d2))
+        along = cumulative[lo + j] + t[j] * (cumulative[lo + j + 1] - cumulative[lo + j])
+        return float(along) * self.scale, float(np.sqrt(d2[j]))
+
+    def fuel_at(self, miles):
+        """
+        Fuel left at `miles` if the truck bought what the last plan said on the way there
+        """
+        fuel = self.fuel
+        for stop in self.stops:
+            if self.miles <= stop["miles_from_start"] <= miles:
+                fuel += stop["gallons"]
+        fuel -= (miles - self.miles) / self.params["mpg"]
+        return max(0.0, min(fuel, self.params["tank_gallons"]))
+
+    def advance(self, miles, fuel=None):
+        """
+        Move the truck to `miles` along the route with `fuel` gallons (estimated from the last plan when None)
+        """
+        miles = max(0.0, min(float(miles), self.route_miles))
+        self.fuel = self.fuel_at(miles) if fuel is None else max(0.0, min(float(fuel), self.params["tank_gallons"]))
+        self.miles = miles
+
+    def remaining_waypoints(self, miles):
+        return [point for point, at in self.waypoints if at > miles]
+
+    def reroute(self, route, waypoints):
+        """
+        Replace the remaining route after a detour with `route`, a route
+        from the truck through `waypoints` to the destination
+        """
+        geometry = RouteGeometry(route["geometry"])
+        route_miles = route["distance_meters"] * 0.000621371 if route["distance_meters"] else geometry.length_miles
+        self._set_route(geometry, route_miles, waypoints, route.get("legs"))
+        self.miles = 0.0
+        self.reroutes += 1
+
+    def save(self):
+        return {name: getattr(self, name) for name in self._STATE}
+
+    def restore(self, saved):
+        for name, value in saved.items():
+            setattr(self, name, value)
+
+    def state(self):
+        plan = self.plan
+        return {
+            "route_id": self.id,
+            "revision": self.revision,
+            "reroutes": self.reroutes,
+            "miles_from_start": round(self.miles, 1),
+            "remaining_miles": round(self.route_miles - self.miles, 1),
+            "fuel_gallons": round(self.fuel, 2),
+            "remaining_fuel_cost": round(plan.trip_cost, 2) if plan else None,
+            "remaining_purchase_cost": round(plan.total_cost, 2) if plan else None,
+            "recommended_stops": self.stops,
+        }
+
+
+class RouteSessionStore:
+    """
+    In-process sessions by id: expire `ttl_seconds` after their last use,
+    least recently used evicted past `max_sessions`. Sessions live in the
+    worker that created them, so multi-worker deployments need sticky
+    routing on the route id.
+    """
+
+    def __init__(self, ttl_seconds, max_sessions):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def add(self, session):
+        with self._lock:
+            self._sessions[session.id] = (session, time.monotonic())
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (entry[0], now)
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+def session_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ROUTE_SESSIONS', {})}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """
+    Shared RouteSessionStore configured from settings.ROUTE_SESSIONS
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                options = session_settings()
+                _store = RouteSessionStore(options['TTL_SECONDS'], options['MAX_SESSIONS'])
+    return _store
+
+
+def update_session(session, data, fetch_route_via):
+    """
+    Apply a position/fuel update and re-plan the rest of the route.
+
+    `data` has either "position" ([lng, lat]) or "miles_from_start", and
+    optionally "fuel_gallons". Positions further than REROUTE_MILES off the
+    route get a new route through the waypoints still ahead to the
+    destination from `fetch_route_via(points)`.
+    Returns (state dict, None) or (None, error message). Raises
+    RouteNotCoverable and RoutingError, leaving the session as it was.
+    """
+    try:
+        position = data.get("position")
+        position = None if position is None else [float(position[0]), float(position[1])]
+        miles = data.get("miles_from_start")
+        miles = None if miles is None else float(miles)
+        fuel = data.get("fuel_gallons")
+        fuel = None if fuel is None else float(fuel)
+    except (TypeError, ValueError, IndexError, KeyError):
+        return None, "position must be [longitude, latitude]; miles_from_start and fuel_gallons must be numbers"
+    if (position is None) == (miles is None):
+        return None, "Give exactly one of position and miles_from_start"
+    if fuel is not None and fuel < 0:
+        return None, "fuel_gallons must not be negative"
+
+    with session.lock:
+        saved = session.save()
+        off_route = 0.0
+        rerouted = False
+        try:
+            if position is not None:
+                with span("locate"):
+                    miles, off_route = session.locate(*position)
+                if off_route > session_settings()['REROUTE_MILES']:
+                    if fuel is None:
+                        fuel = session.fuel_at(miles)
+                    waypoints = session.remaining_waypoints(miles)
+                    session.reroute(fetch_route_via([position, *waypoints, session.params["end"]]), waypoints)
+                    miles, rerouted = 0.0, True
+            session.advance(miles, fuel)
+            session.replan()
+        except BaseException:
+            session.restore(saved)
+            SESSION_UPDATES.labels("failed").inc()
+            raise
+        SESSION_UPDATES.labels("rerouted" if rerouted else "replanned").inc()
+        return {**session.state(), "off_route_miles": round(off_route, 2), "rerouted": rerouted}, None
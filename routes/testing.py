@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fuel.spatial import haversine_miles
+
+
+def straight_line_route(start, end, vertices=100):
+    """
+    ORS-style GeoJSON directions response for a straight line from start to end
+    """
+    n = max(1, vertices - 1)
+    coords = [
+        [start[0] + (end[0] - start[0]) * k / n, start[1] + (end[1] - start[1]) * k / n]
+        for k in range(n + 1)
+    ]
+    meters = haversine_miles(start[1], start[0], end[1], end[0]) / 0.000621371
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coords},
+            "properties": {
+                "summary": {"distance": meters, "duration": meters / 25.0},
+                "segments": [{"distance": meters, "duration": meters / 25.0}],
+            },
+        }],
+    }
+
+
+class StubORSServer:
+    """
+    Local stand-in for the ORS directions API, for tests and benchmarks.
+
+    Answers POST /v2/directions/<profile> with a straight-line GeoJSON route
+    of `vertices` points after `delay` seconds. Keeps HTTP/1.1 connections
+    alive and counts requests, connections and peak concurrency so tests can
+    check pooling and concurrency limits. Set `status` to make it fail.
+    """
+
+    def __init__(self, vertices=100, delay=0.0, status=200):
+        self.vertices = vertices
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    if stub.delay:
+                        time.sleep(stub.delay)
+                    if stub.status != 200:
+                        body = json.dumps({"error": {"code": stub.status, "message": "stub failure"}}).encode()
+                    else:
+                        start, end = payload["coordinates"][0], payload["coordinates"][-1]
+                        body = json.dumps(straight_line_route(start, end, stub.vertices)).encode()
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,3 +1,768 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from routes.benchmarks import compare
+from routes.cache import RouteCache, route_cache_key
+from routes.geometry import RouteGeometry, decode_polyline, encode_polyline, tolerance_for_zoom
+from routes.planning import reset_planner
+from routes.resilience import get_ors_guard, reset_ors_guard
+from routes.services import RoutingError, fetch_route, request_route_async
+from routes.testing import StubORSServer
+from routes.views import BINARY_GEOMETRY_TYPE
+
+DALLAS = [-96.80, 32.78]
+FORT_WORTH = [-97.33, 32.76]
+
+
+class StubORSTestCase(SimpleTestCase):
+    stub_options = {}
+    resilience = {}
+
+    def setUp(self):
+        self.stub = StubORSServer(**self.stub_options).start()
+        self.addCleanup(self.stub.stop)
+        overrides = override_settings(
+            ORS_API_KEY='test-key',
+            ORS_BASE_URL=self.stub.url,
+            ROUTE_CACHE={'DISABLED': True},
+            ORS_RESILIENCE={**self.resilience, 'RATE_PER_SECOND': 1000, 'BURST': 1000},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_ors_guard()
+        self.addCleanup(reset_ors_guard)
+
+    def route_body(self):
+        return json.dumps({"start": DALLAS, "end": FORT_WORTH})
+
+
+class CalculateRouteTests(StubORSTestCase):
+
+    def test_calculate_route_reuses_pooled_connection(self):
+        for _ in range(3):
+            response = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["status"], "success")
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_short_trip_on_the_starting_tank_is_not_free(self):
+        data = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json').json()
+        self.assertEqual(data["recommended_stops"], [])
+        self.assertEqual(data["fuel_purchase_cost"], 0)
+        expected = data["debug_info"]["gallons_needed"] * data["debug_info"]["tank_fuel_price"]
+        self.assertAlmostEqual(data["total_fuel_cost"], expected, delta=0.05)
+        self.assertGreater(data["total_fuel_cost"], 0)
+
+    async def test_calculate_route_async(self):
+        response = await self.async_client.post(
+            '/routes/calculate-route-async/', self.route_body(), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertGreater(data["route_distance_miles"], 20)
+        self.assertEqual(data["debug_info"]["geometry_points"], 100)
+
+    def test_invalid_coordinates(self):
+        response = self.client.post(
+            '/routes/calculate-route/', json.dumps({"start": "Dallas", "end": FORT_WORTH}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stub.requests, 0)
+
+
+def _encode_value(value):
+    # Reference encoder: the per-value loop from the polyline format description
+    value = ~(value << 1) if value < 0 else value << 1
+    out = ""
+    while value >= 0x20:
+        out += chr((0x20 | (value & 0x1f)) + 63)
+        value >>= 5
+    return out + chr(value + 63)
+
+
+class GeometryEngineTests(SimpleTestCase):
+
+    def test_polyline_matches_the_reference_format(self):
+        # The worked example from the format description
+        coords = decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        np.testing.assert_allclose(coords, [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]])
+
+        rng = np.random.default_rng(5)
+        coords = np.column_stack([rng.uniform(-180, 180, 500), rng.uniform(-90, 90, 500)]).round(5)
+        scaled = np.round(coords[:, ::-1] * 1e5).astype(int)
+        deltas = np.diff(scaled, axis=0, prepend=[[0, 0]]).ravel()
+        encoded = encode_polyline(coords)
+        self.assertEqual(encoded, "".join(_encode_value(int(d)) for d in deltas))
+        np.testing.assert_allclose(decode_polyline(encoded), coords, atol=1e-9)
+        self.assertEqual(encode_polyline([]), "")
+
+    def test_elevation_polylines_drop_the_third_value(self):
+        # lat, lng at 1e5 and elevation at 1e2 per vertex, as ORS encodes with elevation=true
+        points = [(38.5, -120.2, 412.5), (40.7, -120.95, 1388.0), (43.252, -126.453, 7.25)]
+        values = np.round(np.array(points) * [1e5, 1e5, 1e2]).astype(int)
+        deltas = np.diff(values, axis=0, prepend=[[0, 0, 0]]).ravel()
+        encoded = "".join(_encode_value(int(d)) for d in deltas)
+
+        np.testing.assert_allclose(decode_polyline(encoded, dimensions=3), [[lng, lat] for lat, lng, _ in points])
+        with self.assertRaises(ValueError):
+            decode_polyline(encoded)
+        with self.assertRaises(ValueError):
+            decode_polyline(encoded, dimensions=4)
+
+        from routes.services import parse_route_response
+        route = parse_route_response({
+            "routes": [{"geometry": encoded, "summary": {"distance": 1000.0}}],
+            "metadata": {"query": {"elevation": True}},
+        })
+        self.assertEqual(len(route["geometry"]), 3)
+
+    def test_malformed_polylines_are_rejected(self):
+        for encoded in ("_p~iF~ps|", "_p~iF~ps|U_", "_p~iF ps|U", "_p~iF~ps|U_ulL", "é"):
+            with self.assertRaises(ValueError, msg=encoded):
+                decode_polyline(encoded)
+
+    def test_distances_match_the_scalar_haversine(self):
+        from fuel.spatial import haversine_miles
+
+        route = RouteGeometry([[-96.8, 32.78], [-97.33, 32.76], [-101.83, 35.22], [-106.65, 35.08]])
+        expected = [0.0]
+        for (lng1, lat1), (lng2, lat2) in zip(route.coords, route.coords[1:]):
+            expected.append(expected[-1] + haversine_miles(lat1, lng1, lat2, lng2))
+        np.testing.assert_allclose(route.cumulative_miles, expected)
+        self.assertAlmostEqual(route.length_miles, expected[-1])
+        self.assertEqual(RouteGeometry([]).length_miles, 0.0)
+
+    def test_simplified_route_stays_within_tolerance(self):
+        rng = np.random.default_rng(11)
+        lngs = np.linspace(-100.0, -95.0, 3000)
+        lats = 35.0 + 0.3 * np.sin(lngs * 3) + rng.normal(0, 0.002, 3000)
+        route = RouteGeometry(np.column_stack([lngs, lats]))
+        for tolerance in (0.5, 2.0, 10.0):
+            simple = route.simplify(tolerance)
+            self.assertLess(len(simple), len(route))
+            np.testing.assert_array_equal(simple.coords[[0, -1]], route.coords[[0, -1]])
+            # Every original vertex is within tolerance of the simplified line
+            xs, ys = route.xy
+            sx, sy = simple.xy
+            x1, y1, dx, dy = sx[:-1], sy[:-1], np.diff(sx), np.diff(sy)
+            t = np.clip(((xs[:, None] - x1) * dx + (ys[:, None] - y1) * dy) / (dx * dx + dy * dy), 0, 1)
+            d = np.hypot(x1 + t * dx - xs[:, None], y1 + t * dy - ys[:, None]).min(axis=1)
+            self.assertLessEqual(d.max(), tolerance + 1e-9)
+        self.assertLess(tolerance_for_zoom(10), tolerance_for_zoom(4))
+        self.assertEqual(tolerance_for_zoom(99), tolerance_for_zoom(22))
+
+
+class RouteGeometryTests(StubORSTestCase):
+    stub_options = {'vertices': 2000}
+
+    def geometry(self, headers=None, **options):
+        body = json.dumps({"start": DALLAS, "end": FORT_WORTH, **options})
+        return self.client.post('/routes/route-geometry/', body, content_type='application/json', headers=headers)
+
+    @override_settings(ROUTE_GEOMETRY_CHUNK_POINTS=500)
+    def test_encodings_carry_the_same_vertices(self):
+        coords = np.array(json.loads(b"".join(self.geometry().streaming_content))["geometry"])
+        self.assertEqual(coords.shape, (2000, 2))
+
+        polyline = self.geometry(encoding="polyline").json()
+        np.testing.assert_allclose(decode_polyline(polyline["geometry"]), coords, atol=1e-9)
+
+        response = self.geometry(headers={"Accept": BINARY_GEOMETRY_TYPE})
+        self.assertEqual(response["Content-Type"], BINARY_GEOMETRY_TYPE)
+        binary = np.frombuffer(b"".join(response.streaming_content), dtype="<f4").reshape(-1, 2)
+        np.testing.assert_allclose(binary, coords, atol=1e-4)
+
+    def test_zoom_selects_level_of_detail(self):
+        full = self.geometry(encoding="polyline").json()
+        far = self.geometry(encoding="polyline", zoom=4).json()
+        self.assertEqual(full["points"], 2000)
+        self.assertEqual(full["tolerance_miles"], 0)
+        self.assertLess(far["points"], 2000)
+        self.assertGreater(far["tolerance_miles"], 1)
+        self.assertEqual(self.geometry(zoom=30).status_code, 400)
+
+    def test_calculate_route_map_encoding(self):
+        body = json.dumps({"start": DALLAS, "end": FORT_WORTH, "map": {"encoding": "polyline", "tolerance_miles": 0}})
+        data = self.client.post('/routes/calculate-route/', body, content_type='application/json').json()
+        self.assertEqual(len(decode_polyline(data["map_route"])), 2000)
+        self.assertEqual(data["debug_info"]["map_encoding"], "polyline")
+
+    def test_cheapest_stations_are_ranked_by_price(self):
+        body = json.dumps({"start": DALLAS, "end": FORT_WORTH, "limit": 3, "radius_miles": 25})
+        data = self.client.post('/routes/cheapest-stations/', body, content_type='application/json').json()
+        prices = [s["fuel_price"] for s in data["stations"]]
+        self.assertTrue(0 < len(prices) <= 3)
+        self.assertEqual(prices, sorted(prices))
+        self.assertTrue(all(s["offset_miles"] <= 25 for s in data["stations"]))
+        body = json.dumps({"start": DALLAS, "end": FORT_WORTH, "limit": 0})
+        self.assertEqual(self.client.post('/routes/cheapest-stations/', body, content_type='application/json').status_code, 400)
+
+
+class RouteSessionTests(StubORSTestCase):
+    lane = {"start": DALLAS, "end": [-87.63, 41.88], "range_miles": 700, "mpg": 10}
+
+    def update(self, route_id, **body):
+        return self.client.post(f'/routes/sessions/{route_id}/', json.dumps(body), content_type='application/json')
+
+    def test_updates_replan_without_routing(self):
+        created = self.client.post('/routes/sessions/', json.dumps(self.lane), content_type='application/json').json()
+        route_id = created["route_id"]
+        self.assertTrue(created["recommended_stops"])
+
+        data = self.update(route_id, miles_from_start=200, fuel_gallons=60).json()
+        self.assertEqual(data["miles_from_start"], 200)
+        self.assertTrue(all(s["miles_from_start"] >= 200 for s in data["recommended_stops"]))
+        self.assertEqual(data["revision"], 2)
+        self.assertEqual(self.stub.requests, 1)
+
+        on_route = self.update(route_id, position=[-93.13, 36.42]).json()
+        self.assertFalse(on_route["rerouted"])
+        self.assertGreater(on_route["miles_from_start"], 200)
+        self.assertEqual(self.stub.requests, 1)
+
+        detour = self.update(route_id, position=[-92.0, 36.0], fuel_gallons=60).json()
+        self.assertTrue(detour["rerouted"])
+        self.assertEqual(detour["miles_from_start"], 0)
+        self.assertEqual(self.stub.requests, 2)
+
+        self.assertEqual(self.client.delete(f'/routes/sessions/{route_id}/').status_code, 200)
+        self.assertEqual(self.update(route_id, miles_from_start=10).status_code, 404)
+
+
+    def test_failed_update_leaves_the_session_unchanged(self):
+        created = self.client.post('/routes/sessions/', json.dumps(self.lane), content_type='application/json').json()
+        route_id = created["route_id"]
+        before = self.client.get(f'/routes/sessions/{route_id}/').json()
+
+        # Out of fuel 200 miles in, nowhere near a station
+        response = self.update(route_id, miles_from_start=200, fuel_gallons=0)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.client.get(f'/routes/sessions/{route_id}/').json(), before)
+
+        # A detour whose new route can't be fetched
+        self.stub.status = 503
+        response = self.update(route_id, position=[-92.0, 36.0])
+        self.assertEqual(response.json()["ors_status"], 503)
+        self.assertEqual(self.client.get(f'/routes/sessions/{route_id}/').json(), before)
+
+        self.stub.status = 200
+        self.assertEqual(self.update(route_id, miles_from_start=200, fuel_gallons=60).json()["revision"], 2)
+
+
+class UpstreamErrorTests(StubORSTestCase):
+    stub_options = {'status': 503}
+
+    def test_upstream_error_is_reported(self):
+        response = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()["ors_status"], 503)
+
+
+class PooledClientTests(StubORSTestCase):
+
+    def test_sync_session_is_shared_across_threads(self):
+        from routes.clients import get_sync_session
+
+        with ThreadPoolExecutor(4) as pool:
+            sessions = set(pool.map(lambda _: id(get_sync_session()), range(8)))
+        self.assertEqual(sessions, {id(get_sync_session())})
+
+    def test_async_client_is_per_loop_and_keeps_connections_alive(self):
+        from routes.clients import get_async_client
+
+        async def sequential():
+            for _ in range(3):
+                await request_route_async(DALLAS, FORT_WORTH)
+            return get_async_client()
+
+        first = asyncio.run(sequential())
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.stub.connections, 1)
+        # A new event loop gets its own client
+        self.assertIsNot(asyncio.run(sequential()), first)
+
+
+class AsyncClientLimitTests(StubORSTestCase):
+    stub_options = {'delay': 0.05}
+
+    @override_settings(ORS_HTTP={'MAX_CONCURRENCY': 3, 'PER_HOST_LIMIT': 2})
+    def test_async_client_bounds_concurrency(self):
+        async def burst():
+            await asyncio.gather(*(request_route_async(DALLAS, FORT_WORTH) for _ in range(8)))
+
+        asyncio.run(burst())
+        self.assertEqual(self.stub.requests, 8)
+        self.assertLessEqual(self.stub.max_in_flight, 2)
+
+
+class BatchRouteTests(StubORSTestCase):
+
+    def test_batch_deduplicates_lanes_and_streams_ndjson(self):
+        body = {
+            "vehicle": {"mpg": 8},
+            "lanes": [
+                {"id": "a", "start": DALLAS, "end": FORT_WORTH},
+                {"id": "b", "start": DALLAS, "end": FORT_WORTH, "mpg": 6},
+                {"id": "c", "start": FORT_WORTH, "end": DALLAS},
+                {"id": "d", "start": "nowhere", "end": DALLAS},
+            ],
+        }
+        response = self.client.post('/routes/calculate-route-batch/', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        results = {line["id"]: line for line in lines if "id" in line}
+        summary = lines[-1]["summary"]
+
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(summary["unique_routes"], 2)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(results["d"]["status"], "error")
+        self.assertEqual(results["a"]["debug_info"]["mpg"], 8)
+        self.assertEqual(results["b"]["debug_info"]["mpg"], 6)
+
+    def test_batch_deduplicates_at_the_route_cache_precision(self):
+        nearby = [DALLAS[0] + 0.002, DALLAS[1] + 0.002]
+        body = {"lanes": [{"id": "a", "start": DALLAS, "end": FORT_WORTH}, {"id": "b", "start": nearby, "end": FORT_WORTH}]}
+        with override_settings(ROUTE_CACHE={'DISABLED': True, 'PRECISION': 2}):
+            response = self.client.post('/routes/calculate-route-batch/', json.dumps(body), content_type='application/json')
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(lines[-1]["summary"]["unique_routes"], 1)
+
+    def test_failing_lanes_do_not_end_the_stream(self):
+        from unittest import mock
+        from routes import views
+
+        real_result = views.route_result
+
+        def route_result(route, params, **kwargs):
+            if params["mpg"] == 7:
+                raise RuntimeError("boom")
+            return real_result(route, params, **kwargs)
+
+        body = {
+            "lanes": [
+                {"id": "ok", "start": DALLAS, "end": FORT_WORTH},
+                {"id": "crash", "start": DALLAS, "end": FORT_WORTH, "mpg": 7},
+                {"id": "short", "start": FORT_WORTH, "end": DALLAS, "range_miles": 1, "start_fuel_gallons": 0},
+            ],
+        }
+        with mock.patch.object(views, "route_result", route_result):
+            response = self.client.post('/routes/calculate-route-batch/', json.dumps(body), content_type='application/json')
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        results = {line["id"]: line for line in lines if "id" in line}
+
+        self.assertEqual(results["ok"]["status"], "success")
+        self.assertIn("boom", results["crash"]["message"])
+        self.assertIn("gap_start_miles", results["short"])
+        self.assertEqual(lines[-1]["summary"]["errors"], 2)
+
+
+class WaypointAndMatrixTests(StubORSTestCase):
+    def test_waypoint_route_joins_legs(self):
+        body = {"start": DALLAS, "waypoints": [[-97.0, 32.9]], "end": FORT_WORTH}
+        data = self.client.post('/routes/calculate-route/', json.dumps(body), content_type='application/json').json()
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(len(data["legs"]), 2)
+        self.assertEqual(data["legs"][1]["from"], [-97.0, 32.9])
+        self.assertAlmostEqual(sum(leg["distance_miles"] for leg in data["legs"]), data["route_distance_miles"], delta=0.05)
+        self.assertEqual(data["debug_info"]["geometry_points"], 199)
+
+    def test_cost_matrix(self):
+        body = {"origins": [DALLAS, FORT_WORTH, DALLAS], "destinations": [FORT_WORTH, [-97.0, 32.9]], "vehicle": {"mpg": 8}}
+        data = self.client.post('/routes/cost-matrix/', json.dumps(body), content_type='application/json').json()
+        self.assertEqual(len(data["fuel_cost"]), 3)
+        self.assertEqual(data["fuel_cost"][0], data["fuel_cost"][2])
+        self.assertEqual(data["debug_info"]["unique_origins"], 2)
+        self.assertEqual(self.stub.requests, 4)
+        self.assertEqual(data["errors"], [])
+        self.assertTrue(all(cost is not None for row in data["fuel_cost"] for cost in row))
+
+
+@override_settings(ROUTING_BACKEND='local', ROUTE_CACHE={'DISABLED': True}, ORS_BASE_URL='http://127.0.0.1:9')
+class LocalGraphBackendTests(SimpleTestCase):
+    """
+    Routing over the bundled road graph, no network involved
+    """
+
+    def test_route_between_cities(self):
+        from routes.backends import get_routing_backend
+        route = get_routing_backend().route(DALLAS, [-95.37, 29.76], 'driving-car')
+        self.assertEqual(route['format'], 'local')
+        self.assertEqual(route['geometry'][0], DALLAS)
+        self.assertGreater(route['distance_meters'] / 1609.344, 225)
+        self.assertGreater(route['duration_seconds'], 3600)
+
+    def test_calculate_route_uses_local_graph(self):
+        response = self.client.post(
+            '/routes/calculate-route/', json.dumps({"start": DALLAS, "end": [-87.63, 41.88]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["debug_info"]["format_detected"], "local")
+        self.assertGreater(data["route_distance_miles"], 800)
+
+    def test_route_from_matches_single_routes(self):
+        from routes.backends import get_routing_backend
+        backend = get_routing_backend()
+        ends = [[-95.37, 29.76], [-87.63, 41.88], [-40.0, 30.0]]
+        routes = backend.route_from(DALLAS, ends, 'driving-car')
+        for end, route in zip(ends[:2], routes):
+            single = backend.route(DALLAS, end, 'driving-car')
+            self.assertAlmostEqual(route['duration_seconds'], single['duration_seconds'], places=0)
+            self.assertAlmostEqual(route['distance_meters'], single['distance_meters'], delta=1)
+        self.assertIn("No road within", routes[2].message)
+
+    def test_point_off_the_network(self):
+        response = self.client.post(
+            '/routes/calculate-route/', json.dumps({"start": DALLAS, "end": [-40.0, 30.0]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("No road within", response.json()["message"])
+
+
+class RoadGraphTests(SimpleTestCase):
+
+    def test_nearest_node_matches_a_scan(self):
+        from fuel.spatial import project_many
+        from routes.graph import RoadGraph
+
+        graph = RoadGraph.load(os.path.join(settings.BASE_DIR, 'data', 'road_graph'))
+        xs, ys = project_many(np.asarray(graph.node_lat), np.asarray(graph.node_lon))
+        rng = np.random.default_rng(2)
+        points = np.column_stack([rng.uniform(-125, -65, 200), rng.uniform(24, 50, 200)]).tolist()
+        # Far off the network, where the ring search gives way to a scan
+        points += [[-40.0, 30.0], [0.0, 0.0]]
+        for lng, lat in points:
+            x, y = project_many(lat, lng)
+            d2 = (xs - x) ** 2 + (ys - y) ** 2
+            node, _ = graph.nearest_node(lng, lat)
+            self.assertAlmostEqual(d2[node], d2.min(), places=6)
+
+    def test_path_meters_use_the_fastest_parallel_edge(self):
+        from routes.graph import RoadGraph
+
+        # 0 -> 1 twice (the slower edge is shorter), 1 -> 2, and a slow direct 0 -> 2
+        graph = RoadGraph.from_edges(
+            [30.0, 30.1, 30.2], [-97.0, -97.0, -97.0],
+            sources=[0, 0, 1, 0], targets=[1, 1, 2, 2],
+            distance=[1200.0, 1000.0, 1500.0, 2000.0], duration=[60.0, 90.0, 70.0, 500.0],
+        )
+        nodes, meters, seconds = graph.shortest_path(0, 2)
+        self.assertEqual(nodes, [0, 1, 2])
+        self.assertEqual((meters, seconds), (2700.0, 130.0))
+        self.assertEqual(graph.shortest_path_tree(0, [2])[2], (nodes, meters, seconds))
+        self.assertEqual(graph._path_meters([1]), 0.0)
+        self.assertIsNone(graph.shortest_path(2, 0))
+
+
+class RouteCacheTests(StubORSTestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'routes.sqlite3')
+        self.now = 1000.0
+        clock = mock.patch('routes.cache.time')
+        clock.start().time.side_effect = lambda: self.now
+        self.addCleanup(clock.stop)
+
+    def test_keys_snap_nearby_points_to_the_same_lane(self):
+        key = route_cache_key(DALLAS, FORT_WORTH, 'driving-hgv')
+        self.assertEqual(route_cache_key([-96.8001, 32.7801], FORT_WORTH, 'driving-hgv'), key)
+        self.assertNotEqual(key, route_cache_key(FORT_WORTH, DALLAS, 'driving-hgv'))
+        self.assertNotEqual(key, route_cache_key(DALLAS, FORT_WORTH, 'driving-car'))
+
+    def test_entries_expire_into_the_stale_window(self):
+        cache = RouteCache(self.path, ttl_seconds=100, max_entries=10, precision=3, stale_seconds=50)
+        cache.set('lane', {'distance': 1})
+        self.now += 100
+        self.assertEqual(cache.get('lane'), {'distance': 1})
+        self.now += 1
+        # Expired: a miss for normal reads, still there for stale ones
+        self.assertIsNone(cache.get('lane'))
+        self.assertEqual(cache.get('lane', allow_stale=True), {'distance': 1})
+        self.now += 50
+        self.assertIsNone(cache.get('lane', allow_stale=True))
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'expired': 1, 'evictions': 0, 'entries': 0})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = RouteCache(self.path, ttl_seconds=100, max_entries=2, precision=3)
+        for key in ('a', 'b'):
+            cache.set(key, key)
+            self.now += 1
+        cache.get('a')
+        self.now += 1
+        cache.set('c', 'c')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('a', 'c'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_size_is_checked_periodically_and_evicted_in_bulk(self):
+        cache = RouteCache(self.path, ttl_seconds=100, max_entries=200, precision=3)
+        with mock.patch.object(cache, '_evict', wraps=cache._evict) as evict:
+            for i in range(300):
+                cache.set(f'lane-{i}', i)
+                self.now += 1
+        # One COUNT every max_entries // 100 writes, not one per write
+        self.assertEqual(evict.call_count, 150)
+        stats = cache.stats()
+        self.assertTrue(180 <= stats['entries'] <= 200, stats)
+        self.assertIsNone(cache.get('lane-0'))
+        self.assertEqual(cache.get('lane-299'), 299)
+
+    def test_calculate_route_is_served_from_the_cache(self):
+        with override_settings(ROUTE_CACHE={'PATH': self.path}):
+            first = fetch_route(DALLAS, FORT_WORTH)
+            again = fetch_route([-96.8002, 32.7798], FORT_WORTH)
+        self.assertFalse(first['cached'])
+        self.assertTrue(again['cached'])
+        self.assertEqual(again['distance_meters'], first['distance_meters'])
+        self.assertEqual(self.stub.requests, 1)
+
+
+class CoalescingTests(StubORSTestCase):
+    stub_options = {'delay': 0.2}
+
+    def test_identical_requests_share_one_upstream_call(self):
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            routes = list(pool.map(lambda _: fetch_route(DALLAS, FORT_WORTH), range(6)))
+        self.assertEqual(self.stub.requests, 1)
+        self.assertTrue(all(route["distance_meters"] == routes[0]["distance_meters"] for route in routes))
+
+
+class CircuitBreakerTests(StubORSTestCase):
+    stub_options = {'status': 503}
+    resilience = {'FAILURE_THRESHOLD': 2, 'RESET_SECONDS': 60}
+
+    def test_open_circuit_fails_fast(self):
+        for _ in range(2):
+            response = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+            self.assertEqual(response.json()["ors_status"], 503)
+        response = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("circuit open", response.json()["message"])
+        self.assertEqual(self.stub.requests, 2)
+
+        status = self.client.get('/routes/upstream-status/').json()
+        self.assertEqual(status["ors"]["circuit"]["state"], "open")
+        self.assertEqual(status["ors"]["circuit"]["short_circuited"], 1)
+
+    def test_trial_refused_by_quota_is_handed_back(self):
+        from routes.services import request_route
+
+        with override_settings(ORS_RESILIENCE={'FAILURE_THRESHOLD': 1, 'RESET_SECONDS': 0.05, 'RATE_PER_SECOND': 1000}):
+            with self.assertRaises(RoutingError):
+                request_route(DALLAS, FORT_WORTH)
+            time.sleep(0.1)
+            bucket = get_ors_guard().bucket
+            bucket.acquire = lambda max_wait=0.0: False
+            with self.assertRaises(RoutingError) as ctx:
+                request_route(DALLAS, FORT_WORTH)
+            self.assertEqual(ctx.exception.status, 429)
+            del bucket.acquire
+
+            self.stub.status = 200
+            self.assertEqual(request_route(DALLAS, FORT_WORTH)["format"], "geojson")
+            self.assertEqual(get_ors_guard().breaker.state, "closed")
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_stale_route_served_while_upstream_fails(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(ROUTE_CACHE={
+            'PATH': os.path.join(tmp, 'routes.sqlite3'), 'TTL_SECONDS': 1, 'STALE_SECONDS': 3600,
+        }):
+            self.stub.status = 200
+            fetch_route(DALLAS, FORT_WORTH)
+            self.stub.status = 503
+            time.sleep(1.1)
+            route = fetch_route(DALLAS, FORT_WORTH)
+        self.assertTrue(route["stale"])
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(get_ors_guard().stats()["stale_served"], 1)
+
+    def test_stale_count_is_exact_under_concurrency(self):
+        guard = get_ors_guard()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: [guard.record_stale() for _ in range(2000)], range(8)))
+        self.assertEqual(guard.stats()["stale_served"], 16000)
+
+
+class QuotaTests(StubORSTestCase):
+
+    def test_requests_beyond_quota_are_refused(self):
+        with override_settings(ORS_RESILIENCE={'RATE_PER_SECOND': 0.01, 'BURST': 1, 'MAX_WAIT_SECONDS': 0}):
+            self.assertFalse(fetch_route(DALLAS, FORT_WORTH)["cached"])
+            with self.assertRaises(RoutingError) as ctx:
+                fetch_route(DALLAS, [-97.0, 33.0])
+        self.assertEqual(ctx.exception.status, 429)
+        self.assertEqual(self.stub.requests, 1)
+
+
+class MetricsTests(StubORSTestCase):
+
+    def test_stage_latency_and_counters_are_exposed(self):
+        self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+        text = self.client.get('/metrics').content.decode()
+        for stage in ("parse", "upstream", "geometry", "corridor", "plan", "serialize"):
+            self.assertIn(f'fuelroute_stage_seconds_count{{stage="{stage}"}}', text)
+        self.assertIn('fuelroute_http_request_seconds_bucket{view="calculate-route",method="POST",status="200",le="+Inf"}', text)
+        self.assertIn('fuelroute_stations ', text)
+
+        summary = self.client.get('/metrics', {'format': 'json'}).json()
+        self.assertGreater(summary["fuelroute_stage_seconds"]["upstream"]["p50"], 0)
+
+
+class PlanningExecutorTests(StubORSTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_planner()
+        self.addCleanup(reset_planner)
+
+    def test_process_workers_match_inline_planning(self):
+        from fuel.planner import RouteNotCoverable
+        from routes.backends import make_backend
+        from routes.geometry import RouteGeometry
+        from routes.planning import InlinePlanner, ProcessPlanner
+
+        route = make_backend('local').route(DALLAS, [-87.63, 41.88], 'driving-car')
+        geometry = RouteGeometry(route['geometry'])
+        miles = route['distance_meters'] / 1609.344
+        options = {"tank_gallons": 100, "mpg": 6.5, "start_fuel": None}
+        planner = ProcessPlanner(2, None, 60, 'spawn', shared_memory_min_points=50)
+        self.addCleanup(planner.shutdown)
+        planner.warm()
+        self.assertGreater(len(geometry), 50)  # goes through shared memory
+
+        plan, stops = planner.plan(geometry, miles, options)
+        expected_plan, expected_stops = InlinePlanner().plan(geometry, miles, options)
+        self.assertEqual(stops, expected_stops)
+        self.assertAlmostEqual(plan.total_cost, expected_plan.total_cost)
+        with self.assertRaises(RouteNotCoverable):
+            planner.plan(geometry, miles, {**options, "tank_gallons": 5})
+        self.assertEqual(planner.stats()["in_flight"], 0)
+
+    def test_dead_worker_is_replaced(self):
+        import signal
+        from routes.geometry import RouteGeometry
+        from routes.planning import ProcessPlanner, _worker_ready
+
+        planner = ProcessPlanner(1, None, 60, 'spawn', shared_memory_min_points=2000)
+        self.addCleanup(planner.shutdown)
+        os.kill(planner.pool.submit(_worker_ready).result(), signal.SIGKILL)
+
+        geometry = RouteGeometry([DALLAS, FORT_WORTH])
+        plan, stops = planner.plan(geometry, 35.0, {"tank_gallons": 50, "mpg": 10, "start_fuel": None})
+        self.assertEqual(stops, [])
+        self.assertEqual(planner.stats()["restarts"], 1)
+        self.assertEqual(planner.plan(geometry, 35.0, {"tank_gallons": 50, "mpg": 10, "start_fuel": None})[1], [])
+
+    @override_settings(PLANNING_EXECUTOR={'MODE': 'thread', 'WORKERS': 1, 'MAX_PENDING': 1, 'QUEUE_TIMEOUT_SECONDS': 0.01})
+    def test_full_queue_answers_503(self):
+        from routes.planning import get_planner
+
+        planner = get_planner()
+        self.assertTrue(planner._slots.acquire(timeout=1))  # the one slot is taken
+        response = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["retry_after"], 0.0)
+        planner._slots.release()
+
+        response = self.client.post('/routes/calculate-route/', self.route_body(), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(planner.stats()["rejected"], 1)
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+
+    def test_only_changes_beyond_tolerance_regress(self):
+        baseline = {"a": {"p50_ms": 10.0, "rps": 100.0}, "gone": {"p50_ms": 1.0}}
+        results = {"a": {"p50_ms": 12.0, "rps": 60.0}, "new": {"p50_ms": 99.0}}
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual([(name, metric) for name, metric, *_ in regressions], [("a", "rps")])
+
+
+class LoggingTests(StubORSTestCase):
+
+    def record(self, level=logging.INFO, **extra):
+        record = logging.LogRecord("routes.views", level, __file__, 1, "planned %d stops", (3,), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_request_id_is_echoed_or_replaced(self):
+        response = self.client.get('/routes/upstream-status/', headers={'X-Request-ID': 'lane-42.a'})
+        self.assertEqual(response['X-Request-ID'], 'lane-42.a')
+        response = self.client.get('/routes/upstream-status/', headers={'X-Request-ID': 'bad id\n'})
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_sampling_is_decided_per_request(self):
+        from django.test import RequestFactory
+        from config.log import SamplingFilter, _begin, sampled_var
+
+        def begin():
+            _begin(RequestFactory().get('/'))
+            return sampled_var.get()
+
+        for rate, sampled in ((0.0, False), (1.0, True)):
+            with override_settings(LOG_SAMPLE_RATE=rate):
+                self.assertIs(contextvars.copy_context().run(begin), sampled)
+
+        def passes(level):
+            sampled_var.set(False)
+            return SamplingFilter().filter(self.record(level))
+
+        self.assertFalse(contextvars.copy_context().run(passes, logging.INFO))
+        self.assertTrue(contextvars.copy_context().run(passes, logging.WARNING))
+
+    def test_structured_lines_carry_extra_fields(self):
+        from config.log import RequestIdFilter, StructuredFormatter, request_id_var
+
+        def format_record():
+            request_id_var.set("abc")
+            record = self.record(route_miles=35.7)
+            RequestIdFilter().filter(record)
+            return json.loads(StructuredFormatter().format(record))
+
+        entry = contextvars.copy_context().run(format_record)
+        self.assertEqual(entry["message"], "planned 3 stops")
+        self.assertEqual((entry["request_id"], entry["route_miles"], entry["level"]), ("abc", 35.7, "INFO"))
+
+    def test_queued_handler_drops_instead_of_blocking(self):
+        from config.log import QueuedStreamHandler
+
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream, maxsize=1)
+        handler.emit(self.record())
+        handler.close()
+        self.assertEqual(stream.getvalue(), "planned 3 stops\n")
+
+        # While the writer is stuck, at most one record is being written and one queued
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream, maxsize=1)
+        with handler.target.lock:
+            for _ in range(5):
+                handler.emit(self.record())
+        self.assertGreaterEqual(handler.dropped, 3)
+        handler.close()
+        handler.close()
+        self.assertEqual(stream.getvalue().count("\n"), 5 - handler.dropped)
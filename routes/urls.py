@@ -1,8 +1,16 @@
-print("[+] routes.urls.py loaded")
-
 from django.urls import path
-from .views import calculate_route  # ✅ Add this to import your route view
+from .views import (
+    calculate_cost_matrix, calculate_route, calculate_route_async, calculate_route_batch, cheapest_stations,
+    create_route_session, route_geometry, route_session, upstream_status,
+)
 urlpatterns = [
-    path('calculate-route/', calculate_route),
     path("calculate-route/", calculate_route, name="calculate-route"),
-]  
\ No newline at end of file
+    path("calculate-route-async/", calculate_route_async, name="calculate-route-async"),
+    path("calculate-route-batch/", calculate_route_batch, name="calculate-route-batch"),
+    path("cost-matrix/", calculate_cost_matrix, name="cost-matrix"),
+    path("route-geometry/", route_geometry, name="route-geometry"),
+    path("cheapest-stations/", cheapest_stations, name="cheapest-stations"),
+    path("sessions/", create_route_session, name="route-sessions"),
+    path("sessions/<str:route_id>/", route_session, name="route-session"),
+    path("upstream-status/", upstream_status, name="upstream-status"),
+]
@@ -1,244 +1,833 @@
-import json
-import os
-import requests
-from django.http import JsonResponse
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from fuel.utils import best_fuel_stops
+from config import codec
+from config.codec import JSONBytesResponse
+from config.metrics import span
+from fuel.planner import DEFAULT_MPG, DEFAULT_RANGE_MILES, RouteNotCoverable
+from fuel.stations import get_station_table
+from fuel.utils import CORRIDOR_RADIUS_MILES, cheapest_on_route
+from routes.backends import get_routing_backend
+from routes.cache import get_route_cache, lane_key
+from routes.geometry import MAX_ZOOM, RouteGeometry, tolerance_for_zoom
+from routes.planning import PlanningOverloaded, get_planner
+from routes.resilience import get_ors_guard
+from routes.sessions import RouteSession, get_session_store, update_session
+from routes.services import (
+    DEFAULT_PROFILE, RoutingError, fetch_route, fetch_route_via, fetch_route_via_async, fetch_routes_from,
+)
+
+logger = logging.getLogger(__name__)
+
+GEOMETRY_ENCODINGS = ("coords", "polyline", "binary")
+# Little-endian float32 [lng, lat] pairs, 8 bytes per vertex
+BINARY_GEOMETRY_TYPE = "application/vnd.fuelroute.lnglat+float32"
+
+
+def error_response(message, status, **extra):
+    return JSONBytesResponse({"status": "error", "message": message, **extra}, status=status)
+
+
+def parse_route_params(data, defaults=None):
+    """
+    Validate one lane (start/end plus vehicle options, falling back to
+    `defaults`). Returns (params, None) or (None, error message).
+    """
+    defaults = defaults or {}
+    start = data.get("start")
+    end = data.get("end")
+
+    if not start or not end:
+        return None, "Start and end coordinates are required"
+
+    try:
+        start = [float(start[0]), float(start[1])]
+        end = [float(end[0]), float(end[1])]
+    except (TypeError, ValueError, IndexError, KeyError):
+        return None, "Start and end must be [longitude, latitude] pairs"
+
+    waypoints = data.get("waypoints") or []
+    max_waypoints = getattr(settings, "ROUTE_MAX_WAYPOINTS", 25)
+    if not isinstance(waypoints, list):
+        return None, "waypoints must be a list of [longitude, latitude] pairs"
+    if len(waypoints) > max_waypoints:
+        return None, f"At most {max_waypoints} waypoints per route"
+    try:
+        waypoints = [[float(point[0]), float(point[1])] for point in waypoints]
+    except (TypeError, ValueError, IndexError, KeyError):
+        return None, "waypoints must be a list of [longitude, latitude] pairs"
+
+    def option(name, fallback=None):
+        return data.get(name, defaults.get(name, fallback))
+
+    try:
+        mpg = float(option("mpg", DEFAULT_MPG))
+        range_miles = float(option("range_miles", DEFAULT_RANGE_MILES))
+        tank_gallons = float(option("tank_gallons", range_miles / mpg))
+        start_fuel = option("start_fuel_gallons")
+        start_fuel = None if start_fuel is None else float(start_fuel)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None, "mpg, range_miles, tank_gallons and start_fuel_gallons must be numbers"
+    if mpg <= 0 or tank_gallons <= 0:
+        return None, "mpg and tank_gallons must be positive"
+
+    map_options = option("map") or {}
+    if not isinstance(map_options, dict):
+        return None, "map must be an object"
+    map_options, message = parse_geometry_options(map_options, encodings=("coords", "polyline"))
+    if message:
+        return None, message
+
+    return {
+        "start": start,
+        "end": end,
+        "waypoints": waypoints,
+        "mpg": mpg,
+        "tank_gallons": tank_gallons,
+        "start_fuel": start_fuel,
+        "map": map_options,
+    }, None
+
+
+def parse_geometry_options(data, encodings=GEOMETRY_ENCODINGS, default_encoding="coords"):
+    """
+    Validate geometry output options: encoding, zoom, tolerance_miles and
+    precision (polyline digits). Returns (options, None) or (None, error message).
+    """
+    encoding = data.get("encoding") or default_encoding
+    if encoding not in encodings:
+        return None, f"encoding must be one of {', '.join(encodings)}"
+    try:
+        zoom = data.get("zoom")
+        zoom = None if zoom is None else float(zoom)
+        tolerance = data.get("tolerance_miles")
+        tolerance = None if tolerance is None else float(tolerance)
+        precision = int(data.get("precision", 5))
+    except (TypeError, ValueError):
+        return None, "zoom, tolerance_miles and precision must be numbers"
+    if zoom is not None and not 0 <= zoom <= MAX_ZOOM:
+        return None, f"zoom must be between 0 and {MAX_ZOOM}"
+    if tolerance is not None and tolerance < 0:
+        return None, "tolerance_miles must not be negative"
+    if precision not in (5, 6):
+        return None, "precision must be 5 or 6"
+    return {"encoding": encoding, "zoom": zoom, "tolerance_miles": tolerance, "precision": precision}, None
+
+
+def output_geometry(route_geometry, options, default_tolerance):
+    """
+    Level of detail for a client: explicit tolerance_miles first, else one
+    pixel at `zoom`, else `default_tolerance`. Returns (geometry, tolerance).
+    """
+    tolerance = options["tolerance_miles"]
+    if tolerance is None and options["zoom"] is not None and len(route_geometry):
+        tolerance = tolerance_for_zoom(options["zoom"], float(route_geometry.lats.mean()))
+    if tolerance is None:
+        tolerance = default_tolerance
+    if not tolerance:
+        return route_geometry, 0.0
+    with span("simplify"):
+        return route_geometry.simplify(tolerance), tolerance
+
+
+def encode_geometry(geometry, options):
+    if options["encoding"] == "polyline":
+        return geometry.encode_polyline(options["precision"])
+    return geometry.tolist(decimals=options["precision"])
+
+
+def load_json_body(body):
+    """
+    Decode a JSON object body. Returns (data, None) or (None, error response).
+    """
+    try:
+        data = codec.loads(body)
+    except (UnicodeDecodeError, codec.JSONDecodeError) as e:
+        return None, error_response(f"Invalid JSON: {str(e)}", 400)
+    if not isinstance(data, dict):
+        return None, error_response("Request body must be a JSON object", 400)
+    return data, None
+
+
+def parse_route_request(body):
+    """
+    Validate a calculate-route body. Returns (params, None) or (None, error response).
+    """
+    # 1. Parse request
+    data, error = load_json_body(body)
+    if error:
+        return None, error
+
+    params, message = parse_route_params(data)
+    if message:
+        return None, error_response(message, 400)
+
+    logger.debug("Route request start=%s end=%s", params["start"], params["end"])
+    return params, None
+
+
+def routing_error_response(e):
+    logger.warning("Routing failed: %s", e.message, extra={"status": e.status})
+    return error_response(e.message, e.status, **e.extra)
+
+
+def route_result(route, params, table=None, sessions=None):
+    """
+    Plan fuel stops on a fetched route. Returns (payload, http status).
+    With a RouteSessionStore the planned route is kept there for
+    re-planning and the payload carries its route_id.
+    """
+    with span("geometry"):
+        route_geometry = RouteGeometry(route["geometry"])
+        geometry_miles = route_geometry.length_miles
+    # Fall back to the polyline length when ORS leaves the summary out
+    distance_meters = route["distance_meters"] or geometry_miles / 0.000621371
+    mpg = params["mpg"]
+    tank_gallons = params["tank_gallons"]
+
+    # 3. Distance & fuel math
+    distance_miles = round(distance_meters * 0.000621371, 2)
+    gallons_needed = round(distance_miles / mpg, 2)
+
+    # 4. Fuel stops: cheapest refuelling plan along the route
+    session = None
+    try:
+        if sessions is not None:
+            session = RouteSession(route_geometry, distance_miles, params, table=table, legs=route.get("legs"))
+            plan, recommended_stops = session.replan()
+        else:
+            plan, recommended_stops = get_planner().plan(
+                route_geometry,
+                distance_miles,
+                {"tank_gallons": tank_gallons, "mpg": mpg, "start_fuel": params["start_fuel"]},
+                legs=route.get("legs"),
+                table=table,
+            )
+    except RouteNotCoverable as e:
+        return not_coverable_payload(e), 422
+    except PlanningOverloaded as e:
+        logger.warning("Route planning rejected: %s", e)
+        return {"status": "error", "message": str(e), "retry_after": e.retry_after}, 503
+
+    map_route, map_tolerance = output_geometry(
+        route_geometry, params["map"], getattr(settings, "ROUTE_MAP_TOLERANCE_MILES", 0.5)
+    )
+
+    # Everything the trip burns, including what it draws from the starting tank
+    total_fuel_cost = round(plan.trip_cost, 2)
+    avg_price = round(plan.total_cost / plan.total_gallons, 3) if plan.total_gallons else 0
+
+    logger.info(
+        "Route planned: %.1f miles, %d stops, $%.2f",
+        distance_miles, len(recommended_stops), total_fuel_cost,
+        extra={"geometry_points": len(route_geometry), "route_cached": route["cached"]},
+    )
+
+    # 5. Final response
+    payload = {
+        "status": "success",
+        "route_distance_miles": distance_miles,
+        "total_fuel_cost": total_fuel_cost,
+        "fuel_purchase_cost": round(plan.total_cost, 2),
+        "map_route": encode_geometry(map_route, params["map"]),
+        "recommended_stops": recommended_stops,
+        "debug_info": {
+            "geometry_points": len(route_geometry),
+            "map_route_points": len(map_route),
+            "map_encoding": params["map"]["encoding"],
+            "map_tolerance_miles": round(map_tolerance, 4),
+            "geometry_miles": round(geometry_miles, 2),
+            "avg_fuel_price": avg_price,
+            "gallons_needed": gallons_needed,
+            "gallons_purchased": round(plan.total_gallons, 2),
+            "start_fuel_gallons": round(plan.start_fuel, 2),
+            "end_fuel_gallons": round(plan.end_fuel, 2),
+            "tank_fuel_price": round(plan.tank_price, 3),
+            "mpg": mpg,
+            "tank_gallons": tank_gallons,
+            "distance_meters": distance_meters,
+            "format_detected": route["format"],
+            "route_cached": route["cached"],
+            "route_stale": route.get("stale", False),
+        }
+    }
+    if route.get("legs"):
+        payload["legs"] = route_legs(route, params)
+    if session is not None:
+        sessions.add(session)
+        payload["route_id"] = session.id
+    return payload, 200
+
+
+def route_points(params):
+    return [params["start"], *params["waypoints"], params["end"]]
+
+
+def route_legs(route, params):
+    """
+    Per-leg summary of a waypoint route
+    """
+    points = route_points(params)
+    return [
+        {
+            "from": points[k],
+            "to": points[k + 1],
+            "distance_miles": round(leg["distance_meters"] * 0.000621371, 2),
+            "duration_minutes": round(leg["duration_seconds"] / 60, 1),
+            "cached": leg["cached"],
+        }
+        for k, leg in enumerate(route["legs"])
+    ]
+
+
+def not_coverable_payload(e):
+    return {
+        "status": "error",
+        "message": str(e),
+        "gap_start_miles": round(e.gap_start_miles, 1),
+        "gap_end_miles": round(e.gap_end_miles, 1),
+    }
+
+
+def route_response(route, params, sessions=None):
+    """
+    Plan fuel stops on a fetched route and build the calculate-route response
+    """
+    payload, status = route_result(route, params, sessions=sessions)
+    with span("serialize"):
+        return JSONBytesResponse(payload, status=status)
+
+
+def internal_error_response(e):
+    logger.exception("Unhandled exception in route view")
+    return error_response(
+        f"Internal server error: {str(e)}",
+        500,
+        debug="Check server logs for details",
+    )
+
 
 @csrf_exempt
 def calculate_route(request):
     if request.method != "POST":
-        return JsonResponse(
-            {"status": "error", "message": "Only POST requests allowed"},
-            status=405
-        )
-    
-    print("\n" + "="*60)
-    print("🚀 CALCULATE_ROUTE CALLED")
-    
+        return error_response("Only POST requests allowed", 405)
+
     try:
-        # 1. Parse request
+        with span("parse"):
+            params, error = parse_route_request(request.body)
+        if error:
+            return error
+
+        # 2. Route: route cache first (leg by leg with waypoints), OpenRouteService on a miss
         try:
-            body = request.body.decode("utf-8")
-            data = json.loads(body)
-            print(f"✅ Request body parsed: {data}")
-        except json.JSONDecodeError as e:
-            return JsonResponse(
-                {"status": "error", "message": f"Invalid JSON: {str(e)}"},
-                status=400
-            )
-        
-        start = data.get("start")
-        end = data.get("end")
-        
-        if not start or not end:
-            return JsonResponse(
-                {"status": "error", "message": "Start and end coordinates are required"},
-                status=400
-            )
-        
-        print(f"📍 Start: {start}, End: {end}")
-        
-        # 2. Get ORS API key
-        ors_api_key = os.getenv("ORS_API_KEY")
-        print(f"🔑 ORS_API_KEY loaded: {'YES' if ors_api_key else 'NO'}")
-        
-        if not ors_api_key:
-            return JsonResponse(
-                {
-                    "status": "error", 
-                    "message": "ORS_API_KEY not found. Check your .env file.",
-                    "debug": "Set ORS_API_KEY=your_key_here in .env file"
-                },
-                status=500
+            route = fetch_route_via(route_points(params))
+        except RoutingError as e:
+            return routing_error_response(e)
+
+        return route_response(route, params)
+
+    except Exception as e:
+        return internal_error_response(e)
+
+
+@csrf_exempt
+async def calculate_route_async(request):
+    """
+    calculate_route for ASGI: the ORS call goes through the pooled async
+    client and planning runs in a worker thread, so the event loop is never
+    blocked on upstream latency.
+    """
+    if request.method != "POST":
+        return error_response("Only POST requests allowed", 405)
+
+    try:
+        with span("parse"):
+            params, error = parse_route_request(request.body)
+        if error:
+            return error
+
+        try:
+            route = await fetch_route_via_async(route_points(params))
+        except RoutingError as e:
+            return routing_error_response(e)
+
+        return await sync_to_async(route_response, thread_sensitive=False)(route, params)
+
+    except Exception as e:
+        return internal_error_response(e)
+
+
+@csrf_exempt
+def create_route_session(request):
+    """
+    calculate_route that also keeps the planned route as a session.
+
+    The response carries a route_id; position and fuel updates posted to
+    /routes/sessions/<route_id>/ re-plan the rest of the route from there.
+    """
+    if request.method != "POST":
+        return error_response("Only POST requests allowed", 405)
+
+    try:
+        with span("parse"):
+            params, error = parse_route_request(request.body)
+        if error:
+            return error
+
+        try:
+            route = fetch_route_via(route_points(params))
+        except RoutingError as e:
+            return routing_error_response(e)
+
+        return route_response(route, params, sessions=get_session_store())
+
+    except Exception as e:
+        return internal_error_response(e)
+
+
+@csrf_exempt
+def route_session(request, route_id):
+    """
+    GET: the session's current position, fuel and remaining plan.
+    POST {"position": [lng, lat]} or {"miles_from_start": ...}, optionally
+    with "fuel_gallons" (estimated from the last plan when left out): move
+    the truck and re-plan the remaining route.
+    DELETE: end the session.
+    """
+    store = get_session_store()
+    if request.method == "DELETE":
+        if not store.remove(route_id):
+            return error_response("Unknown or expired route session", 404)
+        return JSONBytesResponse({"status": "success", "route_id": route_id})
+    if request.method not in ("GET", "POST"):
+        return error_response("Only GET, POST and DELETE requests allowed", 405)
+
+    session = store.get(route_id)
+    if session is None:
+        return error_response("Unknown or expired route session", 404)
+    if request.method == "GET":
+        with session.lock:
+            return JSONBytesResponse({"status": "success", **session.state()})
+
+    try:
+        with span("parse"):
+            data, error = load_json_body(request.body)
+        if error:
+            return error
+        try:
+            state, message = update_session(session, data, fetch_route_via)
+        except RoutingError as e:
+            return routing_error_response(e)
+        except RouteNotCoverable as e:
+            return JSONBytesResponse({**not_coverable_payload(e), "route_id": route_id}, status=422)
+        if message:
+            return error_response(message, 400)
+        return JSONBytesResponse({"status": "success", **state})
+
+    except Exception as e:
+        return internal_error_response(e)
+
+
+def _coords_json_chunks(head, geometry, decimals, chunk_points):
+    # {...head, "geometry": [[lng, lat], ...]} with the coordinates written chunk by chunk
+    yield codec.dumps(head)[:-1] + b',"geometry":['
+    for offset in range(0, len(geometry), chunk_points):
+        part = codec.dumps(np.round(geometry.coords[offset:offset + chunk_points], decimals))
+        yield (b"," if offset else b"") + part[1:-1]
+    yield b"]}"
+
+
+def _binary_chunks(geometry, chunk_points):
+    for offset in range(0, len(geometry), chunk_points):
+        yield geometry.coords[offset:offset + chunk_points].astype("<f4").tobytes()
+
+
+def geometry_response(route, options):
+    """
+    The route polyline alone at the requested level of detail.
+
+    coords and polyline answer JSON; binary answers BINARY_GEOMETRY_TYPE
+    with the metadata in headers. Geometries over ROUTE_GEOMETRY_CHUNK_POINTS
+    vertices are streamed in chunks of that many instead of being built in memory.
+    """
+    with span("geometry"):
+        route_geometry = RouteGeometry(route["geometry"])
+    geometry, tolerance = output_geometry(route_geometry, options, default_tolerance=0.0)
+    distance_meters = route["distance_meters"] or route_geometry.length_miles / 0.000621371
+    chunk_points = getattr(settings, "ROUTE_GEOMETRY_CHUNK_POINTS", 5000)
+    head = {
+        "status": "success",
+        "encoding": options["encoding"],
+        "points": len(geometry),
+        "source_points": len(route_geometry),
+        "tolerance_miles": round(tolerance, 4),
+        "route_distance_miles": round(distance_meters * 0.000621371, 2),
+        "route_cached": route["cached"],
+    }
+
+    with span("serialize"):
+        if options["encoding"] == "binary":
+            response = StreamingHttpResponse(_binary_chunks(geometry, chunk_points), content_type=BINARY_GEOMETRY_TYPE)
+            response["Content-Length"] = str(len(geometry) * 8)
+            for name in ("points", "source_points", "tolerance_miles", "route_distance_miles"):
+                response["X-Geometry-" + name.replace("_", "-").title()] = str(head[name])
+            return response
+        if options["encoding"] == "polyline":
+            encoded = geometry.encode_polyline(options["precision"])
+            return JSONBytesResponse({**head, "precision": options["precision"], "geometry": encoded})
+        if len(geometry) > chunk_points:
+            return StreamingHttpResponse(
+                _coords_json_chunks(head, geometry, options["precision"], chunk_points),
+                content_type="application/json",
             )
-        
-        # 3. Call OpenRouteService - TRY WITH QUERY PARAM FOR FORMAT
-        url = "https://api.openrouteservice.org/v2/directions/driving-car"
-        headers = {
-            "Authorization": ors_api_key.strip(),
-            "Content-Type": "application/json",
-            "Accept": "application/json"
+        return JSONBytesResponse({**head, "geometry": np.round(geometry.coords, options["precision"])})
+
+
+@csrf_exempt
+def route_geometry(request):
+    """
+    Full route geometry for drawing a lane.
+
+    Body: {"start": [lng, lat], "end": [lng, lat], "encoding": "coords" | "polyline" | "binary",
+           "zoom": 0-22, "tolerance_miles": ..., "precision": 5 | 6}
+    Without zoom or tolerance_miles every vertex is returned. An Accept
+    header of BINARY_GEOMETRY_TYPE selects the binary encoding.
+    """
+    if request.method != "POST":
+        return error_response("Only POST requests allowed", 405)
+
+    try:
+        with span("parse"):
+            data, error = load_json_body(request.body)
+            if error:
+                return error
+            params, message = parse_route_params({"start": data.get("start"), "end": data.get("end")})
+            if message:
+                return error_response(message, 400)
+            default_encoding = "binary" if BINARY_GEOMETRY_TYPE in request.headers.get("Accept", "") else "coords"
+            options, message = parse_geometry_options(data, default_encoding=default_encoding)
+            if message:
+                return error_response(message, 400)
+
+        try:
+            route = fetch_route(params["start"], params["end"])
+        except RoutingError as e:
+            return routing_error_response(e)
+
+        return geometry_response(route, options)
+
+    except Exception as e:
+        return internal_error_response(e)
+
+
+MAX_CHEAPEST_STATIONS = 100
+MAX_CHEAPEST_RADIUS_MILES = 50.0
+
+
+@csrf_exempt
+def cheapest_stations(request):
+    """
+    The cheapest stations near a lane, cheapest first.
+
+    Body: {"start": [lng, lat], "end": [lng, lat], "limit": 10, "radius_miles": 10}
+    Stations carry miles_from_start (road miles) and offset_miles from the route.
+    """
+    if request.method != "POST":
+        return error_response("Only POST requests allowed", 405)
+
+    try:
+        with span("parse"):
+            data, error = load_json_body(request.body)
+            if error:
+                return error
+            params, message = parse_route_params({"start": data.get("start"), "end": data.get("end")})
+            if message:
+                return error_response(message, 400)
+            try:
+                limit = int(data.get("limit", 10))
+                radius_miles = float(data.get("radius_miles", CORRIDOR_RADIUS_MILES))
+            except (TypeError, ValueError):
+                return error_response("limit and radius_miles must be numbers", 400)
+            if not 1 <= limit <= MAX_CHEAPEST_STATIONS:
+                return error_response(f"limit must be between 1 and {MAX_CHEAPEST_STATIONS}", 400)
+            if not 0 < radius_miles <= MAX_CHEAPEST_RADIUS_MILES:
+                return error_response(f"radius_miles must be above 0 and at most {MAX_CHEAPEST_RADIUS_MILES:g}", 400)
+
+        try:
+            route = fetch_route(params["start"], params["end"])
+        except RoutingError as e:
+            return routing_error_response(e)
+
+        with span("geometry"):
+            route_geometry = RouteGeometry(route["geometry"])
+        distance_miles = round(route["distance_meters"] * 0.000621371, 2) if route["distance_meters"] else None
+        stations = cheapest_on_route(route_geometry, limit=limit, radius_miles=radius_miles, route_miles=distance_miles)
+        with span("serialize"):
+            return JSONBytesResponse({
+                "status": "success",
+                "route_distance_miles": distance_miles if distance_miles is not None else round(route_geometry.length_miles, 2),
+                "radius_miles": radius_miles,
+                "stations": stations,
+            })
+
+    except Exception as e:
+        return internal_error_response(e)
+
+
+def batch_lines(lanes, defaults, concurrency):
+    """
+    NDJSON lines for a batch: one per lane as soon as it's planned (or
+    failed), then a summary.
+
+    Identical lanes (same snapped stops) share their upstream calls, unique
+    lanes are fetched on up to `concurrency` threads, and every lane is
+    planned against the same station table.
+    """
+    started = time.perf_counter()
+    table = get_station_table()
+    groups = {}
+    errors = 0
+
+    for index, lane in enumerate(lanes):
+        lane_id = lane.get("id") if isinstance(lane, dict) else None
+        params, message = parse_route_params(lane, defaults) if isinstance(lane, dict) else (None, "Lane must be an object")
+        if message:
+            errors += 1
+            yield _ndjson({"index": index, "id": lane_id, "status": "error", "message": message})
+            continue
+        points = route_points(params)
+        key = tuple(lane_key(a, b, DEFAULT_PROFILE) for a, b in zip(points, points[1:]))
+        groups.setdefault(key, []).append((index, lane_id, params))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(groups) or 1)))
+    try:
+        futures = {
+            # Each worker runs in a copy of this context so its logs keep the request ID
+            executor.submit(contextvars.copy_context().run, fetch_route_via, route_points(members[0][2])): members
+            for members in groups.values()
         }
-        
-        # Payload without format
-        payload = {
-            "coordinates": [start, end]
+        for future in as_completed(futures):
+            members = futures[future]
+            try:
+                route = future.result()
+            except RoutingError as e:
+                for index, lane_id, _ in members:
+                    errors += 1
+                    yield _ndjson({"index": index, "id": lane_id, "status": "error", "message": e.message, **e.extra})
+                continue
+            except Exception as e:
+                logger.exception("Batch route fetch failed")
+                for index, lane_id, _ in members:
+                    errors += 1
+                    yield _ndjson({"index": index, "id": lane_id, "status": "error", "message": f"Internal server error: {e}"})
+                continue
+
+            for index, lane_id, params in members:
+                # One lane failing must not cut the stream short for the others
+                try:
+                    payload, status = route_result(route, params, table=table)
+                except Exception as e:
+                    logger.exception("Batch lane %s failed", index)
+                    payload, status = {"status": "error", "message": f"Internal server error: {e}"}, 500
+                if status != 200:
+                    errors += 1
+                yield _ndjson({"index": index, "id": lane_id, **payload})
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    yield _ndjson({
+        "summary": {
+            "lanes": len(lanes),
+            "unique_routes": len(groups),
+            "errors": errors,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
         }
-        
-        # Try with query parameter for format
-        params = {"format": "geojson"}
-        
-        print(f"📡 Calling ORS: {url}")
-        print(f"📦 Payload: {json.dumps(payload, indent=2)}")
-        print(f"🔧 Params: {params}")
-        
-        try:
-            response = requests.post(
-                url, 
-                headers=headers, 
-                json=payload, 
-                params=params,  # ✅ Add format as query parameter
-                timeout=30
-            )
-            print(f"📊 ORS Response Status: {response.status_code}")
-            
-            if response.status_code != 200:
-                print(f"❌ ORS Error Response: {response.text[:200]}")
-                return JsonResponse(
-                    {
-                        "status": "error",
-                        "message": f"ORS API returned error {response.status_code}",
-                        "ors_status": response.status_code,
-                        "ors_error": response.text[:500] if response.text else "No error message"
-                    },
-                    status=500
+    })
+
+
+def _ndjson(payload):
+    return codec.dumps(payload) + b"\n"
+
+
+@csrf_exempt
+def calculate_route_batch(request):
+    """
+    Cost many lanes in one request.
+
+    Body: {"lanes": [{"start": [lng, lat], "end": [lng, lat], "id": ..., "mpg": ...}, ...],
+           "vehicle": {"mpg": ..., "range_miles": ..., ...}}  (vehicle = per-lane defaults)
+    Streams application/x-ndjson, one result per lane in completion order.
+    """
+    if request.method != "POST":
+        return error_response("Only POST requests allowed", 405)
+
+    data, error = load_json_body(request.body)
+    if error:
+        return error
+
+    lanes = data.get("lanes")
+    defaults = data.get("vehicle") or {}
+    max_lanes = getattr(settings, "ROUTE_BATCH_MAX_LANES", 1000)
+    if not isinstance(lanes, list) or not lanes:
+        return error_response("lanes must be a non-empty list", 400)
+    if len(lanes) > max_lanes:
+        return error_response(f"At most {max_lanes} lanes per batch", 400)
+    if not isinstance(defaults, dict):
+        return error_response("vehicle must be an object", 400)
+
+    concurrency = getattr(settings, "ROUTE_BATCH_CONCURRENCY", 8)
+    return StreamingHttpResponse(
+        batch_lines(lanes, defaults, concurrency),
+        content_type="application/x-ndjson",
+    )
+
+
+def _point_list(value, name):
+    """
+    [[lng, lat], ...] from a request field, or (None, error message)
+    """
+    if not isinstance(value, list) or not value:
+        return None, f"{name} must be a non-empty list of [longitude, latitude] pairs"
+    try:
+        return [[float(point[0]), float(point[1])] for point in value], None
+    except (TypeError, ValueError, IndexError, KeyError):
+        return None, f"{name} must be a non-empty list of [longitude, latitude] pairs"
+
+
+def cost_matrix(origins, destinations, params, concurrency):
+    """
+    Fuel cost, distance and duration from every origin to every destination.
+
+    Each distinct origin is one fetch_routes_from() call: cached lanes come
+    from the route cache and the rest from the backend, which for the local
+    graph is a single shortest-path tree per origin instead of one search
+    per cell. Corridor projections go through the leg cache, and every
+    cell is planned by the configured planner (routes.planning) against
+    the same station table.
+    """
+    table = get_station_table()
+    planner = get_planner()
+    vehicle = {"tank_gallons": params["tank_gallons"], "mpg": params["mpg"], "start_fuel": params["start_fuel"]}
+    rows = {}
+    for i, origin in enumerate(origins):
+        # Origins that snap to the same route cache point share a row
+        rows.setdefault(tuple(round(v, 3) for v in origin), []).append(i)
+
+    def cells(origin):
+        result = []
+        for route in fetch_routes_from(origin, destinations):
+            if isinstance(route, RoutingError):
+                result.append({"error": route.message})
+                continue
+            distance_miles = round(route["distance_meters"] * 0.000621371, 2)
+            cell = {
+                "distance_miles": distance_miles,
+                "duration_minutes": round(route["duration_seconds"] / 60, 1),
+                "cached": route["cached"],
+            }
+            try:
+                plan, _ = planner.plan(
+                    RouteGeometry(route["geometry"]), distance_miles or None, vehicle, table=table,
                 )
-            
-            route_data = response.json()
-            print("✅ ORS Response received and parsed")
-            print(f"📄 Response keys: {list(route_data.keys())}")
-            
-        except requests.exceptions.RequestException as e:
-            print(f"❌ RequestException: {str(e)}")
-            return JsonResponse(
-                {
-                    "status": "error",
-                    "message": f"Network error: {str(e)}",
-                    "debug": "Check internet connection or ORS API availability"
-                },
-                status=500
-            )
-        
-        # 4. Handle BOTH response formats
-        route_geometry = []
-        distance_meters = 0
-        
-        # Format 1: GeoJSON (with "features")
-        if "features" in route_data:
-            print("✅ Detected GeoJSON format (features)")
-            features = route_data.get("features", [])
-            if features:
-                feature = features[0]
-                geometry = feature.get("geometry", {})
-                
-                if isinstance(geometry, dict) and "coordinates" in geometry:
-                    route_geometry = geometry["coordinates"]
-                
-                properties = feature.get("properties", {})
-                if "summary" in properties:
-                    summary = properties["summary"]
-                    distance_meters = summary.get("distance", 0)
-                elif "segments" in properties and properties["segments"]:
-                    segments = properties["segments"]
-                    distance_meters = sum(seg.get("distance", 0) for seg in segments)
-        
-        # Format 2: Default format (with "routes")
-        elif "routes" in route_data:
-            print("✅ Detected default format (routes)")
-            routes = route_data.get("routes", [])
-            if routes:
-                route = routes[0]
-                geometry = route.get("geometry", {})
-                
-                if isinstance(geometry, dict) and "coordinates" in geometry:
-                    route_geometry = geometry["coordinates"]
-                elif isinstance(geometry, str):
-                    # Encoded polyline - decode it
-                    print("⚠️ Got encoded polyline, attempting to decode...")
-                    try:
-                        import polyline
-                        # polyline.decode returns [(lat, lng), ...]
-                        decoded = polyline.decode(geometry)
-                        # Convert to GeoJSON format [(lng, lat), ...]
-                        route_geometry = [[lng, lat] for lat, lng in decoded]
-                    except ImportError:
-                        print("❌ polyline module not installed. Install: pip install polyline")
-                        route_geometry = []
-                
-                summary = route.get("summary", {})
-                distance_meters = summary.get("distance", 0)
-        
-        else:
-            print(f"❌ Unknown response format. Keys: {list(route_data.keys())}")
-            return JsonResponse(
-                {
-                    "status": "error",
-                    "message": "Unexpected ORS response format",
-                    "ors_response_keys": list(route_data.keys()),
-                    "sample_response": json.dumps(route_data)[:500]
-                },
-                status=500
-            )
-        
-        if not route_geometry:
-            print("❌ No route geometry extracted")
-            return JsonResponse(
-                {"status": "error", "message": "Could not extract route geometry"},
-                status=500
-            )
-        
-        print(f"✅ Geometry extracted: {len(route_geometry)} points")
-        if route_geometry:
-            print(f"   First point: {route_geometry[0]}")
-            print(f"   Last point: {route_geometry[-1]}")
-        
-        print(f"📏 Distance: {distance_meters} meters")
-        
-        # 5. Distance & fuel math
-        distance_miles = round(distance_meters * 0.000621371, 2)
-        gallons_needed = round(distance_miles / 10, 2)
-        
-        print(f"📏 Distance: {distance_miles} miles")
-        print(f"⛽ Gallons needed: {gallons_needed}")
-        
-        # 6. Fuel stops
-        recommended_stops = best_fuel_stops(route_geometry)
-        print(f"🛑 Fuel stops found: {len(recommended_stops)}")
-        
-        if recommended_stops:
-            avg_price = sum(stop["fuel_price"] for stop in recommended_stops) / len(recommended_stops)
-            avg_price = round(avg_price, 2)
-            print(f"💰 Fuel stops: {recommended_stops}")
-        else:
-            avg_price = 0
-            print("⚠️ No fuel stops found")
-        
-        total_fuel_cost = round(avg_price * gallons_needed, 2)
-        
-        print(f"💰 Avg fuel price: ${avg_price}")
-        print(f"💵 Total fuel cost: ${total_fuel_cost}")
-        print("="*60 + "\n")
-        
-        # 7. Final response
-        return JsonResponse(
-            {
+                cell["fuel_cost"] = round(plan.trip_cost, 2)
+            except (RouteNotCoverable, PlanningOverloaded) as e:
+                cell["error"] = str(e)
+            result.append(cell)
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(rows))))
+    try:
+        futures = {
+            executor.submit(contextvars.copy_context().run, cells, origins[members[0]]): members
+            for members in rows.values()
+        }
+        matrix = [None] * len(origins)
+        for future in as_completed(futures):
+            row = future.result()
+            for i in futures[future]:
+                matrix[i] = row
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return matrix, len(rows)
+
+
+@csrf_exempt
+def calculate_cost_matrix(request):
+    """
+    Fuel cost between many depots and customers.
+
+    Body: {"origins": [[lng, lat], ...], "destinations": [[lng, lat], ...],
+           "vehicle": {"mpg": ..., "range_miles": ..., ...}}
+    Returns N x M matrices of fuel_cost, distance_miles and duration_minutes
+    (null where a cell failed, see errors).
+    """
+    if request.method != "POST":
+        return error_response("Only POST requests allowed", 405)
+
+    try:
+        started = time.perf_counter()
+        with span("parse"):
+            data, error = load_json_body(request.body)
+            if error:
+                return error
+            origins, message = _point_list(data.get("origins"), "origins")
+            if message:
+                return error_response(message, 400)
+            destinations, message = _point_list(data.get("destinations"), "destinations")
+            if message:
+                return error_response(message, 400)
+            max_cells = getattr(settings, "ROUTE_MATRIX_MAX_CELLS", 2500)
+            if len(origins) * len(destinations) > max_cells:
+                return error_response(f"At most {max_cells} origin-destination pairs per matrix", 400)
+            vehicle = data.get("vehicle") or {}
+            if not isinstance(vehicle, dict):
+                return error_response("vehicle must be an object", 400)
+            params, message = parse_route_params({"start": origins[0], "end": destinations[0]}, vehicle)
+            if message:
+                return error_response(message, 400)
+
+        matrix, unique_origins = cost_matrix(
+            origins, destinations, params, getattr(settings, "ROUTE_BATCH_CONCURRENCY", 8),
+        )
+        errors = [
+            {"origin": i, "destination": j, "message": cell["error"]}
+            for i, row in enumerate(matrix) for j, cell in enumerate(row) if "error" in cell
+        ]
+        with span("serialize"):
+            return JSONBytesResponse({
                 "status": "success",
-                "route_distance_miles": distance_miles,
-                "total_fuel_cost": total_fuel_cost,
-                "map_route": route_geometry[:10] if route_geometry else [],  # First 10 points only
-                "recommended_stops": recommended_stops,
+                "fuel_cost": [[cell.get("fuel_cost") for cell in row] for row in matrix],
+                "distance_miles": [[cell.get("distance_miles") for cell in row] for row in matrix],
+                "duration_minutes": [[cell.get("duration_minutes") for cell in row] for row in matrix],
+                "errors": errors,
                 "debug_info": {
-                    "geometry_points": len(route_geometry),
-                    "avg_fuel_price": avg_price,
-                    "gallons_needed": gallons_needed,
-                    "distance_meters": distance_meters,
-                    "format_detected": "geojson" if "features" in route_data else "default"
-                }
-            },
-            status=200
-        )
-        
+                    "origins": len(origins),
+                    "destinations": len(destinations),
+                    "unique_origins": unique_origins,
+                    "routes_cached": sum(cell.get("cached", False) for row in matrix for cell in row),
+                    "backend": get_routing_backend().name,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                },
+            })
+
     except Exception as e:
-        print(f"💥 Unhandled exception: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        return JsonResponse(
-            {
-                "status": "error",
-                "message": f"Internal server error: {str(e)}",
-                "debug": "Check server logs for details"
-            },
-            status=500
-        )
\ No newline at end of file
+        return internal_error_response(e)
+
+
+def upstream_status(request):
+    """
+    Routing backend health: ORS circuit breaker, rate limiter, request
+    coalescing and route cache counters for this process.
+    """
+    cache = get_route_cache()
+    return JSONBytesResponse({
+        "backend": get_routing_backend().name,
+        "ors": get_ors_guard().stats(),
+        "route_cache": cache.stats() if cache else None,
+    })